@@ -0,0 +1,276 @@
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只支持单进程写日志
+    fcntl = None
+
+# 活动日志配置（可通过环境变量覆盖）
+ACTIVITY_LOG_FILE = Path(os.getenv("ACTIVITY_LOG_FILE", Path("logs") / "activity.log"))
+ACTIVITY_LOG_MAX_BYTES = int(os.getenv("ACTIVITY_LOG_MAX_BYTES", 50 * 1024 * 1024))  # 单个日志文件的大小上限，超过时轮转
+ACTIVITY_LOG_ROTATE_INTERVAL = int(os.getenv("ACTIVITY_LOG_ROTATE_INTERVAL", 24 * 60 * 60))  # 按时间轮转的周期（秒），默认每天（本地时间零点），0表示不按时间轮转
+ACTIVITY_LOG_BACKUPS = int(os.getenv("ACTIVITY_LOG_BACKUPS", 14))  # 保留的已轮转（gzip压缩）日志文件数
+ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv("ACTIVITY_LOG_QUEUE_SIZE", 10000))  # 等待写入的最大条数，队列满时丢弃新日志而不阻塞请求
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", 500))  # 每次写入的最大条数
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", 1))  # 最长写入间隔（秒）
+# 高频事件的采样率，格式 "事件=比例,事件=比例"；未列出的事件全部记录
+ACTIVITY_LOG_SAMPLE_RATES = os.getenv("ACTIVITY_LOG_SAMPLE_RATES", "File list requested=0.1")
+
+# 每条日志固定包含的字段（缺失的字段为null）
+LOG_FIELDS = ("ts", "level", "event", "user", "ip", "file_id", "filename", "downloads", "detail", "pid", "sample_rate")
+
+
+def parse_sample_rates(value: str) -> dict:
+    """解析 ACTIVITY_LOG_SAMPLE_RATES，忽略格式错误的项"""
+    rates = {}
+    for item in value.split(","):
+        event, sep, rate = item.rpartition("=")
+        if not sep or not event.strip():
+            continue
+        try:
+            rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+def _period(timestamp: float, interval: int) -> int:
+    """时间所在的轮转周期（按本地时间对齐，每天轮转时在零点切换）"""
+    return int((timestamp + time.localtime(timestamp).tm_gmtoff) // interval)
+
+
+class ActivityLog:
+    """
+    JSON Lines 格式的活动日志，异步批量写入
+
+    请求中调用 log() 只把记录放入内存队列（队列满时丢弃并计数，不会阻塞请求），
+    由后台线程每 ACTIVITY_LOG_FLUSH_INTERVAL 秒或攒够 ACTIVITY_LOG_BATCH_SIZE 条后一次性写入。
+    文件超过 ACTIVITY_LOG_MAX_BYTES 或进入新的时间周期时轮转，旧文件用gzip压缩，只保留 ACTIVITY_LOG_BACKUPS 个。
+
+    多个进程可以写同一个日志文件：每批日志用一次 O_APPEND 写入，写入和轮转都在文件锁内进行，
+    写入前检查文件是否已被其他进程轮转，是则重新打开。
+    """
+
+    def __init__(
+        self,
+        path=ACTIVITY_LOG_FILE,
+        max_bytes=ACTIVITY_LOG_MAX_BYTES,
+        rotate_interval=ACTIVITY_LOG_ROTATE_INTERVAL,
+        backups=ACTIVITY_LOG_BACKUPS,
+        queue_size=ACTIVITY_LOG_QUEUE_SIZE,
+        batch_size=ACTIVITY_LOG_BATCH_SIZE,
+        flush_interval=ACTIVITY_LOG_FLUSH_INTERVAL,
+        sample_rates=None
+    ):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rates = parse_sample_rates(ACTIVITY_LOG_SAMPLE_RATES) if sample_rates is None else sample_rates
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.rotations = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._fd = None
+        self._lock_fd = None
+
+    def log(self, event, user=None, ip=None, file_id=None, filename=None, downloads=None, detail=None,
+            level="INFO", ts=None):
+        """记录一条活动日志（只放入队列，不做文件I/O）"""
+        rate = self.sample_rates.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            return
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((ts or time.time(), level, event, user, ip, file_id, filename, downloads, detail, rate))
+        except queue.Full:
+            self.dropped += 1
+
+    # ---- 后台写入线程 ----
+
+    def start(self):
+        """启动后台写入线程（第一次记录日志时自动启动）"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="activity-log", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """写入队列中剩余的日志并停止后台线程（在应用关闭和进程退出时调用）"""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    # 不能再写入活动日志，直接输出到标准错误
+                    print(f"Failed to write activity log: {e}", file=sys.stderr, flush=True)
+        self._close()
+
+    def _format(self, item) -> str:
+        ts, level, event, user, ip, file_id, filename, downloads, detail, rate = item
+        record = dict(zip(LOG_FIELDS, (
+            datetime.fromtimestamp(ts).astimezone().isoformat(timespec="milliseconds"),
+            level, event, user, ip, file_id, filename, downloads, detail, os.getpid(), rate
+        )))
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+    def _write_batch(self, batch):
+        data = ("\n".join(self._format(item) for item in batch) + "\n").encode("utf-8")
+        rotated = None
+        self._acquire_lock()
+        try:
+            self._reopen_if_rotated()
+            if self._should_rotate(len(data)):
+                rotated = self._rotate()
+            os.write(self._fd, data)
+        finally:
+            self._release_lock()
+        self.written += len(batch)
+        if rotated is not None:
+            # 压缩在锁外进行，轮转后没有进程会再写入旧文件
+            self._compress(rotated)
+
+    def _acquire_lock(self):
+        if fcntl is None:
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(f"{self.path}.lock", os.O_WRONLY | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _release_lock(self):
+        if fcntl is not None and self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _close(self):
+        for name in ("_fd", "_lock_fd"):
+            fd = getattr(self, name)
+            if fd is not None:
+                os.close(fd)
+                setattr(self, name, None)
+
+    def _reopen_if_rotated(self):
+        """文件不存在或已被其他进程轮转（inode不同）时重新打开"""
+        if self._fd is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._fd).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+        self._open()
+
+    def _should_rotate(self, incoming: int) -> bool:
+        stat = os.fstat(self._fd)
+        if stat.st_size == 0:
+            return False
+        if self.max_bytes and stat.st_size + incoming > self.max_bytes:
+            return True
+        # 文件最后一次写入在上一个周期，说明这是新周期的第一批日志
+        now = time.time()
+        return bool(self.rotate_interval) and _period(stat.st_mtime, self.rotate_interval) != _period(now, self.rotate_interval)
+
+    def _rotate(self):
+        rotated = Path(f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.{os.getpid()}")
+        os.close(self._fd)
+        self._fd = None
+        try:
+            os.replace(self.path, rotated)
+        except OSError:
+            # 例如 Windows 上文件被其他进程占用，暂不轮转
+            rotated = None
+        self._open()
+        if rotated is not None:
+            self.rotations += 1
+        return rotated
+
+    def _compress(self, rotated: Path):
+        try:
+            with open(rotated, "rb") as src, gzip.open(f"{rotated}.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+            # 按文件名（包含轮转时间）删除最旧的压缩日志
+            archives = sorted(glob.glob(f"{glob.escape(str(self.path))}.*.gz"))
+            for old in archives[:max(len(archives) - self.backups, 0)]:
+                os.remove(old)
+        except OSError as e:
+            # 写线程中不能再通过 logging 写入活动日志，直接输出到标准错误
+            print(f"Failed to compress rotated activity log {rotated}: {e}", file=sys.stderr, flush=True)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "rotations": self.rotations,
+        }
+
+
+class ActivityLogHandler(logging.Handler):
+    """把标准 logging 的记录（错误、诊断信息）也写入活动日志，同样不阻塞调用方"""
+
+    def __init__(self, activity_log, level=logging.NOTSET):
+        super().__init__(level)
+        self.activity_log = activity_log
+
+    def emit(self, record):
+        try:
+            detail = self.formatException(record.exc_info) if record.exc_info else None
+            self.activity_log.log(record.getMessage(), detail=detail, level=record.levelname, ts=record.created)
+        except Exception:
+            self.handleError(record)
+
+    def formatException(self, exc_info):
+        return logging.Formatter().formatException(exc_info)
+
+
+activity_log = ActivityLog()
+atexit.register(activity_log.stop)
@@ -0,0 +1,363 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from metrics import RouteResolver, admission_queue_wait_seconds, admission_rejected_total
+
+# 准入控制配置（可通过环境变量覆盖）
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")  # 是否启用并发限制和限流
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", 100000))  # 每个限流器最多记录的IP/用户数，超出时清理已回满的令牌桶
+# 错误的下载码按IP计数，防止穷举4位下载码（默认每分钟12次，允许连续猜错10次）
+DOWNLOAD_CODE_RATE = float(os.getenv("DOWNLOAD_CODE_RATE", 0.2))
+DOWNLOAD_CODE_BURST = float(os.getenv("DOWNLOAD_CODE_BURST", 10))
+
+# 需要准入控制的路由：(方法, 路由模板) -> 路由类别
+ROUTE_CLASSES = {
+    ("POST", "/api/files/upload"): "upload",
+    ("POST", "/api/files/instant"): "upload",
+    ("PUT", "/api/uploads/{upload_id}/chunks/{chunk_index}"): "upload",
+    ("GET", "/api/files/{file_id}"): "download",
+    ("POST", "/api/files/archive"): "download",
+    ("GET", "/api/files/{file_id}/preview"): "preview",
+    ("GET", "/api/files/{file_id}/preview/text"): "preview",
+    ("GET", "/api/files/{file_id}/thumbnail"): "thumbnail",
+    ("GET", "/api/events"): "events",
+    ("POST", "/api/login"): "auth",
+    ("POST", "/api/register"): "auth",
+}
+
+# 每类路由的默认限制，可以用 ADMISSION_<类别> 环境变量覆盖其中的部分项，如 ADMISSION_UPLOAD="concurrency=4,ip_rate=1"
+#   concurrency: 同时处理的请求数（包括发送响应体的时间），0表示不限制
+#   queue: 超出并发数时最多排队等待的请求数，队列已满时立即返回503
+#   timeout: 排队等待的最长秒数，超时返回503
+#   retry_after: 返回503时建议客户端等待的秒数
+#   ip_rate/ip_burst、user_rate/user_burst: 按客户端IP、按登录用户的令牌桶（每秒补充的请求数/桶容量），rate为0表示不限流
+DEFAULT_ROUTE_LIMITS = {
+    "upload": dict(concurrency=8, queue=16, timeout=10, retry_after=5,
+                   ip_rate=10, ip_burst=50, user_rate=10, user_burst=50),
+    "download": dict(concurrency=64, queue=128, timeout=10, retry_after=2,
+                     ip_rate=20, ip_burst=100, user_rate=20, user_burst=100),
+    "preview": dict(concurrency=8, queue=32, timeout=15, retry_after=5,
+                    ip_rate=5, ip_burst=30, user_rate=5, user_burst=30),
+    "thumbnail": dict(concurrency=32, queue=256, timeout=15, retry_after=2,
+                      ip_rate=50, ip_burst=200, user_rate=50, user_burst=200),
+    # 事件流的并发数即每个进程最多保持的连接数，不排队；限流防止客户端反复重连
+    "events": dict(concurrency=10000, queue=0, timeout=0, retry_after=5,
+                   ip_rate=1, ip_burst=20, user_rate=1, user_burst=20),
+    "auth": dict(concurrency=4, queue=32, timeout=10, retry_after=2,
+                 ip_rate=1, ip_burst=10, user_rate=0, user_burst=0),
+}
+
+
+def load_route_limits(defaults=DEFAULT_ROUTE_LIMITS) -> Dict[str, dict]:
+    """读取每类路由的限制，ADMISSION_<类别> 中给出的项覆盖默认值"""
+    limits = {}
+    for route_class, default in defaults.items():
+        config = dict(default)
+        spec = os.getenv(f"ADMISSION_{route_class.upper()}", "")
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, value = item.partition("=")
+            name = name.strip()
+            if name not in config:
+                raise ValueError(f"Unknown admission setting {name!r} for {route_class}")
+            config[name] = float(value)
+        limits[route_class] = config
+    return limits
+
+
+class RateLimiter:
+    """
+    按key（客户端IP、用户名）的令牌桶限流
+
+    每个key一个令牌桶，每秒补充 rate 个令牌，最多积累 burst 个，每个请求消耗一个。
+    只在事件循环中使用，不需要加锁。记录的key超过 max_keys 时删除已经回满的桶（与新建的桶等价）。
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = ADMISSION_MAX_KEYS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [令牌数, 更新时间]
+
+    def acquire(self, key, now: Optional[float] = None, count: int = 1) -> float:
+        """
+        取 count 个令牌，令牌不足时一个也不取
+
+        Returns:
+            0 表示允许；否则为还需等待的秒数
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[key] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= count:
+            bucket[0] = tokens - count
+            return 0
+        bucket[0] = tokens
+        return (count - tokens) / self.rate
+
+    def wait_time(self, key, now: Optional[float] = None, count: int = 1) -> float:
+        """
+        不取令牌，只检查当前是否有 count 个令牌
+
+        Returns:
+            0 表示足够；否则为还需等待的秒数
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        return 0 if tokens >= count else (count - tokens) / self.rate
+
+    def consume(self, key, count: int = 1, now: Optional[float] = None):
+        """取 count 个令牌，不足时取完为止（记录已经发生的请求，不拒绝）"""
+        if now is None:
+            now = time.monotonic()
+        if self.acquire(key, now, count):
+            self._buckets[key][0] = 0
+
+    def _prune(self, now):
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if bucket[0] + (now - bucket[1]) * self.rate < self.burst
+        }
+        if len(self._buckets) >= self.max_keys:
+            # 仍然太多（大量不同来源同时被限流），整体清空，宁可放过也不无限占用内存
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimiter:
+    """
+    带有限等待队列的并发限制
+
+    同时处理的请求达到 limit 时，后来的请求按到达顺序排队，释放的名额直接交给队首；
+    队列已满或等待超过 timeout 秒时 acquire 返回 False，调用方应立即拒绝请求，
+    而不是让请求无限堆积、拖慢所有请求。
+    """
+
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size or self.timeout <= 0:
+            return False
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        expire = loop.call_later(self.timeout, self._expire, waiter)
+        try:
+            # 结果为 True 表示 release 已把名额交给本请求，False 表示等待超时
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                # 名额已经交过来，但请求被取消了，交给下一个等待者
+                self.release()
+            raise
+        finally:
+            expire.cancel()
+            if not waiter.done() or waiter.cancelled():
+                self._remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # 名额直接转交，active 不变
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def _expire(self, waiter):
+        if not waiter.done():
+            waiter.set_result(False)
+            self._remove(waiter)
+
+    def _remove(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class RouteAdmission:
+    """一类路由的并发限制和按IP、按用户的限流"""
+
+    def __init__(self, route_class: str, concurrency=0, queue=0, timeout=0, retry_after=1,
+                 ip_rate=0, ip_burst=0, user_rate=0, user_burst=0):
+        self.route_class = route_class
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.concurrency = ConcurrencyLimiter(int(concurrency), int(queue), timeout) if concurrency > 0 else None
+        self.ip_limiter = RateLimiter(ip_rate, ip_burst) if ip_rate > 0 else None
+        self.user_limiter = RateLimiter(user_rate, user_burst) if user_rate > 0 else None
+
+    def check_rate(self, client_ip: str, username: Optional[str]) -> float:
+        """按IP和用户各取一个令牌，返回还需等待的秒数（0表示允许）"""
+        now = time.monotonic()
+        wait = 0
+        if self.ip_limiter is not None:
+            wait = self.ip_limiter.acquire(client_ip, now)
+        if not wait and self.user_limiter is not None and username:
+            wait = self.user_limiter.acquire(username, now)
+        return wait
+
+
+class AdmissionControl:
+    """所有路由类别的准入控制状态，供中间件使用和 /metrics 读取"""
+
+    def __init__(self, limits: Optional[Dict[str, dict]] = None, route_classes=ROUTE_CLASSES):
+        self.route_classes = route_classes
+        self.routes = {
+            route_class: RouteAdmission(route_class, **config)
+            for route_class, config in (limits if limits is not None else load_route_limits()).items()
+        }
+        self.download_code_limiter = RateLimiter(DOWNLOAD_CODE_RATE, DOWNLOAD_CODE_BURST) if DOWNLOAD_CODE_RATE > 0 else None
+
+    def download_code_wait(self, client_ip: str, count: int = 1) -> float:
+        """
+        该IP是否还可以尝试 count 个下载码（不取令牌，只有错误的下载码才通过 charge_download_codes 计数）
+
+        Returns:
+            0 表示允许；否则为还需等待的秒数
+        """
+        if self.download_code_limiter is None or count <= 0:
+            return 0
+        return self.download_code_limiter.wait_time(client_ip, count=count)
+
+    def charge_download_codes(self, client_ip: str, count: int = 1):
+        """按IP为 count 个错误的下载码各取一个令牌（每个错误的下载码都是一次失败的猜测）"""
+        if self.download_code_limiter is not None and count > 0:
+            self.download_code_limiter.consume(client_ip, count)
+
+    def stats(self):
+        return {
+            route_class: {
+                "active": route.concurrency.active if route.concurrency else 0,
+                "queued": route.concurrency.queued if route.concurrency else 0,
+                "tracked_keys": (len(route.ip_limiter) if route.ip_limiter else 0)
+                + (len(route.user_limiter) if route.user_limiter else 0),
+            }
+            for route_class, route in self.routes.items()
+        }
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def check_download_code_rate(client_ip: str, count: int = 1):
+    """
+    在接口中检查请求体里的下载码（如打包下载的 download_codes）是否还可以尝试，查询参数中的下载码由中间件检查
+
+    只检查不计数，错误的下载码由 charge_download_code_failures 计数。
+
+    Raises:
+        HTTPException: 该IP错误的下载码过多时返回429
+    """
+    if not ADMISSION_ENABLED:
+        return
+    wait = admission.download_code_wait(client_ip, count)
+    if wait:
+        admission_rejected_total.inc(route_class="download_code", reason="rate_limited")
+        raise HTTPException(status_code=429, detail="请求过于频繁，请稍后重试",
+                            headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+def charge_download_code_failures(client_ip: str, count: int = 1):
+    """记录该IP提供的 count 个错误的下载码，正确的下载码不计数，持有下载码的访客可以正常翻页和分段下载"""
+    if ADMISSION_ENABLED:
+        admission.charge_download_codes(client_ip, count)
+
+
+def _bearer_token(request: Request) -> Optional[str]:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+
+class AdmissionMiddleware:
+    """
+    上传、下载、预览和登录注册的准入控制
+
+    在读取请求体之前（上传的内容还没有接收）依次检查：查询参数中携带下载码的请求（不论哪个路由），
+    该IP错误的下载码过多时直接拒绝（计数在接口的访问检查中进行，只计错误的下载码）；
+    按客户端IP和登录用户的令牌桶限流，超出时返回429；然后取得该类路由的并发名额，
+    名额用完时在有限的队列中等待，队列已满或等待超时返回503。两种拒绝都带有 Retry-After。
+    并发名额一直占用到响应体发送完毕，因此同时进行的下载、渲染和上传数都有上限，
+    过载时多出的请求被快速拒绝，已经接受的请求延迟保持稳定。
+    """
+
+    def __init__(self, app, router, client_ip: Callable[[Request], str],
+                 username: Callable[[Optional[str]], Optional[str]], control: "AdmissionControl" = None):
+        self.app = app
+        self.client_ip = client_ip
+        self.username = username
+        self.control = control or admission
+        self._route_for = RouteResolver(router)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route_class = self.control.route_classes.get((scope["method"], self._route_for(scope)))
+        route = self.control.routes.get(route_class) if route_class else None
+        request = Request(scope)
+
+        # 任何路由上携带下载码的请求（下载、预览、文件信息等），该IP猜错的下载码过多时在执行接口之前拒绝
+        if "download_code" in request.query_params:
+            client_ip = self.client_ip(request)
+            wait = self.control.download_code_wait(client_ip)
+            if wait:
+                admission_rejected_total.inc(route_class="download_code", reason="rate_limited")
+                return await _reject(429, "请求过于频繁，请稍后重试", wait)(scope, receive, send)
+        if route is None:
+            return await self.app(scope, receive, send)
+
+        client_ip = self.client_ip(request)
+        wait = route.check_rate(client_ip, self.username(_bearer_token(request)))
+        if wait:
+            admission_rejected_total.inc(route_class=route_class, reason="rate_limited")
+            return await _reject(429, "请求过于频繁，请稍后重试", wait)(scope, receive, send)
+
+        if route.concurrency is None:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        if not await route.concurrency.acquire():
+            admission_rejected_total.inc(route_class=route_class, reason="overloaded")
+            return await _reject(503, "服务器繁忙，请稍后重试", route.retry_after)(scope, receive, send)
+        admission_queue_wait_seconds.observe(time.perf_counter() - started, route_class=route_class)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route.concurrency.release()
+
+
+admission = AdmissionControl()
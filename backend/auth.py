@@ -1,22 +1,179 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from database import AsyncSessionLocal
 from models import User
 import logging
+import os
+import threading
+import time
 
 # 配置
 SECRET_KEY = "your-secret-key-here"  # 在生产环境中应该使用环境变量
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# 认证缓存配置
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))  # 最多缓存的token数
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))  # 缓存条目有效期（秒）
+AUTH_CACHE_SYNC_INTERVAL = float(os.getenv("AUTH_CACHE_SYNC_INTERVAL", 1))  # 检查其他进程失效通知的间隔（秒）
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login", auto_error=False)
 
+class AuthCache:
+    """
+    已验证token的进程内缓存（LRU + TTL）
+
+    缓存 token -> (用户ID, 用户名, token过期时间)，命中时既不解码JWT也不查询数据库。
+    本进程内的登录、注销、修改密码会立即使对应用户的条目失效；其他进程的变更通过
+    users.token_generation 感知：每次变更都把该用户的代数设为全局最大值+1，
+    每隔 AUTH_CACHE_SYNC_INTERVAL 秒用一条索引查询取出代数增大的用户并使其条目失效。
+
+    查询数据库验证token期间用户的会话可能恰好失效：查询之前用 begin_lookup 取得当前的失效序号，
+    put 时如果该用户在此之后失效过就不写入，已注销的token不会被写回缓存。
+    """
+
+    def __init__(self, max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL, sync_interval=AUTH_CACHE_SYNC_INTERVAL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_generation = None
+        self._next_sync = 0.0
+        # 失效序号：每次失效加一，记录每个用户最近一次失效时的序号；记录过多时清空，
+        # 并把 _invalidated_floor 提到当前序号，此前开始的查询都视为已失效
+        self._invalidations = 0
+        self._invalidated = {}
+        self._invalidated_floor = 0
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[3] < now or entry[2] < time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry
+
+    def begin_lookup(self) -> int:
+        """查询数据库验证token之前调用，返回传给 put 的失效序号"""
+        with self._lock:
+            return self._invalidations
+
+    def put(self, token, user_id, username, token_exp, lookup=None):
+        """
+        缓存已验证的token
+
+        Args:
+            lookup: begin_lookup 的返回值；该用户在此之后失效过时不写入
+        """
+        with self._lock:
+            if lookup is not None and max(self._invalidated_floor, self._invalidated.get(user_id, 0)) > lookup:
+                return
+            self._entries[token] = (user_id, username, token_exp, time.monotonic() + self.ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _record_invalidation(self, user_id=None):
+        self._invalidations += 1
+        if user_id is None or len(self._invalidated) >= self.max_size:
+            self._invalidated.clear()
+            self._invalidated_floor = self._invalidations
+        if user_id is not None:
+            self._invalidated[user_id] = self._invalidations
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._record_invalidation(user_id)
+            for token in [t for t, entry in self._entries.items() if entry[0] == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._record_invalidation()
+            self._entries.clear()
+
+    async def sync(self, db: AsyncSession):
+        """检查其他进程是否有用户的会话发生变化（到达同步间隔时才查询）"""
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        with self._lock:
+            if now < self._next_sync:
+                return
+            self._next_sync = now + self.sync_interval
+            last_generation = self._last_generation
+
+        if last_generation is None:
+            # 首次同步只记录当前的最大代数
+            changed = []
+            latest = await db.scalar(select(func.max(User.token_generation))) or 0
+        else:
+            changed = (await db.execute(
+                select(User.id, User.token_generation).where(User.token_generation > last_generation)
+            )).all()
+            latest = max([generation for _, generation in changed], default=last_generation)
+
+        for user_id, _ in changed:
+            self.invalidate_user(user_id)
+        with self._lock:
+            self._last_generation = max(latest, self._last_generation or 0)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+auth_cache = AuthCache()
+
+
+async def invalidate_user_sessions(db: AsyncSession, user: User):
+    """
+    用户的会话发生变化（登录、注销、修改密码）时调用
+
+    本进程的缓存立即失效，并把用户的 token_generation 设为全局最大值+1，通知其他进程。
+    读取最大值和写入在同一条UPDATE中完成，SQLite同时只有一个写事务，代数按提交顺序严格递增，
+    并发的两次失效不会得到相同的代数（否则同步游标已经越过该值的进程会错过后一次失效）。
+    调用方负责提交。
+    """
+    users_table = User.__table__
+    latest = users_table.alias("latest")
+    # 通过 execute 执行，取得进程内的写锁（scalar 不经过 SerializedAsyncSession.execute）
+    result = await db.execute(
+        update(users_table)
+        .where(users_table.c.id == user.id)
+        .values(token_generation=select(func.coalesce(func.max(latest.c.token_generation), 0) + 1).scalar_subquery())
+        .returning(users_table.c.token_generation)
+    )
+    generation = result.scalar_one()
+    # 数据库中已经是新值，只更新对象上的属性，提交时不再重复写入
+    set_committed_value(user, "token_generation", generation)
+    auth_cache.invalidate_user(user.id)
+
+
 # 密码处理
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -25,7 +182,7 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 # Token处理
-def create_access_token(data: dict, db: Session, user: User, expires_delta: Optional[timedelta] = None):
+async def create_access_token(data: dict, db: AsyncSession, user: User, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
@@ -34,43 +191,73 @@ def create_access_token(data: dict, db: Session, user: User, expires_delta: Opti
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     
-    # 更新用户的active_token
+    # 更新用户的active_token，旧的token随之失效
     user.active_token = encoded_jwt
-    db.commit()
+    await invalidate_user_sessions(db, user)
+    await db.commit()
     
     return encoded_jwt
 
 # 获取当前用户
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def logout_user(db: Session, user: User):
+async def logout_user(db: AsyncSession, user: User):
     user.active_token = None
-    db.commit()
+    await invalidate_user_sessions(db, user)
+    await db.commit()
+
+def _attach_cached_user(db: AsyncSession, user_id, username, token):
+    """把缓存中的用户关联到当前会话而不查询数据库，未缓存的属性在访问时才加载"""
+    user = db.identity_map.get((User, (user_id,), None))
+    if user is not None:
+        return user
+    user = User(id=user_id, username=username, active_token=token)
+    make_transient_to_detached(user)
+    db.add(user)
+    return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     if not token:
         return None
 
+    await auth_cache.sync(db)
+    cached = auth_cache.get(token)
+    if cached:
+        user_id, username, _, _ = cached
+        return _attach_cached_user(db, user_id, username, token)
+
+    lookup = auth_cache.begin_lookup()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             return None
             
-        user = db.query(User).filter(User.username == username).first()
+        user = await db.scalar(select(User).where(User.username == username))
         if user is None or user.active_token != token:
             return None
         
+        auth_cache.put(token, user.id, user.username, payload.get("exp", 0), lookup)
         return user
     except JWTError as e:
         logging.error(f"JWTError: {e}")
         return None
 
+def token_username(token: Optional[str]) -> Optional[str]:
+    """
+    只校验签名和有效期，从token中取出用户名，不查询数据库（限流等只需要区分用户的场景使用）
+
+    已注销的token仍会返回用户名，不能用于鉴权。
+    """
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 def check_file_access_permission(user: Optional[User], file_info, download_code: Optional[str] = None):
     """
     检查用户是否有权限访问文件内容（下载或预览）
@@ -0,0 +1,5 @@
+import os
+
+# 基准测试在同一个IP、少量用户下发出大量请求，默认关闭准入控制（需要在导入 main、启动服务进程之前设置），
+# benchmarks.admission 会自行开启
+os.environ.setdefault("ADMISSION_ENABLED", "false")
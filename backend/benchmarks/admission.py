@@ -0,0 +1,136 @@
+"""
+准入控制过载测试
+
+分别在开启和关闭准入控制的 uvicorn 进程上，同时发出 --burst 个文本预览请求（每个请求预览不同的文件，
+都需要渲染）和 --burst 个上传请求，报告每种结果的请求数、被接受请求的p50/p95延迟、被拒绝请求的p95延迟
+（应当很快）、全部完成的耗时和服务进程的峰值RSS。为了只测并发限制，过载测试中关闭按IP/用户的限流。
+最后用错误的下载码连续请求一个私密文件，报告被限流（429）之前能尝试的次数。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.admission --burst 100 --text-kb 200 --upload-mb 8
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.mixed_load import percentile  # noqa: E402
+from benchmarks.suite import free_port, make_text, register, upload, wait_until_ready  # noqa: E402
+from benchmarks.upload_rss import RssSampler  # noqa: E402
+
+KB = 1024
+MB = 1024 * 1024
+
+
+async def burst(client, requests):
+    """同时发出一组请求，返回 [(状态码, 耗时ms)]"""
+    async def one(method, url, kwargs):
+        started = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kwargs)
+            status = resp.status_code
+        except Exception as e:
+            status = type(e).__name__
+        return status, (time.perf_counter() - started) * 1000
+
+    return await asyncio.gather(*(one(method, url, kwargs) for method, url, kwargs in requests))
+
+
+def report(label, results, elapsed, peak):
+    statuses = Counter(status for status, _ in results)
+    accepted = [ms for status, ms in results if status == 200]
+    rejected = [ms for status, ms in results if status in (429, 503)]
+    print(f"  {label:<8} {dict(sorted(statuses.items(), key=str))}  wall {elapsed:6.1f}s  "
+          f"accepted p50={percentile(accepted, 50):7.0f}ms p95={percentile(accepted, 95):7.0f}ms  "
+          f"rejected p95={percentile(rejected, 95):6.0f}ms  peak RSS {peak / MB:.0f} MB")
+
+
+async def run_server(args, work_dir, enabled):
+    import httpx
+
+    env = dict(os.environ, ADMISSION_ENABLED="true" if enabled else "false")
+    for route_class in ("PREVIEW", "UPLOAD"):
+        env[f"ADMISSION_{route_class}"] = "ip_rate=0,user_rate=0"
+    server_dir = tempfile.mkdtemp(dir=work_dir)
+    env["STORAGE_ROOT"] = os.path.join(server_dir, "uploads")
+    env["PREVIEW_CACHE_DIR"] = os.path.join(server_dir, "preview_cache")
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=server_dir, env=env,
+    )
+    limits = httpx.Limits(max_connections=args.burst * 2, max_keepalive_connections=args.burst * 2)
+    print(f"admission {'enabled' if enabled else 'disabled'}:")
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300, limits=limits) as client:
+            await wait_until_ready(client, process)
+            headers = await register(client, f"admission{int(time.time())}")
+            ids = []
+            for i in range(args.burst):
+                # 每个文件内容不同，预览都需要渲染
+                data = f"file {i}\n".encode() + make_text(args.text_kb * KB).rsplit(b"\n", 1)[0]
+                ids.append(await upload(client, headers, f"text_{i}.txt", data, "text/plain"))
+
+            scenarios = {
+                "preview": [("GET", f"/api/files/{file_id}/preview", {"headers": headers}) for file_id in ids],
+                "upload": [
+                    ("POST", "/api/files/upload", {
+                        "headers": headers,
+                        "files": {"file": (f"burst_{i}.zip", os.urandom(args.upload_mb * MB), "application/zip")},
+                    })
+                    for i in range(args.burst)
+                ],
+            }
+            for label, requests in scenarios.items():
+                sampler = RssSampler(pid=process.pid)
+                sampler.start()
+                started = time.perf_counter()
+                results = await burst(client, requests)
+                elapsed = time.perf_counter() - started
+                report(label, results, elapsed, sampler.stop())
+
+            if enabled:
+                resp = await client.post("/api/files/upload", headers=headers, data={"is_private": "true", "download_code": "1234"},
+                                         files={"file": ("secret.txt", b"secret", "text/plain")})
+                resp.raise_for_status()
+                secret_id = resp.json()["file_id"]
+                statuses = Counter()
+                for code in range(args.guesses):
+                    resp = await client.get(f"/api/files/{secret_id}", params={"download_code": f"{code + 5000:04d}"})
+                    statuses[resp.status_code] += 1
+                print(f"  code guessing: {args.guesses} attempts -> {dict(statuses)}  "
+                      f"(Retry-After {resp.headers.get('retry-after')}s)")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+async def run(args, work_dir):
+    for enabled in (True, False):
+        await run_server(args, work_dir, enabled)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="准入控制过载测试")
+    parser.add_argument("--burst", type=int, default=100, help="同时发出的预览请求数和上传请求数")
+    parser.add_argument("--text-kb", type=int, default=200, help="每个预览文本文件的大小（KB）")
+    parser.add_argument("--upload-mb", type=int, default=8, help="每个上传文件的大小（MB）")
+    parser.add_argument("--guesses", type=int, default=50, help="错误下载码的尝试次数")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="netdisk_admission_")
+    print(f"work dir: {work_dir}")
+    asyncio.run(run(args, work_dir))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,175 @@
+"""
+打包下载基准测试
+
+启动真实的 uvicorn 进程，上传 --files 个文件（一半为不再压缩的 .zip 随机内容，一半为按行分隔的 .txt 文本），
+先直接读取存储文件得到磁盘读取速度、逐个下载 .zip 文件得到HTTP传输速度，再通过 POST /api/files/archive 下载只含 .zip 的压缩包和混合压缩包，
+报告吞吐量、与磁盘读取速度之比和服务进程的峰值RSS（应与压缩包大小无关）。--verify 时保存压缩包并校验CRC。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.archive --files 50 --size-mb 8
+    python -m benchmarks.archive --files 10 --size-mb 1000 --verify   # 压缩包超过4GB，覆盖ZIP64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.suite import free_port, make_text, wait_until_ready  # noqa: E402
+from benchmarks.upload_rss import RssSampler, make_source_file  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def read_files(paths, chunk_size=MB):
+    """直接按块读取存储文件，返回字节数和耗时"""
+    total = 0
+    started = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+    return total, time.perf_counter() - started
+
+
+async def upload_files(client, headers, args, work_dir):
+    """上传测试文件，返回 [(文件ID, 文件名, 存储路径)]"""
+    from storage import hash_file
+    from storage_backend import blob_key, storage
+
+    uploaded = []
+    for i in range(args.files):
+        source = os.path.join(work_dir, "source")
+        if i % 2:
+            name = f"notes_{i}.txt"
+            with open(source, "wb") as f:
+                for _ in range(args.size_mb):
+                    f.write(make_text(MB))
+        else:
+            name = f"data_{i}.zip"
+            make_source_file(source, args.size_mb)
+        with open(source, "rb") as f:
+            resp = await client.post("/api/files/upload", headers=headers, files={"file": (name, f, "application/octet-stream")})
+        resp.raise_for_status()
+        uploaded.append((resp.json()["file_id"], name, storage.local_path(blob_key(hash_file(source)))))
+    os.remove(source)
+    return uploaded
+
+
+async def download_archive(client, headers, ids, server_pid, save_path=None):
+    import httpx
+
+    sampler = RssSampler(pid=server_pid)
+    sampler.start()
+    total = 0
+    started = time.perf_counter()
+    out = open(save_path, "wb") if save_path else None
+    try:
+        # 每次下载使用新连接：uvicorn 0.23 在复用的连接上发送耗时较长的响应时，上一个请求的keep-alive计时器会关闭连接
+        async with httpx.AsyncClient(base_url=client.base_url, timeout=None) as fresh, \
+                fresh.stream("POST", "/api/files/archive", headers=headers, json={"ids": ids}) as resp:
+            resp.raise_for_status()
+            content_length = resp.headers.get("content-length")
+            async for chunk in resp.aiter_raw():
+                total += len(chunk)
+                if out:
+                    out.write(chunk)
+    finally:
+        if out:
+            out.close()
+        peak = sampler.stop()
+    elapsed = time.perf_counter() - started
+    if content_length is not None and int(content_length) != total:
+        raise RuntimeError(f"Content-Length {content_length} but received {total} bytes")
+    return total, elapsed, peak, content_length
+
+
+async def run(args, work_dir):
+    import httpx
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=work_dir,
+    )
+    failed = False
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            await wait_until_ready(client, process)
+            resp = await client.post("/api/register", json={"username": f"archive{int(time.time())}", "password": "bench"})
+            resp.raise_for_status()
+            headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+            uploaded = await upload_files(client, headers, args, work_dir)
+            ids = [file_id for file_id, _, _ in uploaded]
+            try:
+                # 直接读取存储文件作为磁盘读取速度的参照（与下载一样命中页缓存）
+                size, elapsed = read_files([path for _, _, path in uploaded])
+                raw_speed = size / elapsed
+                print(f"raw read        {size / MB:9.0f} MB  {raw_speed / MB:8.0f} MB/s")
+
+                # 同样经过HTTP逐个下载这些文件，作为传输本身的上限
+                total = 0
+                started = time.perf_counter()
+                for file_id, name, _ in uploaded:
+                    if name.endswith(".zip"):
+                        async with httpx.AsyncClient(base_url=client.base_url, timeout=None) as fresh, \
+                                fresh.stream("GET", f"/api/files/{file_id}", headers=headers) as resp:
+                            resp.raise_for_status()
+                            async for chunk in resp.aiter_raw():
+                                total += len(chunk)
+                single_speed = total / (time.perf_counter() - started)
+                print(f"single download {total / MB:9.0f} MB  {single_speed / MB:8.0f} MB/s")
+
+                sets = {
+                    "stored only": [file_id for file_id, name, _ in uploaded if name.endswith(".zip")],
+                    "mixed": ids,
+                }
+                for label, selected in sets.items():
+                    save_path = os.path.join(work_dir, "archive.zip") if args.verify else None
+                    total, elapsed, peak, content_length = await download_archive(
+                        client, headers, selected, process.pid, save_path)
+                    speed = total / elapsed
+                    print(f"{label:<15} {total / MB:9.0f} MB  {speed / MB:8.0f} MB/s  "
+                          f"{speed / raw_speed:5.0%} of raw read  {speed / single_speed:5.0%} of single download  "
+                          f"peak server RSS {peak / MB:.0f} MB  "
+                          f"content-length {'yes' if content_length else 'no'}")
+                    if save_path:
+                        with zipfile.ZipFile(save_path) as archive:
+                            bad = archive.testzip()
+                            names = len(archive.namelist())
+                        os.remove(save_path)
+                        print(f"  verify: {names} entries, {'CRC error in ' + bad if bad else 'ok'}")
+                        failed = failed or bad is not None or names != len(selected)
+            finally:
+                await client.post("/api/files/bulk", headers=headers, json={"ids": ids, "action": "delete"})
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return 1 if failed else 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="打包下载基准测试")
+    parser.add_argument("--files", type=int, default=50, help="上传的文件数")
+    parser.add_argument("--size-mb", type=int, default=8, help="每个文件的大小（MB）")
+    parser.add_argument("--verify", action="store_true", help="保存压缩包并校验每个文件的CRC")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="netdisk_archive_")
+    print(f"work dir: {work_dir}")
+    sys.exit(asyncio.run(run(args, work_dir)))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,157 @@
+"""
+批量文件操作基准测试
+
+直接写数据库和存储目录初始化 N 个文件（部分文件共享同一份内容，覆盖引用计数），然后对全部文件依次执行
+POST /api/files/bulk 的 set_private、regenerate_code、set_public 和 delete，报告每个操作的耗时和吞吐量。
+--single 指定数量时，再用同样方式初始化一批文件，逐个调用 DELETE /api/files/{file_id} 删除作为对比。
+结束后检查存储文件和内容记录是否都已删除。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.bulk_ops --files 10000 --single 1000
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+ACTIONS = ("set_private", "regenerate_code", "set_public", "delete")
+
+
+def seed_files(user_id, count, shared_every, file_size):
+    """
+    直接插入文件和内容记录并写入存储文件
+
+    Args:
+        user_id: 文件所属用户
+        count: 文件数
+        shared_every: 每多少个文件共享同一份内容（1 表示内容各不相同）
+        file_size: 每个存储文件的字节数
+
+    Returns:
+        list: 文件ID
+    """
+    from sqlalchemy import insert, select
+
+    from database import SessionLocal
+    from models import Blob, FileInfo
+    from storage_backend import blob_key, storage
+
+    now = datetime.now()
+    prefix = f"bulk{time.time_ns()}"
+    blobs = {}
+    rows = []
+    for i in range(count):
+        data = f"{prefix}-{i // shared_every}".encode().ljust(file_size, b".")
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 not in blobs:
+            blobs[sha256] = {"sha256": sha256, "size": len(data), "ref_count": 0, "created_at": now}
+            staging = storage.staging_path(sha256)
+            staging.write_bytes(data)
+            storage.commit(staging, blob_key(sha256))
+        blobs[sha256]["ref_count"] += 1
+        rows.append({
+            "filename": f"{prefix}_{i}.txt", "filepath": blob_key(sha256), "upload_time": now,
+            "is_private": False, "file_type": "text/plain", "downloads": 0, "content_hash": sha256,
+            "file_size": len(data), "user_id": user_id,
+        })
+    with SessionLocal() as db:
+        db.execute(insert(Blob), list(blobs.values()))
+        db.execute(insert(FileInfo), rows)
+        db.commit()
+        names = [row["filename"] for row in rows]
+        ids = []
+        for start in range(0, len(names), 5000):
+            ids.extend(db.scalars(select(FileInfo.id).where(FileInfo.filename.in_(names[start:start + 5000]))))
+    return sorted(ids), list(blobs)
+
+
+def leftover(hashes):
+    """返回仍然存在的内容记录数和存储文件数"""
+    from sqlalchemy import func, select
+
+    from database import SessionLocal
+    from models import Blob
+    from storage_backend import blob_key, storage
+
+    with SessionLocal() as db:
+        rows = 0
+        for start in range(0, len(hashes), 5000):
+            rows += db.scalar(select(func.count()).select_from(Blob).where(Blob.sha256.in_(hashes[start:start + 5000])))
+    return rows, sum(storage.exists(blob_key(sha256)) for sha256 in hashes)
+
+
+async def run(args):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        username = f"bulk{int(time.time())}"
+        resp = await client.post("/api/register", json={"username": username, "password": "bench"})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        user_id = (await client.get("/api/user/me", headers=headers)).json()["id"]
+
+        started = time.perf_counter()
+        ids, hashes = seed_files(user_id, args.files, args.shared_every, args.file_size)
+        print(f"seeded {len(ids)} files ({len(hashes)} blobs) in {time.perf_counter() - started:.1f}s")
+
+        failed = 0
+        try:
+            for action in ACTIONS:
+                started = time.perf_counter()
+                resp = await client.post("/api/files/bulk", headers=headers, json={"ids": ids, "action": action})
+                elapsed = time.perf_counter() - started
+                resp.raise_for_status()
+                result = resp.json()
+                failed += result["failed"]
+                print(f"bulk {action:<16} {result['succeeded']:>6} ok {result['failed']:>4} failed  "
+                      f"{elapsed * 1000:8.0f}ms  {len(ids) / elapsed:10.0f} ids/s")
+        finally:
+            # 中途失败时也删除初始化的文件
+            await client.post("/api/files/bulk", headers=headers, json={"ids": ids, "action": "delete"})
+
+        if args.single:
+            single_ids, single_hashes = seed_files(user_id, args.single, args.shared_every, args.file_size)
+            hashes += single_hashes
+            started = time.perf_counter()
+            for file_id in single_ids:
+                resp = await client.delete(f"/api/files/{file_id}", headers=headers)
+                failed += resp.status_code != 200
+            elapsed = time.perf_counter() - started
+            print(f"single delete    {len(single_ids):>6} files      {elapsed * 1000:8.0f}ms  "
+                  f"{len(single_ids) / elapsed:10.0f} ids/s  (~{args.files * elapsed / len(single_ids):.1f}s "
+                  f"for {args.files})")
+
+        await asyncio.gather(*main.background_tasks, return_exceptions=True)
+        main.preview_pool.shutdown()
+
+    rows, paths = leftover(hashes)
+    print(f"leftover blobs: {rows} rows, {paths} files; failed items: {failed}")
+    return 1 if rows or paths or failed else 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="批量文件操作基准测试")
+    parser.add_argument("--files", type=int, default=10000, help="批量操作的文件数")
+    parser.add_argument("--shared-every", type=int, default=4, help="每多少个文件共享同一份内容")
+    parser.add_argument("--file-size", type=int, default=1024, help="每个存储文件的字节数")
+    parser.add_argument("--single", type=int, default=0, help="逐个删除对比的文件数，0表示不对比")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="netdisk_bulk_")
+    print(f"work dir: {work_dir}")
+    os.chdir(work_dir)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,241 @@
+"""
+响应压缩基准测试
+
+准备一组接近实际的数据：--files 个文件名、类型和大小各不相同的文件的列表JSON（通过接口上传后请求
+/api/files?limit=500 得到），以及访问日志、CSV表格、Python源码、中文文档和JSON导出五种各 --text-mb 的文本文件。
+
+1. 编码器：对每份数据按64KB分块流式压缩，报告每种已安装编码在不同级别下的压缩率、节省的字节比例
+   和单核压缩吞吐量（CPU时间）。
+2. 端到端：在进程内（httpx ASGI transport）分别用 identity 和每种编码（使用服务配置的级别）请求列表和下载文本文件，
+   报告实际发送的字节数和每个请求的CPU时间，两者之差即为压缩的代价。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.compression --files 300 --text-mb 4 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import sysconfig
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+KB = 1024
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * KB  # 与 FileResponse 每次发送的块大小相同
+
+# 各编码比较的压缩级别（服务实际使用的级别见 compression.py 的 COMPRESSION_LEVELS / COMPRESSION_STREAM_LEVELS）
+COMPARED_LEVELS = {"gzip": (1, 5, 9), "br": (1, 4, 9), "zstd": (1, 3, 9)}
+
+# 生成文件名和文本用的词汇
+NAME_WORDS = ("季度报告", "会议纪要", "合同", "预算", "项目计划", "发票", "简历", "产品手册", "测试报告", "周报",
+              "design", "notes", "invoice", "report", "backup", "photo", "scan", "draft", "final", "export")
+CHINESE_WORDS = ("系统", "用户", "文件", "上传", "下载", "服务器", "数据库", "配置", "性能", "测试", "我们", "需要",
+                 "已经", "可以", "通过", "进行", "问题", "方案", "结果", "分析", "项目", "团队", "时间", "完成",
+                 "，", "，", "。", "、", "；", "的", "了", "在", "是", "和", "对", "将", "并且", "因此")
+# 内容是随机字节，不包含图片类型，避免上传后生成缩略图失败
+FILE_TYPES = (".txt", ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".zip", ".rar")
+PATHS = ("/api/files", "/api/files/{}", "/api/files/{}/preview", "/api/files/{}/thumbnail?size=sm",
+         "/api/login", "/api/user/me", "/assets/index.js", "/favicon.ico")
+
+
+def make_log(rng, size):
+    lines = []
+    total = 0
+    started = 1_700_000_000
+    while total < size:
+        started += rng.randint(0, 3)
+        line = (f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)} - - "
+                f"[{time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(started))}] "
+                f"\"{rng.choice(('GET', 'GET', 'GET', 'POST', 'DELETE'))} "
+                f"{rng.choice(PATHS).format(rng.randint(1, 100000))} HTTP/1.1\" "
+                f"{rng.choice((200, 200, 200, 206, 304, 404))} {rng.randint(0, 5 * MB)} "
+                f"\"-\" \"Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/{rng.randint(100, 130)}.0\"\n")
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def make_csv(rng, size):
+    lines = ["id,date,region,product,quantity,unit_price,amount\n"]
+    total = len(lines[0])
+    row = 0
+    while total < size:
+        row += 1
+        quantity, price = rng.randint(1, 500), round(rng.uniform(1, 999), 2)
+        line = (f"{row},2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},"
+                f"{rng.choice(('华东', '华南', '华北', '西南'))},P{rng.randint(1000, 9999)},"
+                f"{quantity},{price},{quantity * price:.2f}\n")
+        lines.append(line)
+        total += len(line.encode())
+    return "".join(lines).encode()[:size]
+
+
+def make_source(size):
+    """拼接标准库的Python源码"""
+    parts = []
+    total = 0
+    for path in sorted(Path(sysconfig.get_paths()["stdlib"]).glob("*.py")):
+        data = path.read_bytes()
+        parts.append(data)
+        total += len(data)
+        if total >= size:
+            break
+    return b"".join(parts)[:size]
+
+
+def make_chinese(rng, size):
+    words = []
+    total = 0
+    while total < size:
+        word = rng.choice(CHINESE_WORDS)
+        if word == "。" and rng.random() < 0.2:
+            word += "\n"
+        words.append(word)
+        total += len(word.encode())
+    return "".join(words).encode()[:size].decode(errors="ignore").encode()
+
+
+def make_json(rng, size):
+    records = []
+    total = 0
+    while total < size:
+        record = json.dumps({
+            "id": rng.randint(1, 10 ** 9), "name": f"{rng.choice(NAME_WORDS)}_{rng.randint(1, 999)}",
+            "email": f"user{rng.randint(1, 99999)}@example.com", "score": round(rng.random() * 100, 3),
+            "tags": rng.sample(NAME_WORDS, 3), "active": rng.random() < 0.5,
+        }, ensure_ascii=False)
+        records.append(record)
+        total += len(record.encode()) + 2
+    return ("[" + ",\n".join(records) + "]").encode()
+
+
+def make_text_set(rng, size):
+    return {
+        "access.log": make_log(rng, size),
+        "sales.csv": make_csv(rng, size),
+        "source.txt": make_source(size),
+        "chinese.txt": make_chinese(rng, size),
+        "export.txt": make_json(rng, size),
+    }
+
+
+def random_filename(rng, i):
+    return f"{rng.choice(NAME_WORDS)}_{2020 + rng.randint(0, 5)}{rng.randint(1, 12):02d}_{i}{rng.choice(FILE_TYPES)}"
+
+
+def measure_encoder(data, encoding, level):
+    """按块流式压缩，返回 (压缩后字节数, CPU秒数)"""
+    from compression import create_encoder
+
+    started = time.process_time()
+    encoder = create_encoder(encoding, level)
+    size = 0
+    for start in range(0, len(data), CHUNK_SIZE):
+        size += len(encoder.compress(data[start:start + CHUNK_SIZE]))
+    size += len(encoder.finish())
+    return size, time.process_time() - started
+
+
+def report_encoders(samples):
+    from compression import ENCODERS
+
+    print("encoder (streamed in 64KB chunks, single core):")
+    for name, data in samples.items():
+        for encoding in ENCODERS:
+            for level in COMPARED_LEVELS[encoding]:
+                size, seconds = measure_encoder(data, encoding, level)
+                print(f"  {name:<12} {len(data) / KB:8.0f} KB  {encoding:<4} level {level}:  "
+                      f"{size / KB:8.0f} KB  saved {1 - size / len(data):6.1%}  "
+                      f"{len(data) / MB / max(seconds, 1e-9):7.1f} MB/s")
+
+
+async def fetch(client, url, headers, repeat):
+    """请求 repeat 次，返回 (每次发送的字节数, 每个请求的CPU毫秒数)"""
+    async with client.stream("GET", url, headers=headers) as resp:
+        await resp.aread()  # 预热
+    started = time.process_time()
+    for _ in range(repeat):
+        async with client.stream("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            size = 0
+            async for chunk in resp.aiter_raw():
+                size += len(chunk)
+    return size, (time.process_time() - started) * 1000 / repeat
+
+
+async def report_end_to_end(client, headers, targets, repeat):
+    from compression import ENCODERS, LEVELS, STREAM_LEVELS
+
+    print(f"end to end (levels: responses sent at once {LEVELS}, streamed {STREAM_LEVELS}; "
+          f"CPU per request includes routing, database and file I/O):")
+    for label, url in targets:
+        identity, identity_ms = await fetch(client, url, {**headers, "Accept-Encoding": "identity"}, repeat)
+        print(f"  {label:<12} identity  {identity / KB:8.1f} KB  {identity_ms:7.2f} ms CPU")
+        for encoding in ENCODERS:
+            size, ms = await fetch(client, url, {**headers, "Accept-Encoding": encoding}, repeat)
+            print(f"  {label:<12} {encoding:<8}  {size / KB:8.1f} KB  {ms:7.2f} ms CPU  "
+                  f"saved {1 - size / identity:6.1%}  +{ms - identity_ms:6.2f} ms")
+
+
+async def run(args):
+    import httpx
+    import main
+
+    rng = random.Random(args.seed)
+    texts = make_text_set(rng, args.text_mb * MB)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        resp = await client.post("/api/register", json={"username": f"compress{int(time.time())}", "password": "bench"})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        ids = []
+        try:
+            for i in range(args.files):
+                filename = random_filename(rng, i)
+                resp = await client.post(
+                    "/api/files/upload", headers=headers,
+                    files={"file": (filename, os.urandom(rng.randint(KB, 8 * KB)), "application/octet-stream")},
+                    data={"is_private": str(rng.random() < 0.3).lower()},
+                )
+                resp.raise_for_status()
+                ids.append(resp.json()["file_id"])
+            text_ids = {}
+            for name, data in texts.items():
+                resp = await client.post("/api/files/upload", headers=headers,
+                                         files={"file": (f"{Path(name).stem}.txt", data, "text/plain")})
+                resp.raise_for_status()
+                text_ids[name] = resp.json()["file_id"]
+            ids.extend(text_ids.values())
+
+            resp = await client.get("/api/files", params={"limit": 500}, headers={**headers, "Accept-Encoding": "identity"})
+            samples = {"listing.json": resp.content, **texts}
+            print(f"listing: {len(resp.json()['items'])} files, {len(resp.content) / KB:.0f} KB")
+            report_encoders(samples)
+
+            targets = [("listing.json", "/api/files?limit=500")]
+            targets += [(name, f"/api/files/{file_id}") for name, file_id in text_ids.items()]
+            await report_end_to_end(client, headers, targets, args.repeat)
+        finally:
+            await client.post("/api/files/bulk", headers=headers, json={"ids": ids, "action": "delete"})
+            main.preview_pool.shutdown()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="响应压缩基准测试")
+    parser.add_argument("--files", type=int, default=300, help="列表中的文件数")
+    parser.add_argument("--text-mb", type=int, default=4, help="每个文本文件的大小（MB）")
+    parser.add_argument("--repeat", type=int, default=20, help="端到端测试中每个请求的重复次数")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
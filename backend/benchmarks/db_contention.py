@@ -0,0 +1,163 @@
+"""
+数据库写入并发压力测试
+
+N 个客户端同时反复执行登录、上传、下载（下载计数写回阈值调低，频繁提交）、列表和删除，
+统计失败的请求和 "database is locked" 错误。写事务串行化、WAL 和 busy_timeout 生效时应当没有任何失败。
+--mode uvicorn --workers 4 时由多个uvicorn进程共享同一个数据库，验证进程之间的 busy_timeout 等待。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.db_contention --clients 200 --rounds 5
+    python -m benchmarks.db_contention --clients 200 --rounds 5 --mode uvicorn --workers 4
+    DB_SERIALIZE_WRITES=false SQLITE_JOURNAL_MODE=DELETE SQLITE_BUSY_TIMEOUT=0 \\
+        python -m benchmarks.db_contention --clients 200   # 对比：旧配置
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# 每次下载都尽快写回计数，制造更多并发写入（需要在导入 main 之前设置）
+os.environ.setdefault("DOWNLOAD_FLUSH_THRESHOLD", "1")
+os.environ.setdefault("DOWNLOAD_FLUSH_INTERVAL", "0.05")
+
+from benchmarks.mixed_load import percentile  # noqa: E402
+from benchmarks.suite import free_port, wait_until_ready  # noqa: E402
+
+
+class Outcomes:
+    def __init__(self):
+        self.statuses = Counter()
+        self.locked = 0
+        self.exceptions = Counter()
+        self.latencies = []
+
+    def record(self, name, resp, started):
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        self.statuses[(name, resp.status_code)] += 1
+        if "database is locked" in resp.text:
+            self.locked += 1
+        return resp
+
+    @property
+    def failures(self):
+        return sum(count for (_, status), count in self.statuses.items() if status >= 500) + sum(self.exceptions.values())
+
+
+async def client_session(client, index, prefix, args, outcomes):
+    username = f"{prefix}_{index}"
+
+    async def call(name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            return outcomes.record(name, await client.request(method, url, **kwargs), started)
+        except Exception as e:
+            # 进程内运行时应用的异常直接抛给客户端
+            message = str(e).splitlines()[0] if str(e) else ""
+            if "database is locked" in message:
+                outcomes.locked += 1
+            outcomes.exceptions[f"{name}: {type(e).__name__}: {message}"] += 1
+            return None
+
+    resp = await call("register", "POST", "/api/register", json={"username": username, "password": "bench"})
+    if resp is None or resp.status_code != 200:
+        return
+
+    for round_index in range(args.rounds):
+        resp = await call("login", "POST", "/api/login", data={"username": username, "password": "bench"})
+        if resp is None or resp.status_code != 200:
+            continue
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        data = f"{username} round {round_index} {time.time()}".encode() * 64
+        resp = await call("upload", "POST", "/api/files/upload", headers=headers,
+                          files={"file": (f"{username}_{round_index}.txt", data, "text/plain")})
+        if resp is None or resp.status_code != 200:
+            continue
+        file_id = resp.json()["file_id"]
+        for _ in range(args.downloads):
+            await call("download", "GET", f"/api/files/{file_id}", headers=headers)
+        await call("list", "GET", "/api/files?limit=20", headers=headers)
+        await call("delete", "DELETE", f"/api/files/{file_id}", headers=headers)
+
+
+async def run_clients(client, args):
+    outcomes = Outcomes()
+    prefix = f"stress{int(time.time())}"
+    started = time.perf_counter()
+    await asyncio.gather(*(client_session(client, i, prefix, args, outcomes) for i in range(args.clients)))
+    return outcomes, time.perf_counter() - started
+
+
+async def run_inproc(args):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        main.download_counter.start()
+        try:
+            return await run_clients(client, args)
+        finally:
+            await main.download_counter.stop()
+            await asyncio.gather(*main.background_tasks, return_exceptions=True)
+            main.preview_pool.shutdown()
+
+
+async def run_uvicorn(args, work_dir):
+    import httpx
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=work_dir,
+    )
+    limits = httpx.Limits(max_connections=args.clients)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            await wait_until_ready(client, process)
+            return await run_clients(client, args)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="数据库写入并发压力测试")
+    parser.add_argument("--clients", type=int, default=200, help="并发客户端数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个客户端的轮数（登录、上传、下载、列表、删除）")
+    parser.add_argument("--downloads", type=int, default=3, help="每轮的下载次数")
+    parser.add_argument("--mode", choices=("inproc", "uvicorn"), default="inproc", help="进程内或真实uvicorn进程")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn 进程数（--mode uvicorn）")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="netdisk_stress_")
+    print(f"work dir: {work_dir}")
+    if args.mode == "inproc":
+        os.chdir(work_dir)
+        outcomes, elapsed = asyncio.run(run_inproc(args))
+    else:
+        outcomes, elapsed = asyncio.run(run_uvicorn(args, work_dir))
+
+    total = sum(outcomes.statuses.values())
+    print(f"{total} requests from {args.clients} clients in {elapsed:.1f}s "
+          f"(p50={percentile(outcomes.latencies, 50):.0f}ms p99={percentile(outcomes.latencies, 99):.0f}ms)")
+    for (name, status), count in sorted(outcomes.statuses.items()):
+        print(f"  {name:<10} {status}  {count}")
+    for message, count in outcomes.exceptions.most_common(10):
+        print(f"  exception x{count}: {message}")
+    print(f"'database is locked' errors: {outcomes.locked}")
+    print(f"failed requests (5xx or exception): {outcomes.failures}")
+    sys.exit(1 if outcomes.failures or outcomes.locked else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,142 @@
+"""
+事件流基准测试
+
+在子进程中启动一个 uvicorn 工作进程（使用临时目录中的数据库和上传目录），建立 --connections 个空闲的
+/api/events 连接，报告每个连接增加的服务进程内存（RSS），然后上传 --uploads 个文件，
+报告从上传接口返回到所有连接都收到对应 file-created 事件的延迟。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.events --connections 2000 --uploads 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def request(host, port, method, path, headers=None, body=b""):
+    reader, writer = await asyncio.open_connection(host, port)
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nContent-Length: {len(body)}\r\n"
+    for name, value in (headers or {}).items():
+        head += f"{name}: {value}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    data = await reader.read()
+    writer.close()
+    header, _, content = data.partition(b"\r\n\r\n")
+    return int(header.split()[1]), content
+
+
+class Subscriber:
+    """一个事件流连接，只记录收到的事件ID"""
+
+    def __init__(self):
+        self.ids = set()
+        self.arrived = {}
+        self.ready = asyncio.Event()
+
+    async def run(self, host, port, token):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET /api/events HTTP/1.1\r\nHost: {host}\r\nAuthorization: Bearer {token}\r\n\r\n".encode())
+        await reader.readuntil(b"\r\n\r\n")
+        self.ready.set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            # 分块传输编码中的事件行
+            if line.startswith(b"id: "):
+                version = int(line[4:])
+                self.ids.add(version)
+                self.arrived[version] = time.perf_counter()
+
+
+async def run(args):
+    work = tempfile.mkdtemp(prefix="events-bench-")
+    env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR), ADMISSION_ENABLED="false", METRICS_ENABLED="true")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", args.host, "--port", str(args.port),
+         "--log-level", "warning", "--backlog", str(max(2048, args.connections))],
+        cwd=work, env=env)
+    try:
+        for _ in range(100):
+            try:
+                await request(args.host, args.port, "GET", "/metrics")
+                break
+            except OSError:
+                await asyncio.sleep(0.2)
+        status, body = await request(args.host, args.port, "POST", "/api/register",
+                                     {"Content-Type": "application/json"},
+                                     json.dumps({"username": "events", "password": "bench"}).encode())
+        token = json.loads(body)["access_token"]
+
+        await asyncio.sleep(1)
+        before = rss_kb(server.pid)
+        subscribers = [Subscriber() for _ in range(args.connections)]
+        tasks = []
+        for start in range(0, args.connections, 200):
+            batch = subscribers[start:start + 200]
+            tasks += [asyncio.create_task(s.run(args.host, args.port, token)) for s in batch]
+            await asyncio.wait_for(asyncio.gather(*(s.ready.wait() for s in batch)), timeout=60)
+        await asyncio.sleep(1)
+        after = rss_kb(server.pid)
+        print(f"connections: {args.connections}, server RSS {before / 1024:.1f} MB -> {after / 1024:.1f} MB, "
+              f"{(after - before) / args.connections:.1f} KB per idle connection")
+
+        latencies = []
+        boundary = "benchboundary"
+        for i in range(args.uploads):
+            body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"e{i}.txt\"\r\n"
+                    f"Content-Type: text/plain\r\n\r\n{'x' * 100}\r\n--{boundary}--\r\n").encode()
+            status, content = await request(args.host, args.port, "POST", "/api/files/upload",
+                                            {"Authorization": f"Bearer {token}",
+                                             "Content-Type": f"multipart/form-data; boundary={boundary}"}, body)
+            uploaded = time.perf_counter()
+            version = i + 1
+            deadline = uploaded + 10
+            while any(version not in s.ids for s in subscribers) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.001)
+            missing = sum(version not in s.ids for s in subscribers)
+            arrived = [s.arrived[version] - uploaded for s in subscribers if version in s.arrived]
+            latencies.append(max(arrived) if arrived else float("inf"))
+            if missing:
+                print(f"  upload {i}: {missing} connection(s) did not receive the event")
+        print(f"fan-out of one event to all {args.connections} connections after the upload response: "
+              f"median {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms")
+        for task in tasks:
+            task.cancel()
+    finally:
+        server.kill()
+        server.wait()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="事件流基准测试")
+    parser.add_argument("--connections", type=int, default=2000, help="空闲连接数")
+    parser.add_argument("--uploads", type=int, default=20, help="上传的文件数（每个文件产生一个事件）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.connections + 256)), hard))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
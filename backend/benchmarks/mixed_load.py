@@ -0,0 +1,108 @@
+"""
+混合负载基准测试
+
+先单独测量小请求（文件列表、用户信息）的延迟，再在若干大文件持续上传的同时测量一次，
+用于验证大文件上传期间事件循环不被阻塞、小请求的p99延迟不会明显上升。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.mixed_load --uploads 4 --upload-mb 200 --requests 300
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure_small_requests(client, headers, count, concurrency=8):
+    """并发发送小请求，返回每个请求的耗时（毫秒）"""
+    latencies = []
+    paths = ["/api/files?limit=20", "/api/user/me"]
+    queue = list(range(count))
+
+    async def worker():
+        while queue:
+            i = queue.pop()
+            started = time.perf_counter()
+            resp = await client.get(paths[i % len(paths)], headers=headers)
+            resp.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def upload_large_file(client, headers, source):
+    with open(source, "rb") as f:
+        resp = await client.post(
+            "/api/files/upload",
+            headers=headers,
+            files={"file": ("large.zip", f, "application/zip")},
+        )
+    resp.raise_for_status()
+    await client.delete(f"/api/files/{resp.json()['file_id']}", headers=headers)
+
+
+def report(name, latencies):
+    print(f"{name:<22} n={len(latencies):<5} p50={percentile(latencies, 50):7.1f}ms "
+          f"p95={percentile(latencies, 95):7.1f}ms p99={percentile(latencies, 99):7.1f}ms")
+
+
+async def run(args):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        resp = await client.post("/api/register", json={"username": f"bench_{int(time.time())}", "password": "bench"})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        idle = await measure_small_requests(client, headers, args.requests)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # 每个上传使用不同内容，避免被去重
+            sources = []
+            for i in range(args.uploads):
+                source = Path(tmp_dir) / f"large_{i}.zip"
+                with open(source, "wb") as f:
+                    for _ in range(args.upload_mb):
+                        f.write(os.urandom(1024 * 1024))
+                sources.append(source)
+
+            uploads = asyncio.gather(*(upload_large_file(client, headers, s) for s in sources))
+            await asyncio.sleep(0.2)  # 等待上传开始
+            loaded = await measure_small_requests(client, headers, args.requests)
+            await uploads
+
+    report("small requests idle", idle)
+    report("during large uploads", loaded)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="测量大文件上传期间小请求的延迟")
+    parser.add_argument("--uploads", type=int, default=4, help="并发上传的大文件数")
+    parser.add_argument("--upload-mb", type=int, default=200, help="每个大文件的大小（MB）")
+    parser.add_argument("--requests", type=int, default=300, help="每个阶段发送的小请求数")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="netdisk_bench_")
+    os.chdir(work_dir)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
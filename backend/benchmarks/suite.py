@@ -0,0 +1,392 @@
+"""
+API热点路径基准测试套件
+
+先用 N 个用户和 M 个大小混合的文件初始化一个全新的数据库，然后对每个场景以固定并发发送请求，
+报告吞吐量、p50/p95/p99延迟和服务进程的峰值RSS。可以在进程内（httpx ASGI transport）运行，
+也可以启动真实的 uvicorn 进程通过HTTP运行。结果保存为JSON，并可与保存的基线比较，
+吞吐量下降或p95延迟上升超过阈值时以非零状态退出。
+
+场景:
+    list            文件列表第一页（随机用户）
+    small_download  下载小文件
+    large_download  下载大文件（流式读取）
+    upload          上传小文件
+    text_preview    文本文件预览（命中预览缓存后的稳态）
+    image_preview   图片预览
+
+用法（在backend目录下运行）:
+    python -m benchmarks.suite --mode both --users 20 --files 200 --concurrency 16 --requests 200 \\
+        --output results.json
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json   # 保存基线
+    python -m benchmarks.suite --baseline benchmarks/baseline.json        # 与基线比较
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.mixed_load import percentile  # noqa: E402
+from benchmarks.thumbnails import make_photo  # noqa: E402
+from benchmarks.upload_rss import RssSampler  # noqa: E402
+
+SCENARIOS = ("list", "small_download", "large_download", "upload", "text_preview", "image_preview")
+
+# 初始化文件的大小分布：(比例, 最小字节数, 最大字节数)
+SIZE_MIX = (
+    (0.70, 1024, 64 * 1024),
+    (0.25, 256 * 1024, 2 * 1024 * 1024),
+    (0.05, 4 * 1024 * 1024, 16 * 1024 * 1024),
+)
+
+MB = 1024 * 1024
+
+
+def pick_size(rng):
+    roll = rng.random()
+    for share, low, high in SIZE_MIX:
+        if roll < share:
+            return rng.randint(low, high)
+        roll -= share
+    return SIZE_MIX[-1][2]
+
+
+def make_text(size):
+    """生成中英文混合、按行分隔的文本"""
+    line = "基准测试文本 benchmark line 0123456789 abcdefghijklmnopqrstuvwxyz\n".encode("utf-8")
+    return (line * (size // len(line) + 1))[:size]
+
+
+async def register(client, username):
+    resp = await client.post("/api/register", json={"username": username, "password": "bench"})
+    resp.raise_for_status()
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+async def upload(client, headers, filename, data, content_type, is_private=False):
+    resp = await client.post(
+        "/api/files/upload",
+        headers=headers,
+        files={"file": (filename, data, content_type)},
+        data={"is_private": str(is_private).lower()},
+    )
+    resp.raise_for_status()
+    return resp.json()["file_id"]
+
+
+async def seed(client, args):
+    """
+    初始化用户和文件
+
+    Returns:
+        dict: 用户认证头列表、(文件ID, 所属用户认证头) 列表和各场景使用的文件ID
+    """
+    rng = random.Random(args.seed)
+    prefix = f"bench{int(time.time())}"
+    users = [await register(client, f"{prefix}_{i}") for i in range(args.users)]
+
+    uploaded = []
+    for i in range(args.files):
+        owner = users[i % len(users)]
+        size = pick_size(rng)
+        # 内容随机生成，避免被去重为同一个文件；文件大小和类型由种子决定，每次运行相同
+        if rng.random() < 0.3:
+            name, data, content_type = f"notes_{i}.txt", make_text(size), "text/plain"
+        else:
+            name, data, content_type = f"data_{i}.zip", os.urandom(size), "application/zip"
+        file_id = await upload(client, owner, name, data, content_type, is_private=rng.random() < 0.2)
+        uploaded.append((file_id, owner))
+
+    owner = users[0]
+    fixtures = {
+        "small": await upload(client, owner, "small.zip", os.urandom(args.small_kb * 1024), "application/zip"),
+        "large": await upload(client, owner, "large.zip", os.urandom(args.large_mb * MB), "application/zip"),
+        "text": await upload(client, owner, "preview.txt", make_text(args.text_kb * 1024), "text/plain"),
+        "image": await upload(client, owner, "preview.jpg", make_photo(2000, 1500, 0), "image/jpeg"),
+    }
+    uploaded.extend((file_id, owner) for file_id in fixtures.values())
+    return {"users": users, "files": uploaded, "fixtures": fixtures}
+
+
+def scenario_request(name, seeded, rng):
+    """返回发送单个请求的协程函数 (client) -> 传输的字节数；上传场景创建的文件记入 seeded["files"] 以便清理"""
+    fixtures = seeded["fixtures"]
+    users = seeded["users"]
+
+    async def get(client, url, headers=None):
+        total = 0
+        async with client.stream("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.aiter_raw():
+                total += len(chunk)
+        return total
+
+    if name == "list":
+        return lambda client: get(client, "/api/files?limit=50", rng.choice(users))
+    if name == "small_download":
+        return lambda client: get(client, f"/api/files/{fixtures['small']}")
+    if name == "large_download":
+        return lambda client: get(client, f"/api/files/{fixtures['large']}")
+    if name == "text_preview":
+        return lambda client: get(client, f"/api/files/{fixtures['text']}/preview")
+    if name == "image_preview":
+        return lambda client: get(client, f"/api/files/{fixtures['image']}/preview")
+    if name == "upload":
+        async def do_upload(client):
+            data = os.urandom(256 * 1024)
+            owner = users[0]
+            file_id = await upload(client, owner, "upload.zip", data, "application/zip")
+            seeded["files"].append((file_id, owner))
+            return len(data)
+        return do_upload
+    raise ValueError(f"unknown scenario: {name}")
+
+
+async def run_scenario(client, name, seeded, args, server_pid=None):
+    rng = random.Random(args.seed)
+    request = scenario_request(name, seeded, rng)
+
+    # 预热（预览缓存、认证缓存等），不计入结果
+    for _ in range(args.warmup):
+        await request(client)
+
+    # 大文件下载每个请求传输的数据量大，请求数取其他场景的1/10，让各场景耗时接近
+    count = max(args.requests // 10, args.concurrency) if name == "large_download" else args.requests
+    latencies = []
+    errors = 0
+    total_bytes = 0
+    remaining = count
+
+    async def worker():
+        nonlocal remaining, errors, total_bytes
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                total_bytes += await request(client)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    sampler = RssSampler(pid=server_pid)
+    sampler.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    peak = sampler.stop()
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "bytes": total_bytes,
+        "peak_rss_mb": round(peak / MB, 1),
+    }
+
+
+async def cleanup(client, seeded):
+    for file_id, owner in seeded["files"]:
+        await client.delete(f"/api/files/{file_id}", headers=owner)
+
+
+async def run_suite(client, args, server_pid=None, settle=None):
+    """初始化数据后依次运行各场景；settle 为可选的异步函数，用于等待上传触发的后台任务完成"""
+    seeded = await seed(client, args)
+    results = {}
+    try:
+        if settle is not None:
+            await settle()
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, name, seeded, args, server_pid)
+            report_line(name, results[name])
+    finally:
+        if settle is not None:
+            await settle()
+        await cleanup(client, seeded)
+    return results
+
+
+async def run_inproc(args):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def settle():
+            # 上传后生成缩略图的后台任务不应与测量争用渲染进程，也不应在文件删除后才执行
+            await asyncio.gather(*main.background_tasks, return_exceptions=True)
+
+        try:
+            return await run_suite(client, args, settle=settle)
+        finally:
+            main.preview_pool.shutdown()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_ready(client, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            await client.get("/metrics")
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn did not start in time")
+
+
+async def run_uvicorn(args, work_dir):
+    import httpx
+
+    port = free_port()
+    # 服务进程的数据库和日志写到单独的临时目录
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=work_dir,
+    )
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            await wait_until_ready(client, process)
+            return await run_suite(client, args, server_pid=process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def report_line(name, result):
+    print(f"  {name:<16} {result['throughput_rps']:9.1f} req/s  p50={result['p50_ms']:8.1f}ms "
+          f"p95={result['p95_ms']:8.1f}ms p99={result['p99_ms']:8.1f}ms  "
+          f"rss={result['peak_rss_mb']:7.1f}MB  errors={result['errors']}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, max_throughput_drop, max_latency_rise):
+    """
+    与基线比较
+
+    Returns:
+        list: 回归描述，没有回归时为空
+    """
+    regressions = []
+    for mode, scenarios in results["results"].items():
+        for name, current in scenarios.items():
+            previous = baseline.get("results", {}).get(mode, {}).get(name)
+            if not previous:
+                continue
+            throughput_change = (current["throughput_rps"] - previous["throughput_rps"]) / (previous["throughput_rps"] or 1)
+            latency_change = (current["p95_ms"] - previous["p95_ms"]) / (previous["p95_ms"] or 1)
+            flag = ""
+            if throughput_change < -max_throughput_drop:
+                flag = "REGRESSION"
+                regressions.append(f"{mode}/{name}: throughput {throughput_change:+.0%}")
+            if latency_change > max_latency_rise:
+                flag = "REGRESSION"
+                regressions.append(f"{mode}/{name}: p95 latency {latency_change:+.0%}")
+            print(f"  {mode + '/' + name:<26} throughput {throughput_change:+7.1%}  p95 {latency_change:+7.1%}  {flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="API热点路径基准测试")
+    parser.add_argument("--mode", choices=("inproc", "uvicorn", "both"), default="inproc",
+                        help="进程内（ASGI transport）、真实uvicorn进程或两者都运行")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景列表")
+    parser.add_argument("--users", type=int, default=10, help="初始化的用户数")
+    parser.add_argument("--files", type=int, default=100, help="初始化的文件数")
+    parser.add_argument("--small-kb", type=int, default=16, help="小文件下载场景的文件大小（KB）")
+    parser.add_argument("--large-mb", type=int, default=32, help="大文件下载场景的文件大小（MB）")
+    parser.add_argument("--text-kb", type=int, default=256, help="文本预览场景的文件大小（KB）")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数（大文件下载为其1/10）")
+    parser.add_argument("--warmup", type=int, default=3, help="每个场景的预热请求数")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子，决定初始化文件的大小和类型")
+    parser.add_argument("--output", help="结果JSON文件")
+    parser.add_argument("--baseline", help="与该基线JSON比较，出现回归时以状态1退出")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    parser.add_argument("--max-throughput-drop", type=float, default=0.15, help="允许的吞吐量下降比例")
+    parser.add_argument("--max-latency-rise", type=float, default=0.25, help="允许的p95延迟上升比例")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main_cli():
+    args = parse_args()
+    modes = ["inproc", "uvicorn"] if args.mode == "both" else [args.mode]
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "baseline", "save_baseline")},
+        },
+        "results": {},
+    }
+
+    for mode in modes:
+        # 每种模式使用全新的数据库和日志目录，避免污染正式数据，也避免互相影响
+        work_dir = tempfile.mkdtemp(prefix=f"netdisk_bench_{mode}_")
+        print(f"[{mode}] work dir: {work_dir}")
+        if mode == "inproc":
+            os.chdir(work_dir)
+            results["results"][mode] = asyncio.run(run_inproc(args))
+        else:
+            results["results"][mode] = asyncio.run(run_uvicorn(args, work_dir))
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(output, encoding="utf-8")
+            print(f"saved {path}")
+
+    if args.baseline:
+        print(f"compare with {args.baseline}:")
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.max_throughput_drop, args.max_latency_rise)
+        if regressions:
+            print("regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main_cli()
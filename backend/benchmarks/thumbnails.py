@@ -0,0 +1,101 @@
+"""
+缩略图基准测试
+
+上传若干张大尺寸照片，比较原图与各尺寸缩略图的传输字节数，
+以及首次请求（生成缩略图）和再次请求（命中磁盘缓存）的耗时。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.thumbnails --images 5 --width 4000 --height 3000
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def make_photo(width, height, seed):
+    """生成带噪声的渐变图，压缩率接近真实照片"""
+    from PIL import Image
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed)
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+async def timed_get(client, url, headers):
+    started = time.perf_counter()
+    resp = await client.get(url, headers=headers)
+    resp.raise_for_status()
+    return len(resp.content), (time.perf_counter() - started) * 1000
+
+
+async def run(args):
+    import httpx
+    import main
+    from preview_renderer import THUMBNAIL_SIZES, preview_pool
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        resp = await client.post("/api/register", json={"username": f"bench_{int(time.time())}", "password": "bench"})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        file_ids = []
+        for i in range(args.images):
+            data = make_photo(args.width, args.height, i)
+            resp = await client.post(
+                "/api/files/upload",
+                headers=headers,
+                files={"file": (f"photo_{i}.jpg", data, "image/jpeg")},
+            )
+            resp.raise_for_status()
+            file_ids.append(resp.json()["file_id"])
+        # 只测量按需生成，等待上传触发的预先生成完成后清空缓存
+        await asyncio.gather(*main.background_tasks)
+        for file_id in file_ids:
+            await main.thumbnail_cache.invalidate(file_id)
+
+        print(f"{'variant':<10}{'avg bytes':>14}{'first ms':>12}{'cached ms':>12}")
+        results = {}
+        for file_id in file_ids:
+            size, elapsed = await timed_get(client, f"/api/files/{file_id}/preview", headers)
+            results.setdefault("original", []).append((size, elapsed, elapsed))
+            for name in THUMBNAIL_SIZES:
+                url = f"/api/files/{file_id}/thumbnail?size={name}"
+                size, first = await timed_get(client, url, headers)
+                _, cached = await timed_get(client, url, headers)
+                results.setdefault(name, []).append((size, first, cached))
+
+        for name, rows in results.items():
+            count = len(rows)
+            print(f"{name:<10}{sum(r[0] for r in rows) / count:>14,.0f}"
+                  f"{sum(r[1] for r in rows) / count:>12.1f}{sum(r[2] for r in rows) / count:>12.1f}")
+
+        for file_id in file_ids:
+            await client.delete(f"/api/files/{file_id}", headers=headers)
+    preview_pool.shutdown()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="测量缩略图的传输字节数和生成耗时")
+    parser.add_argument("--images", type=int, default=5, help="测试图片数")
+    parser.add_argument("--width", type=int, default=4000, help="图片宽度")
+    parser.add_argument("--height", type=int, default=3000, help="图片高度")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="netdisk_bench_")
+    os.chdir(work_dir)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,119 @@
+"""
+上传内存占用基准测试
+
+在进程内（httpx ASGI transport）上传一个大文件，同时采样进程RSS，
+用于验证流式上传的峰值内存与文件大小无关。
+
+用法（在backend目录下运行）:
+    python -m benchmarks.upload_rss --size-mb 1024
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def current_rss(pid=None):
+    """返回进程（默认当前进程）的常驻内存（字节）"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if pid is not None:
+            return 0
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler(threading.Thread):
+    """后台线程定期采样RSS，记录峰值"""
+
+    def __init__(self, interval=0.05, pid=None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.pid = pid
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, current_rss(self.pid))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def make_source_file(path, size_mb):
+    """生成测试文件（随机内容，避免被压缩或去重影响结果）"""
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+async def run(size_mb):
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        resp = await client.post("/api/register", json={"username": f"bench_{int(time.time())}", "password": "bench"})
+        resp.raise_for_status()
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = Path(tmp_dir) / "bench.zip"
+            make_source_file(source, size_mb)
+
+            baseline = current_rss()
+            sampler = RssSampler()
+            sampler.start()
+            started = time.perf_counter()
+            with open(source, "rb") as f:
+                resp = await client.post(
+                    "/api/files/upload",
+                    headers=headers,
+                    files={"file": ("bench.zip", f, "application/zip")},
+                )
+            elapsed = time.perf_counter() - started
+            peak = sampler.stop()
+            resp.raise_for_status()
+
+        # 清理上传的文件
+        await client.delete(f"/api/files/{resp.json()['file_id']}", headers=headers)
+
+    mb = 1024 * 1024
+    print(f"uploaded:      {size_mb} MB in {elapsed:.2f}s ({size_mb / elapsed:.1f} MB/s)")
+    print(f"baseline RSS:  {baseline / mb:.1f} MB")
+    print(f"peak RSS:      {peak / mb:.1f} MB")
+    print(f"RSS increase:  {(peak - baseline) / mb:.1f} MB")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="测量上传大文件时的进程峰值内存")
+    parser.add_argument("--size-mb", type=int, default=1024, help="上传文件大小（MB），默认1024")
+    args = parser.parse_args()
+
+    # 数据库和日志写到临时目录，避免污染正式数据
+    work_dir = tempfile.mkdtemp(prefix="netdisk_bench_")
+    os.chdir(work_dir)
+    asyncio.run(run(args.size_mb))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,297 @@
+"""
+响应压缩
+
+按请求的 Accept-Encoding 协商 zstd、br 或 gzip，压缩可压缩类型的响应：接口返回的JSON（文件列表等）
+和文本、.doc、.xls 等文件的下载。已经压缩过的类型（zip、rar、jpeg、png、docx、xlsx、pdf）不在可压缩类型中，
+原样发送；范围请求、HEAD 请求、206/304 等响应以及 Cache-Control: no-transform 的响应也不压缩。
+
+压缩是流式的：响应体的每一块压缩后立即发送，不缓存整个响应，内存占用与响应大小无关。
+压缩后的响应分块发送时去掉 Content-Length，ETag 改为弱ETag（内容编码不同，字节不再相同），
+条件请求按弱比较仍然可以返回304。保留 Accept-Ranges：客户端保存的是解码后的内容，断点续传时
+按解码后的偏移发出的范围请求不压缩，返回原始内容的对应字节。
+brotli 和 zstd 需要安装可选的 brotli / zstandard 包，未安装时只使用 gzip。
+"""
+import os
+import time
+import zlib
+from typing import List, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from metrics import compression_input_bytes_total, compression_output_bytes_total, compression_seconds_total
+
+try:
+    import brotli
+except ImportError:  # 未安装时不提供 br
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 未安装时不提供 zstd
+    zstandard = None
+
+# 压缩配置（可通过环境变量覆盖）
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")  # 是否压缩响应
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))  # 小于该字节数的响应不压缩
+COMPRESSION_ENCODINGS = os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip")  # 服务端优先使用的编码顺序（逗号分隔）
+# 压缩级别，"编码=级别" 用逗号分隔（gzip 1-9，br 0-11，zstd 1-22）：
+# 一次发送完的响应（接口JSON）体积小，使用较高的级别；分块发送的响应（文件下载）使用较快的级别，压缩速度不成为下载瓶颈
+COMPRESSION_LEVELS = os.getenv("COMPRESSION_LEVELS", "gzip=5,br=4,zstd=3")
+COMPRESSION_STREAM_LEVELS = os.getenv("COMPRESSION_STREAM_LEVELS", "gzip=1,br=1,zstd=1")
+COMPRESSION_THREAD_THRESHOLD = int(os.getenv("COMPRESSION_THREAD_THRESHOLD", 32 * 1024))  # 不小于该字节数的块在线程池中压缩
+# 可压缩的内容类型，以 / 结尾的按前缀匹配
+COMPRESSIBLE_TYPES = os.getenv(
+    "COMPRESSIBLE_TYPES",
+    "text/,application/json,application/xml,application/javascript,image/svg+xml,"
+    "application/msword,application/vnd.ms-excel,application/vnd.ms-powerpoint,application/rtf"
+)
+# 即使匹配可压缩类型也不压缩的类型：事件流需要每条消息立即送达，不能被压缩缓冲
+INCOMPRESSIBLE_TYPES = {"text/event-stream"}
+
+
+class _GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def parse_levels(spec: str) -> dict:
+    """解析 "编码=级别,..."，返回 {编码: 级别}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        levels[name.strip()] = int(value)
+    return levels
+
+
+# 已安装的编码：名称 -> 编码器类
+ENCODERS = {"gzip": _GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = _ZstdEncoder
+
+DEFAULT_LEVELS = {"gzip": 5, "br": 4, "zstd": 3}
+LEVELS = {**DEFAULT_LEVELS, **parse_levels(COMPRESSION_LEVELS)}
+STREAM_LEVELS = {**DEFAULT_LEVELS, **parse_levels(COMPRESSION_STREAM_LEVELS)}
+
+
+def create_encoder(name: str, level: Optional[int] = None):
+    """
+    创建流式编码器，提供 compress(数据) 和 finish() 两个方法
+
+    Args:
+        name: 编码名称（gzip、br、zstd），需要已安装
+        level: 压缩级别，默认使用 COMPRESSION_LEVELS 中的配置
+    """
+    return ENCODERS[name](LEVELS[name] if level is None else level)
+
+
+def parse_compressible_types(spec: str = COMPRESSIBLE_TYPES):
+    """返回 (完整类型集合, 前缀元组)"""
+    items = [item.strip().lower() for item in spec.split(",") if item.strip()]
+    return {item for item in items if not item.endswith("/")}, tuple(item for item in items if item.endswith("/"))
+
+
+def negotiate_encoding(accept_encoding: Optional[str], preference: List[str]) -> Optional[str]:
+    """
+    按 Accept-Encoding 选择编码
+
+    选择q值最高的编码，q值相同时按服务端的偏好顺序；q=0表示拒绝，* 匹配其他未列出的编码。
+
+    Args:
+        accept_encoding: 请求的 Accept-Encoding 头
+        preference: 服务端支持的编码，按偏好排序
+
+    Returns:
+        编码名称，没有可用编码时返回None
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in preference:
+        q = weights.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def weak_etag(etag: str) -> str:
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 流式压缩可压缩类型的响应
+
+    在响应头到达时决定是否压缩：状态码为200、没有 Content-Encoding、类型可压缩、
+    声明的 Content-Length 不小于 min_size，且请求不是 HEAD 或范围请求。
+    整个响应体只有一块时（JSON接口）一次压缩并给出新的 Content-Length；
+    否则逐块压缩发送（文件下载），超过 thread_threshold 的块在线程池中压缩，不阻塞事件循环。
+    """
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE, encodings: str = COMPRESSION_ENCODINGS,
+                 compressible_types: str = COMPRESSIBLE_TYPES, thread_threshold: int = COMPRESSION_THREAD_THRESHOLD):
+        self.app = app
+        self.min_size = min_size
+        self.thread_threshold = thread_threshold
+        self.preference = [name.strip() for name in encodings.split(",") if name.strip() in ENCODERS]
+        self.types, self.type_prefixes = parse_compressible_types(compressible_types)
+
+    def is_compressible(self, content_type: Optional[str]) -> bool:
+        media_type = (content_type or "").split(";", 1)[0].strip().lower()
+        if not media_type or media_type in INCOMPRESSIBLE_TYPES:
+            return False
+        return media_type in self.types or media_type.startswith(self.type_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        request_headers = Headers(scope=scope)
+        if "range" in request_headers:
+            # 范围请求按原始内容的字节偏移返回，不压缩
+            return await self.app(scope, receive, send)
+        encoding = negotiate_encoding(request_headers.get("accept-encoding"), self.preference)
+        await _CompressedResponder(self, encoding)(scope, receive, send)
+
+
+class _CompressedResponder:
+    """处理一个响应：决定是否压缩并逐块压缩发送"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: Optional[str]):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.encoder = None
+        self.start_message = None
+        self.send = None
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.seconds = 0.0
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        try:
+            await self.middleware.app(scope, receive, self.send_wrapper)
+        finally:
+            if self.encoder is not None:
+                compression_input_bytes_total.inc(self.raw_bytes, encoding=self.encoding)
+                compression_output_bytes_total.inc(self.compressed_bytes, encoding=self.encoding)
+                compression_seconds_total.inc(self.seconds, encoding=self.encoding)
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] == "http.response.body" and self.encoder is not None:
+            return await self.send_compressed(message.get("body", b""), message.get("more_body", False))
+        if message["type"] != "http.response.body" or self.start_message is None:
+            return await self.send(message)
+
+        start, self.start_message = self.start_message, None
+        headers = MutableHeaders(raw=start["headers"])
+        if not self.should_compress(start["status"], headers, message):
+            await self.send(start)
+            return await self.send(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        self.encoder = create_encoder(self.encoding, STREAM_LEVELS[self.encoding] if more_body else None)
+        headers["Content-Encoding"] = self.encoding
+        if "etag" in headers:
+            headers["ETag"] = weak_etag(headers["etag"])
+        if more_body:
+            del headers["Content-Length"]
+            await self.send(start)
+            return await self.send_compressed(body, more_body)
+        # 只有一块的响应直接压缩完，给出压缩后的长度
+        data = await self.compress(body, finish=True)
+        headers["Content-Length"] = str(len(data))
+        await self.send(start)
+        await self.send({"type": "http.response.body", "body": data, "more_body": False})
+
+    def should_compress(self, status: int, headers: MutableHeaders, message) -> bool:
+        if status != 200 or "content-encoding" in headers or "content-range" in headers:
+            return False
+        if not self.middleware.is_compressible(headers.get("content-type")):
+            return False
+        # 可压缩的响应与请求的 Accept-Encoding 有关，不压缩时也要告诉缓存
+        vary = headers.get("vary")
+        if vary is None:
+            headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+            headers["Vary"] = f"{vary}, Accept-Encoding"
+        if self.encoding is None or "no-transform" in headers.get("cache-control", "").lower():
+            return False
+        declared = headers.get("content-length")
+        if declared is not None:
+            return int(declared) >= self.middleware.min_size
+        if not message.get("more_body", False):
+            return len(message.get("body", b"")) >= self.middleware.min_size
+        return True
+
+    async def send_compressed(self, body: bytes, more_body: bool):
+        data = await self.compress(body, finish=not more_body)
+        if data or not more_body:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    async def compress(self, body: bytes, finish: bool) -> bytes:
+        if len(body) >= self.middleware.thread_threshold:
+            # zlib/brotli/zstd 压缩时释放GIL，大块放到线程池，事件循环可以继续处理其他请求
+            data = await run_in_threadpool(self._compress, body, finish)
+        else:
+            data = self._compress(body, finish)
+        self.compressed_bytes += len(data)
+        return data
+
+    def _compress(self, body: bytes, finish: bool) -> bytes:
+        started = time.perf_counter()
+        data = self.encoder.compress(body) if body else b""
+        if finish:
+            data += self.encoder.finish()
+        self.seconds += time.perf_counter() - started
+        self.raw_bytes += len(body)
+        return data
@@ -1,12 +1,198 @@
-from sqlalchemy import create_engine
+import asyncio
+import os
+import weakref
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./netdisk.db"
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl
+    fcntl = None
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# 数据库配置（可通过环境变量覆盖）
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./netdisk.db")
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL", SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
 )
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")  # WAL模式下读不阻塞写、写不阻塞读
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # WAL模式下NORMAL只在检查点时fsync，断电最多丢失最近的事务，不会损坏数据库
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 10000))  # 数据库被其他连接（进程）锁住时等待的毫秒数，超时才报 "database is locked"
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 16 * 1024))  # 每个连接的页缓存大小（KB）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))  # 通过mmap读取的数据库字节数，0表示不使用mmap
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))  # 异步引擎常驻的连接数
+# 连接池满时最多额外创建的连接数，-1表示不限制：会话在等待密码哈希、文件读写时也占用连接，
+# 限制SQLite的本地连接数只会在写锁之外再多一层排队，高并发时等待连接超时
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", -1))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # 等待空闲连接的秒数
+DB_SERIALIZE_WRITES = os.getenv("DB_SERIALIZE_WRITES", "true").lower() in ("1", "true", "yes")  # 进程内的写事务是否排队执行（SQLite需要）
+
+
+def _sqlite_pragmas():
+    return (
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新连接都设置一次（busy_timeout、cache_size等是连接级别的设置）"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in _sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def create_db_engine(url=SQLALCHEMY_DATABASE_URL, is_async=False, **kwargs):
+    """
+    创建数据库引擎，SQLite数据库会在每个连接上设置WAL、busy_timeout等参数
+
+    Args:
+        url: 数据库URL
+        is_async: 是否创建异步引擎
+        kwargs: 传给 create_engine / create_async_engine 的其他参数
+
+    Returns:
+        Engine 或 AsyncEngine
+    """
+    is_sqlite = url.startswith("sqlite")
+    if is_sqlite:
+        connect_args = kwargs.setdefault("connect_args", {})
+        connect_args.setdefault("check_same_thread", False)
+        # sqlite3 自身的锁等待（秒），与 busy_timeout 一致
+        connect_args.setdefault("timeout", SQLITE_BUSY_TIMEOUT / 1000)
+    if is_async:
+        # aiosqlite 默认不使用连接池（NullPool），每个会话都要重新打开数据库并设置参数；
+        # 使用连接池复用连接，页缓存和mmap也随连接保留
+        kwargs.setdefault("poolclass", AsyncAdaptedQueuePool)
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+        kwargs.setdefault("max_overflow", DB_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", DB_POOL_TIMEOUT)
+        db_engine = create_async_engine(url, **kwargs)
+        sync_engine = db_engine.sync_engine
+    else:
+        db_engine = sync_engine = create_engine(url, **kwargs)
+    if is_sqlite and ":memory:" not in url:
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+    return db_engine
+
+
+@contextmanager
+def schema_lock():
+    """
+    多个后端进程同时启动时，让建表和迁移依次执行（否则会同时建表，后者报 "table already exists"）
+
+    锁文件放在SQLite数据库文件旁边；非SQLite数据库或不支持 fcntl 的平台上不加锁。
+    """
+    database = engine.url.database if engine.url.get_backend_name() == "sqlite" else None
+    if fcntl is None or not database or database == ":memory:":
+        yield
+        return
+    with open(f"{database}.init.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# 写锁按事件循环分别创建（asyncio.Lock 不能跨事件循环使用）
+_write_locks = weakref.WeakKeyDictionary()
+
+
+def _write_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    return lock
+
+
+class SerializedAsyncSession(AsyncSession):
+    """
+    写操作串行化的异步会话
+
+    SQLite同时只允许一个写事务，多个请求同时写入时，后来者只能在busy_timeout内反复重试，
+    超时后报 "database is locked"。该会话在第一次写入（flush有待写对象、执行INSERT/UPDATE/DELETE、
+    run_sync）前获取进程内的写锁，提交、回滚或关闭时释放，同一进程内的写事务因此在事件循环上排队，
+    不会互相争抢SQLite的锁；多个进程之间仍由 busy_timeout 等待。读操作不受影响。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._held_write_lock = None
+
+    async def _acquire_write_lock(self):
+        if self._held_write_lock is None:
+            lock = _write_lock()
+            await lock.acquire()
+            self._held_write_lock = lock
+
+    def _release_write_lock(self):
+        lock, self._held_write_lock = self._held_write_lock, None
+        if lock is not None:
+            lock.release()
+
+    def _has_pending_writes(self) -> bool:
+        return bool(self.new or self.deleted or self.dirty)
+
+    async def execute(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._acquire_write_lock()
+        return await super().execute(statement, *args, **kwargs)
+
+    async def flush(self, objects=None):
+        if self._has_pending_writes():
+            await self._acquire_write_lock()
+        await super().flush(objects)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        # 同步函数（如 acquire_blob）可能写入数据库，按写操作处理
+        await self._acquire_write_lock()
+        return await super().run_sync(fn, *args, **kwargs)
+
+    async def commit(self):
+        try:
+            if self._has_pending_writes():
+                await self._acquire_write_lock()
+            await super().commit()
+        finally:
+            self._release_write_lock()
+
+    async def rollback(self):
+        try:
+            await super().rollback()
+        finally:
+            self._release_write_lock()
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            self._release_write_lock()
+
+
+# 同步引擎：用于建表、迁移和命令行脚本
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# 异步引擎：API请求使用，数据库操作不会阻塞事件循环
+async_engine = create_db_engine(ASYNC_SQLALCHEMY_DATABASE_URL, is_async=True)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=SerializedAsyncSession if DB_SERIALIZE_WRITES else AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+Base = declarative_base()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import threading
+
+from sqlalchemy import bindparam, func, update
+
+from database import AsyncSessionLocal
+from events import event_hub
+from file_changes import record_changes
+from models import FileInfo
+
+# 下载计数写回配置（可通过环境变量覆盖）
+DOWNLOAD_FLUSH_INTERVAL = float(os.getenv("DOWNLOAD_FLUSH_INTERVAL", 5))  # 定期写回数据库的间隔（秒）
+DOWNLOAD_FLUSH_THRESHOLD = int(os.getenv("DOWNLOAD_FLUSH_THRESHOLD", 100))  # 未写回的下载次数达到该值时提前写回
+
+
+class DownloadCounter:
+    """
+    下载次数的延迟写回（write-behind）
+
+    每次下载只在内存中累加，由后台任务每隔 DOWNLOAD_FLUSH_INTERVAL 秒、或未写回次数达到
+    DOWNLOAD_FLUSH_THRESHOLD 时，用一条批量 UPDATE 写回 files.downloads，
+    下载请求因此不再占用SQLite写锁。正常关闭时会写回全部计数；进程崩溃时最多丢失
+    一个写回间隔内、且不超过写回阈值左右的计数。UPDATE 是在原值上累加，多进程部署时各自写回互不覆盖。
+    """
+
+    def __init__(self, flush_interval=DOWNLOAD_FLUSH_INTERVAL, flush_threshold=DOWNLOAD_FLUSH_THRESHOLD):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = {}
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def increment(self, file_id, count=1):
+        with self._lock:
+            self._pending[file_id] = self._pending.get(file_id, 0) + count
+            self._pending_total += count
+            should_flush = self._pending_total >= self.flush_threshold
+        if should_flush and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self, file_id):
+        """尚未写回数据库的下载次数，接口返回 数据库中的值 + 该值"""
+        with self._lock:
+            return self._pending.get(file_id, 0)
+
+    def pending_total(self):
+        """所有文件尚未写回的下载次数之和"""
+        with self._lock:
+            return self._pending_total
+
+    def discard(self, file_id):
+        """文件删除后丢弃其未写回的计数"""
+        with self._lock:
+            self._pending_total -= self._pending.pop(file_id, 0)
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending, self._pending_total = self._pending, {}, 0
+            return pending
+
+    def _restore_pending(self, pending):
+        with self._lock:
+            for file_id, count in pending.items():
+                self._pending[file_id] = self._pending.get(file_id, 0) + count
+                self._pending_total += count
+
+    async def flush(self):
+        """把累积的计数写回数据库，失败时放回内存等待下次写回"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            pending = self._take_pending()
+            if not pending:
+                return 0
+            table = FileInfo.__table__
+            stmt = update(table).where(table.c.id == bindparam("file_id")).values(
+                downloads=func.coalesce(table.c.downloads, 0) + bindparam("delta")
+            )
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(stmt, [
+                        {"file_id": file_id, "delta": count} for file_id, count in pending.items()
+                    ])
+                    # 下载次数显示在文件列表中，写回时更新列表版本号
+                    await record_changes(db, pending, "download")
+                    await db.commit()
+            except Exception as e:
+                logging.error(f"Failed to flush download counts: {str(e)}")
+                self._restore_pending(pending)
+                raise
+            # 通知事件流推送 downloads-changed
+            event_hub.notify()
+            return len(pending)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass
+
+    def start(self):
+        """启动后台写回任务（在应用启动时调用）"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写回剩余计数（在应用关闭时调用）"""
+        if self._task is not None:
+            # 不取消任务，避免中断正在进行的写回；唤醒后任务完成当前写回即退出
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+
+download_counter = DownloadCounter()
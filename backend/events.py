@@ -0,0 +1,283 @@
+"""
+文件变更的实时事件流（Server-Sent Events）
+
+事件来自 file_changes 变更记录，事件ID就是文件列表的版本号：
+    file-created      新上传的文件（不包括下载码）
+    file-updated      修改了私密设置或下载码的文件
+    file-deleted      已删除的文件ID
+    downloads-changed 写回数据库后的下载次数
+    reset             客户端的版本号已无法续传（变更记录已清理或版本号无效），需要重新获取完整列表
+
+每个进程一个 EventHub：后台任务从变更来源（ChangeSource，默认读取共享数据库中的 file_changes）
+按版本号读取新的变更，编码一次后放入内存中的缓冲区，所有连接共享同一份字节串，
+每个连接只记录自己发送到的版本号，空闲连接不占用队列。本进程上传、删除、写回下载次数后调用 notify()
+立即读取；其他进程写入的变更最迟在 SSE_POLL_INTERVAL 秒后读到，多进程部署不需要额外的消息服务。
+
+发送时等待客户端接收（背压），接收慢的连接只是落在缓冲区后面；落后超过缓冲区时改为从变更来源分批补发，
+与带 Last-Event-ID 重连的续传是同一条路径。
+"""
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_right
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from file_changes import changes_table, current_version, oldest_version
+from metrics import event_stream_connections, event_stream_events_total
+from models import FileInfo, User
+
+# 事件流配置（可通过环境变量覆盖）
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))  # 没有事件时发送心跳的间隔（秒），防止代理断开空闲连接
+SSE_POLL_INTERVAL = float(os.getenv("SSE_POLL_INTERVAL", 1))  # 检查其他进程写入的变更的间隔（秒）
+SSE_BUFFER_SIZE = max(1, int(os.getenv("SSE_BUFFER_SIZE", 1024)))  # 内存中保留的最近事件数
+SSE_BATCH_SIZE = max(1, int(os.getenv("SSE_BATCH_SIZE", 200)))  # 每次读取变更和每次发送给一个连接的最多事件数
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", 3000))  # 建议客户端断线后重连的等待时间（毫秒）
+
+files_table = FileInfo.__table__
+users_table = User.__table__
+
+EVENT_NAMES = {
+    "created": "file-created",
+    "updated": "file-updated",
+    "deleted": "file-deleted",
+    "download": "downloads-changed",
+}
+
+HEARTBEAT = b": ping\n\n"
+
+# (版本号, 事件名, 数据)，数据为None表示该变更不需要推送（如文件已经被删除），只推进版本号
+Change = Tuple[int, str, Optional[dict]]
+
+
+def encode_event(version: int, event: str, data: dict) -> bytes:
+    """按SSE格式编码一个事件"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"id: {version}\nevent: {event}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class ChangeSource:
+    """
+    变更来源：读取共享数据库中的 file_changes
+
+    多个进程写入同一个数据库，各进程按版本号读取即可看到全部变更。
+    测试或其他部署方式可以换成实现了同样三个方法的对象。
+    """
+
+    async def current_version(self) -> int:
+        async with AsyncSessionLocal() as db:
+            return await current_version(db)
+
+    async def oldest_version(self) -> int:
+        async with AsyncSessionLocal() as db:
+            return await oldest_version(db)
+
+    async def fetch(self, since: int, limit: int) -> List[Change]:
+        """按版本号顺序读取 since 之后的最多 limit 条变更"""
+        query = (
+            select(changes_table.c.version, changes_table.c.file_id, changes_table.c.change,
+                   files_table.c.id, files_table.c.filename, files_table.c.upload_time, files_table.c.is_private,
+                   files_table.c.file_type, files_table.c.file_size, files_table.c.downloads,
+                   users_table.c.username)
+            .select_from(
+                changes_table
+                .outerjoin(files_table, files_table.c.id == changes_table.c.file_id)
+                .outerjoin(users_table, users_table.c.id == files_table.c.user_id)
+            )
+            .where(changes_table.c.version > since)
+            .order_by(changes_table.c.version)
+            .limit(limit)
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(query)).all()
+        return [(row.version, EVENT_NAMES.get(row.change, "file-updated"), self._event_data(row)) for row in rows]
+
+    @staticmethod
+    def _event_data(row) -> Optional[dict]:
+        if row.change == "deleted":
+            return {"id": row.file_id}
+        if row.id is None:
+            # 文件已经被删除，之后的 file-deleted 事件会通知客户端
+            return None
+        if row.change == "download":
+            return {"id": row.id, "downloads": row.downloads or 0}
+        # 所有登录用户都能看到文件列表，事件中只包含列表中对所有人可见的字段
+        return {
+            "id": row.id,
+            "filename": row.filename,
+            "upload_time": row.upload_time.isoformat() if row.upload_time else None,
+            "uploader": row.username,
+            "is_private": bool(row.is_private),
+            "file_type": row.file_type,
+            "file_size": row.file_size,
+            "downloads": row.downloads or 0,
+        }
+
+
+class EventHub:
+    """
+    一个进程内的事件分发
+
+    缓冲区保存最近 buffer_size 个已编码的事件（版本号和字节串两个列表，按版本号二分查找），
+    buffer_since 之后的事件都在缓冲区中。连接的状态只有一个版本号，等待新事件时共享同一个 Future，
+    空闲连接除了HTTP响应本身只占用一个挂起的生成器。
+    """
+
+    def __init__(self, source=None, buffer_size=SSE_BUFFER_SIZE, batch_size=SSE_BATCH_SIZE,
+                 poll_interval=SSE_POLL_INTERVAL, heartbeat_interval=SSE_HEARTBEAT_INTERVAL):
+        self.source = source or ChangeSource()
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.version = 0
+        self.buffer_since = 0
+        self._versions = []
+        self._payloads = []
+        self._next = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self.connections = 0
+
+    def notify(self):
+        """本进程写入变更并提交后调用，立即读取新的变更"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _append(self, changes: List[Change]):
+        for version, event, data in changes:
+            if data is not None:
+                self._versions.append(version)
+                self._payloads.append(encode_event(version, event, data))
+                event_stream_events_total.inc(event=event)
+            self.version = version
+        # 超出两倍大小时一次删除多余的部分，平时追加不移动列表
+        if len(self._versions) > 2 * self.buffer_size:
+            drop = len(self._versions) - self.buffer_size
+            self.buffer_since = self._versions[drop - 1]
+            del self._versions[:drop]
+            del self._payloads[:drop]
+        # 唤醒所有等待新事件的连接
+        waiting, self._next = self._next, asyncio.get_running_loop().create_future()
+        if waiting is not None and not waiting.done():
+            waiting.set_result(None)
+
+    async def poll(self):
+        """读取变更来源中的新变更，直到没有更多"""
+        while True:
+            changes = await self.source.fetch(self.version, self.batch_size)
+            if changes:
+                self._append(changes)
+            if len(changes) < self.batch_size:
+                return
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.poll()
+            except Exception as e:
+                logging.error(f"Failed to read file changes for event stream: {str(e)}")
+
+    async def start(self):
+        """从当前版本号开始读取变更（在应用启动时调用），启动之前的变更只能通过续传补发"""
+        if self._task is None:
+            self.version = self.buffer_since = await self.source.current_version()
+            self._versions, self._payloads = [], []
+            self._next = asyncio.get_running_loop().create_future()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并结束所有连接（在应用关闭时调用）"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+            if self._next is not None and not self._next.done():
+                self._next.cancel()
+
+    async def _replay(self, cursor: int) -> Tuple[bytes, int]:
+        """从变更来源补发缓冲区之前的一批事件，返回 (编码后的事件, 新的版本号)"""
+        oldest = await self.source.oldest_version()
+        if cursor < oldest - 1:
+            return self._reset(), self.version
+        changes = await self.source.fetch(cursor, self.batch_size)
+        if not changes:
+            return b"", self.buffer_since
+        chunk = b"".join(encode_event(version, event, data) for version, event, data in changes if data is not None)
+        return chunk, changes[-1][0]
+
+    def _reset(self) -> bytes:
+        event_stream_events_total.inc(event="reset")
+        return encode_event(self.version, "reset", {"version": self.version})
+
+    async def stream(self, last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        一个连接的事件流
+
+        Args:
+            last_event_id: 客户端已经收到的版本号（Last-Event-ID），为None时只推送之后的新事件
+
+        Yields:
+            编码后的事件；每次最多 batch_size 个事件，等待客户端接收后再发送下一批
+        """
+        if self._next is None:
+            raise RuntimeError("Event hub is not started")
+        self.connections += 1
+        event_stream_connections.inc()
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+            cursor = self.version if last_event_id is None else last_event_id
+            if cursor > self.version:
+                # 版本号比当前还新（数据库被重建等），无法续传
+                yield self._reset()
+                cursor = self.version
+            while not self._stopping:
+                if cursor < self.buffer_since:
+                    chunk, cursor = await self._replay(cursor)
+                    if chunk:
+                        yield chunk
+                    continue
+                start = bisect_right(self._versions, cursor)
+                if start < len(self._versions):
+                    end = min(start + self.batch_size, len(self._versions))
+                    chunk = b"".join(self._payloads[start:end])
+                    cursor = self._versions[end - 1]
+                    yield chunk
+                    continue
+                cursor = max(cursor, self.version)
+                try:
+                    # shield 使超时只取消本连接的等待，共享的 Future 不受影响，也不为每次等待创建任务
+                    await asyncio.wait_for(asyncio.shield(self._next), timeout=self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                except asyncio.CancelledError:
+                    if self._stopping:
+                        return
+                    raise
+        finally:
+            self.connections -= 1
+            event_stream_connections.dec()
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "buffered_events": len(self._versions),
+            "buffered_bytes": sum(map(len, self._payloads)),
+            "version": self.version,
+        }
+
+
+event_hub = EventHub()
@@ -0,0 +1,93 @@
+"""
+文件列表的版本号和变更记录
+
+上传（包括秒传和分块上传）、删除、修改私密设置和写回下载次数时，在修改文件记录的同一个事务中
+向 file_changes 追加一行，自增的 version 就是文件列表的版本号，只增不减。SQLite同时只有一个写事务，
+版本号的顺序与提交顺序一致：读到版本号 V 时，V 及之前的变更都已经可见。
+
+文件列表接口用版本号生成ETag，没有变化时直接返回304；客户端也可以带上已有的版本号，
+只获取之后新增、修改和删除的文件。变更记录只保留最近 FILE_CHANGES_RETAIN 条，
+更早的版本号需要重新获取完整列表。
+"""
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, select
+
+from models import FileChange
+
+# 变更记录配置（可通过环境变量覆盖）
+FILE_CHANGES_RETAIN = max(1, int(os.getenv("FILE_CHANGES_RETAIN", 100000)))  # 保留的变更记录条数
+FILE_DELTA_MAX_FILES = int(os.getenv("FILE_DELTA_MAX_FILES", 1000))  # 一次增量最多返回的文件数，超出时需要重新获取完整列表
+
+changes_table = FileChange.__table__
+
+
+async def record_changes(db, file_ids: Iterable[int], change: str):
+    """
+    追加变更记录，调用方需要与文件记录的修改在同一个事务中提交
+
+    Args:
+        db: 数据库会话
+        file_ids: 发生变化的文件ID
+        change: created、updated、deleted 或 download（写回下载次数）
+    """
+    now = datetime.now()
+    rows = [{"file_id": file_id, "change": change, "changed_at": now} for file_id in file_ids]
+    if not rows:
+        return
+    await db.execute(insert(changes_table), rows)
+    # 删除超出保留条数的旧记录（按主键范围删除，平时每次只删除与新增相同的条数）
+    await db.execute(
+        delete(changes_table).where(
+            changes_table.c.version <= select(func.max(changes_table.c.version)).scalar_subquery() - FILE_CHANGES_RETAIN
+        )
+    )
+
+
+async def current_version(db) -> int:
+    """当前的文件列表版本号（按主键取最大值，不扫描表）"""
+    return await db.scalar(select(func.max(changes_table.c.version))) or 0
+
+
+async def oldest_version(db) -> int:
+    """仍然保留的最早一条变更记录的版本号，没有记录时返回0"""
+    return await db.scalar(select(func.min(changes_table.c.version))) or 0
+
+
+async def changes_since(db, since: int) -> Tuple[int, Dict[int, bool]]:
+    """
+    查询某个版本之后发生变化的文件
+
+    先读取当前版本号再读取变更：两次查询之间提交的变更也可能包含在结果中，下次同步时会再返回一次，不会遗漏。
+
+    Args:
+        db: 数据库会话
+        since: 客户端已有的版本号
+
+    Returns:
+        (当前版本号, {文件ID: 是否为该版本之后新上传的文件})
+
+    Raises:
+        HTTPException: 版本号之后的变更记录已经被清理、版本号无效或变化的文件超过 FILE_DELTA_MAX_FILES 时返回410，
+            客户端需要重新获取完整列表
+    """
+    version = await current_version(db)
+    if since > version:
+        raise HTTPException(status_code=410, detail="Unknown list version, reload the full list")
+    if since == version:
+        return version, {}
+    oldest = await oldest_version(db)
+    if since < oldest - 1:
+        raise HTTPException(status_code=410, detail="Change log truncated, reload the full list")
+    rows = (await db.execute(
+        select(changes_table.c.file_id, func.max(changes_table.c.change == "created"))
+        .where(changes_table.c.version > since)
+        .group_by(changes_table.c.file_id)
+        .limit(FILE_DELTA_MAX_FILES + 1)
+    )).all()
+    if len(rows) > FILE_DELTA_MAX_FILES:
+        raise HTTPException(status_code=410, detail="Too many changes, reload the full list")
+    return version, {file_id: bool(created) for file_id, created in rows}
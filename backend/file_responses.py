@@ -0,0 +1,255 @@
+import os
+import urllib.parse
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from storage_backend import local_files
+
+# 缓存策略（可通过环境变量覆盖）：公开文件允许共享缓存短时间缓存，私密文件只允许浏览器缓存且每次都要重新验证
+PUBLIC_CACHE_CONTROL = os.getenv("PUBLIC_CACHE_CONTROL", "public, max-age=300")
+PRIVATE_CACHE_CONTROL = os.getenv("PRIVATE_CACHE_CONTROL", "private, no-cache")
+# 缩略图由文件ID和内容唯一确定，内容不会变化，可以长期缓存
+THUMBNAIL_PUBLIC_CACHE_CONTROL = os.getenv("THUMBNAIL_PUBLIC_CACHE_CONTROL", "public, max-age=31536000, immutable")
+THUMBNAIL_PRIVATE_CACHE_CONTROL = os.getenv("THUMBNAIL_PRIVATE_CACHE_CONTROL", "private, max-age=86400")
+MAX_RANGES = int(os.getenv("MAX_RANGES", 16))  # 单个请求最多的范围数，超过时忽略Range返回完整内容
+
+
+def cache_control_for(file) -> str:
+    return PRIVATE_CACHE_CONTROL if file.is_private else PUBLIC_CACHE_CONTROL
+
+
+def thumbnail_cache_control_for(file) -> str:
+    return THUMBNAIL_PRIVATE_CACHE_CONTROL if file.is_private else THUMBNAIL_PUBLIC_CACHE_CONTROL
+
+
+def file_etag(content_hash: Optional[str], stat_result: os.stat_result, suffix: str = "") -> str:
+    """强ETag：按内容存储的文件使用内容哈希，旧文件使用大小和修改时间"""
+    tag = content_hash or f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+    return f'"{tag}{suffix}"'
+
+
+def content_disposition(filename: str, disposition_type: str = "attachment") -> str:
+    """按 RFC 5987 同时提供ASCII文件名和UTF-8文件名，解决中文文件名问题"""
+    ascii_filename = filename.encode("ascii", "ignore").decode("ascii").replace('"', "")
+    encoded_filename = urllib.parse.quote(filename)
+    return f"{disposition_type}; filename=\"{ascii_filename}\"; filename*=UTF-8''{encoded_filename}"
+
+
+def _parse_http_date(value: str) -> Optional[int]:
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 是否包含 etag，按RFC 7232使用弱比较（忽略 W/ 前缀）"""
+    etag = etag[2:] if etag.startswith("W/") else etag
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """处理 If-None-Match / If-Modified-Since，返回是否可以回复304"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # 存在 If-None-Match 时忽略 If-Modified-Since
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(last_modified) <= since
+    return False
+
+
+def if_range_matches(request: Request, etag: str, last_modified: float) -> bool:
+    """处理 If-Range：验证器不匹配时忽略Range，返回完整的新内容"""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # If-Range 要求强比较，弱ETag永远不匹配
+        return if_range == etag
+    since = _parse_http_date(if_range)
+    return since is not None and int(last_modified) == since
+
+
+def parse_range_header(value: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    解析 Range 请求头
+
+    Args:
+        value: Range 请求头的值
+        size: 文件大小
+
+    Returns:
+        排序并合并了重叠部分的 [(起始, 结束)] 列表（包含结束字节）；
+        没有Range或无法解析时返回 None，按RFC 7233忽略该请求头并返回完整内容
+
+    Raises:
+        HTTPException: 所有范围都超出文件大小时返回416
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        start_text, sep, end_text = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if not start_text.strip():
+                # 后缀范围：最后N个字节
+                suffix = int(end_text)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(start_text)
+                if end_text.strip():
+                    end = int(end_text)
+                    if start < 0 or end < start:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, end))
+
+    if not ranges:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    # 合并重叠或相邻的范围，避免同一段内容被重复发送
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def range_includes_start(request: Request) -> bool:
+    """Range 请求是否包含文件开头，用于只在下载开始时计数（续传和分段并行下载的其余部分不计数）"""
+    _, _, spec = request.headers.get("range", "").partition("=")
+    return any(part.strip().startswith("0-") for part in spec.split(","))
+
+
+async def _iter_multipart(iter_range, parts, trailer: bytes):
+    for header, start, end in parts:
+        yield header
+        async for chunk in iter_range(start, end):
+            yield chunk
+        yield b"\r\n"
+    yield trailer
+
+
+def validator_headers(etag: str, last_modified: float, cache_control: str) -> dict:
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+
+async def send_file(
+    request: Request,
+    path,
+    media_type: str,
+    etag: str,
+    cache_control: str,
+    headers: Optional[dict] = None,
+    stat_result: Optional[os.stat_result] = None,
+    last_modified: Optional[float] = None,
+    iter_range: Optional[Callable[[int, int], AsyncIterator[bytes]]] = None
+) -> Response:
+    """
+    返回文件内容，支持条件请求和范围请求
+
+    依次处理 If-None-Match/If-Modified-Since（304）、If-Range、Range：
+    单个范围返回206，多个范围返回 multipart/byteranges，范围全部无效时返回416，否则返回完整内容。
+
+    Args:
+        request: 当前请求
+        path: 本地文件路径；为None时（内容不在本地磁盘上）完整内容也通过 iter_range 读取
+        media_type: 内容类型
+        etag: 强ETag（带引号）
+        cache_control: Cache-Control 策略
+        headers: 额外的响应头（如 Content-Disposition）
+        stat_result: 已获取的文件状态，为空时在线程池中获取
+        last_modified: Last-Modified 时间戳，默认使用文件修改时间
+        iter_range: 按范围读取内容的函数 iter_range(起始, 结束)，默认用本地存储后端的 iter_range 读取 path
+    """
+    if iter_range is None:
+        iter_range = partial(local_files.iter_range, str(path))
+    if stat_result is None:
+        stat_result = await run_in_threadpool(os.stat, path)
+    size = stat_result.st_size
+    if last_modified is None:
+        last_modified = stat_result.st_mtime
+    common = validator_headers(etag, last_modified, cache_control)
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=common)
+
+    ranges = None
+    if if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(request.headers.get("range"), size)
+
+    response_headers = {**(headers or {}), **common}
+    if not ranges:
+        if path is None:
+            response_headers["Content-Length"] = str(size)
+            return StreamingResponse(iter_range(0, size - 1), media_type=media_type, headers=response_headers)
+        return FileResponse(path, media_type=media_type, headers=response_headers, stat_result=stat_result)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response_headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_range(start, end),
+            status_code=206,
+            media_type=media_type,
+            headers=response_headers
+        )
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        (f"--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n".encode(),
+         start, end)
+        for start, end in ranges
+    ]
+    trailer = f"--{boundary}--\r\n".encode()
+    response_headers["Content-Length"] = str(
+        sum(len(header) + end - start + 1 + 2 for header, start, end in parts) + len(trailer)
+    )
+    return StreamingResponse(
+        _iter_multipart(iter_range, parts, trailer),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=response_headers
+    )
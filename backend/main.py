@@ -1,171 +1,161 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Request, Response
-from fastapi.background import BackgroundTasks
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
-from typing import Optional
+import asyncio
+import base64
+import hashlib
 import ipaddress
+import json
+import logging
+import math
 import mimetypes
-import io
-from PIL import Image
-import tempfile
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 import os
+import random
+import string
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import partial
 from pathlib import Path
+from typing import List, Optional, Union
 
-# 注册中文字体
-FONT_PATH = Path(__file__).parent / "fonts"
-FONT_PATH.mkdir(exist_ok=True)
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from jose import JWTError, jwt
+from sqlalchemy import bindparam, delete, func, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
 
-# 下载并注册中文字体（如果不存在）
-def ensure_chinese_font():
-    font_file = FONT_PATH / "simhei.ttf"
-    if not font_file.exists():
-        try:
-            # 如果字体文件不存在，尝试从Windows系统字体目录复制
-            windows_font = Path("C:/Windows/Fonts/simhei.ttf")
-            if windows_font.exists():
-                import shutil
-                shutil.copy(str(windows_font), str(font_file))
-            else:
-                # 如果Windows字体不存在，使用内置的DejaVuSans
-                pdfmetrics.registerFont(TTFont('Chinese', 'DejaVuSans.ttf'))
-                return 'DejaVuSans'
-        except Exception as e:
-            logging.error(f"Font setup error: {e}")
-            # 如果出错，使用内置的DejaVuSans
-            return 'DejaVuSans'
-    
-    try:
-        # 注册字体
-        pdfmetrics.registerFont(TTFont('Chinese', str(font_file)))
-        return 'Chinese'
-    except:
-        # 如果注册失败，使用内置的DejaVuSans
-        logging.error(f"Font setup error: {e}")
-        pdfmetrics.registerFont(TTFont('Chinese', 'DejaVuSans.ttf'))
-        return 'DejaVuSans'
-
-# 转换文本为PDF
-def text_to_pdf(text, font_name='Chinese'):
-    # 创建一个临时文件来保存PDF
+from models import Base, User, FileInfo, Blob, UploadSession, UploadChunk
+from database import AsyncSessionLocal, async_engine, engine, schema_lock
+from migrations import run_migrations
+from activity_log import activity_log, ActivityLogHandler
+from metrics import registry, instrument_engine, MetricsMiddleware, METRICS_ENABLED, METRICS_TOKEN
+from admission import (
+    admission, AdmissionMiddleware, ADMISSION_ENABLED, check_download_code_rate, charge_download_code_failures
+)
+from compression import CompressionMiddleware, COMPRESSION_ENABLED
+from download_counter import download_counter
+from events import event_hub
+from storage_backend import storage
+from zip_stream import ZipEntry, ZipStream, unique_name, ARCHIVE_MAX_FILES
+from preview_cache import preview_cache, thumbnail_cache
+from preview_renderer import (
+    preview_pool, render_text_preview, PREVIEW_MAX_INPUT_SIZE,
+    render_thumbnail, is_thumbnailable, THUMBNAIL_SIZES, THUMBNAIL_EAGER_SIZES,
+    start_page_index, ensure_page_index, index_is_current, read_text_page
+)
+from file_responses import (
+    send_file, file_etag, cache_control_for, thumbnail_cache_control_for, content_disposition,
+    is_not_modified, etag_matches, validator_headers, range_includes_start
+)
+from storage import (
+    read_upload_form, receive_upload_file, preallocate_file, save_chunk_at, hash_file,
+    acquire_blob, release_blob, release_blobs, remove_file, delete_concurrently, detach_contents, restore_contents,
+    MAX_UPLOAD_SIZE, DEFAULT_CHUNK_SIZE, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, UPLOAD_SESSION_TTL_HOURS
+)
+from schemas import (
+    UserCreate, Token, FileInfoResponse, FileInfo as FileInfoSchema,
+    UploadSessionCreate, UploadSessionStatus, InstantUploadCreate, FileListPage, FileListDelta,
+    BulkFileOperation, BulkFileOperationItem, BulkFileOperationResult, ArchiveRequest, UserUsage
+)
+from usage import get_usage, upload_allowance, charge_usage, release_usage
+from file_changes import record_changes, current_version, changes_since
+from auth import (
+    create_access_token, get_current_user, get_password_hash, 
+    verify_password, SECRET_KEY, ALGORITHM, logout_user,
+    check_file_access_permission, check_file_management_permission, invalidate_user_sessions, auth_cache, token_username,
+    get_db  # 与 get_current_user 共用同一个依赖，保证同一请求使用同一个数据库会话
+)
+
+# 可信的反向代理（逗号分隔的IP或网段），只有直接连接来自这些地址时才读取 X-Forwarded-For / X-Real-IP
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1")
+
+
+def _parse_networks(spec):
+    networks = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        networks.append(ipaddress.ip_network(item, strict=False))
+    return networks
+
+
+TRUSTED_PROXY_NETWORKS = _parse_networks(TRUSTED_PROXIES)
+
+
+def _is_trusted_proxy(ip) -> bool:
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            # 创建PDF文档
-            c = canvas.Canvas(tmp_file.name, pagesize=A4)
-            width, height = A4
-            
-            # 设置字体和大小
-            c.setFont(font_name, 12)
-            
-            # 分割文本为行
-            lines = text.split('\n')
-            y = height - 50  # 起始位置（上边距）
-            line_height = 15  # 行高
-            margin = 50  # 左右边距
-            
-            # 写入每一行文本
-            for line in lines:
-                if y < 50:  # 如果到达页面底部
-                    c.showPage()  # 创建新页面
-                    y = height - 50  # 重置y坐标
-                    c.setFont(font_name, 12)  # 重新设置字体
-                
-                # 处理过长的行
-                while len(line) * 7 > (width - 2 * margin):  # 估算行宽
-                    # 按照页面宽度截断行
-                    break_point = int((width - 2 * margin) / 7)
-                    c.drawString(margin, y, line[:break_point])
-                    line = line[break_point:]
-                    y -= line_height
-                    
-                    if y < 50:  # 检查是否需要新页面
-                        c.showPage()
-                        y = height - 50
-                        c.setFont(font_name, 12)
-                
-                # 写入剩余的行或原始行
-                if line:
-                    c.drawString(margin, y, line)
-                    y -= line_height
-            
-            c.save()
-            return tmp_file.name
-    except Exception as e:
-        logging.error(f"Error generating PDF: {e}")
-        return None
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXY_NETWORKS)
+
 
 def get_client_ip(request: Request) -> str:
-    """获取客户端真实IP地址"""
-    # 按优先级尝试获取IP地址
-    forwarded_for = request.headers.get("X-Forwarded-For")
-    if forwarded_for:
-        # X-Forwarded-For 格式可能是: client, proxy1, proxy2
-        # 取第一个合法的IP地址
-        for ip in forwarded_for.split(","):
-            ip = ip.strip()
-            try:
-                # 验证IP地址的合法性
-                ipaddress.ip_address(ip)
-                if not (ip.startswith("127.") or ip.startswith("192.168.") or ip.startswith("10.")):
+    """获取客户端真实IP地址（同一请求只解析一次请求头）"""
+    client_ip = getattr(request.state, "client_ip", None)
+    if client_ip is None:
+        client_ip = request.state.client_ip = _parse_client_ip(request)
+    return client_ip
+
+
+def _parse_client_ip(request: Request) -> str:
+    client_host = request.client.host if request.client else ""
+    # 代理请求头可以由客户端任意填写，只信任来自可信代理的连接，否则每个伪造的IP都会得到新的限流额度
+    if _is_trusted_proxy(client_host):
+        forwarded_for = request.headers.get("X-Forwarded-For")
+        if forwarded_for:
+            # X-Forwarded-For 格式为: client, proxy1, proxy2，每一跳代理在末尾追加上一跳的地址，
+            # 从右向左跳过可信代理，第一个不可信的地址就是客户端（更左边的部分可能是客户端伪造的）
+            for ip in reversed([part.strip() for part in forwarded_for.split(",")]):
+                try:
+                    ipaddress.ip_address(ip)
+                except ValueError:
+                    break
+                if not _is_trusted_proxy(ip):
                     return ip
+
+        real_ip = request.headers.get("X-Real-IP")
+        if real_ip:
+            try:
+                ipaddress.ip_address(real_ip)
+                return real_ip
             except ValueError:
-                continue
-    
-    # 尝试从其他header获取
-    real_ip = request.headers.get("X-Real-IP")
-    if real_ip:
-        try:
-            ipaddress.ip_address(real_ip)
-            return real_ip
-        except ValueError:
-            pass
-    
-    # 如果都没有，返回直接连接的客户端IP
-    client_host = request.client.host
+                pass
+
+    # 返回直接连接的客户端IP
     try:
         ipaddress.ip_address(client_host)
         return client_host
     except ValueError:
         return "unknown"
-    
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
-from typing import List, Optional
-import os
-import random
-import string
-import logging
-from pathlib import Path
-from jose import JWTError, jwt
 
-from models import Base, User, FileInfo
-from database import SessionLocal, engine
-from schemas import UserCreate, Token, FileInfoResponse, FileInfo as FileInfoSchema
-from auth import (
-    create_access_token, get_current_user, get_password_hash, 
-    verify_password, SECRET_KEY, ALGORITHM, logout_user,
-    check_file_access_permission, check_file_management_permission
-)
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
-
-# 配置日志记录
-LOG_DIR = Path("logs")
-LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    filename=LOG_DIR / "user_login.log",
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# 创建数据库表，并执行未执行过的迁移（多个进程同时启动时依次执行）
+with schema_lock():
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
+
+# 配置日志记录：活动日志和其他日志都以JSON Lines格式由后台线程批量写入 logs/activity.log
+logging.basicConfig(level=logging.INFO, handlers=[ActivityLogHandler(activity_log)])
 
 app = FastAPI()
 
+# 约定：所有接口都是 async def，在事件循环上运行并通过异步会话（get_db）访问数据库；
+# 会阻塞的操作（bcrypt、整文件哈希、文本渲染PDF、删除/读取文件等）通过 run_in_threadpool 放到线程池执行。
+
+BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS", 10000))  # 批量操作一次最多处理的文件数（需小于SQLite的变量数上限32766）
+
+# 按 Accept-Encoding 压缩JSON和文本类下载（最内层：准入控制的并发名额包含压缩的CPU时间，指标统计压缩后的字节数）
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# 上传、下载、预览和登录的并发限制与限流，过载时快速返回503/429；
+# 放在CORS之内，拒绝的响应也带有CORS头，浏览器端可以读到 Retry-After
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware, router=app.router, client_ip=get_client_ip, username=token_username)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -175,17 +165,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 创建上传文件目录（使用绝对路径）
-UPLOAD_DIR = Path(__file__).parent.absolute() / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-# 依赖项
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# 请求耗时、字节数和SQL耗时指标，通过 /metrics 导出
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, router=app.router)
+    instrument_engine(engine, "sync")
+    instrument_engine(async_engine.sync_engine, "async")
 
 # 生成随机下载码
 def generate_download_code():
@@ -194,29 +178,24 @@ def generate_download_code():
 
 # 辅助函数：记录用户活动日志
 def log_user_activity(request, action, username, extra_info=None):
-    """统一记录用户活动日志"""
-    client_ip = get_client_ip(request)
-    log_message = f"{action} - Username: {username}, IP: {client_ip}"
-    if extra_info:
-        log_message += f", {extra_info}"
-    logging.info(log_message)
+    """统一记录用户活动日志（放入队列后立即返回，不在请求中写文件）"""
+    activity_log.log(action, user=username, ip=get_client_ip(request), detail=extra_info)
 
 
 # 用户注册
 @app.post("/api/register", response_model=Token)
-def register(request: Request, user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
+async def register(request: Request, user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(User).where(User.username == user.username))
     # 用户名不能重复
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
     db_user = User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     
-    access_token = create_access_token(data={"sub": user.username}, db=db, user=db_user)
+    access_token = await create_access_token(data={"sub": user.username}, db=db, user=db_user)
     
     # 记录注册信息
     log_user_activity(request, "New user registered", user.username)
@@ -226,9 +205,9 @@ def register(request: Request, user: UserCreate, db: Session = Depends(get_db)):
 
 # 用户登录
 @app.post("/api/login", response_model=Token)
-def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == form_data.username))
+    if not user or not await run_in_threadpool(verify_password, form_data.password, user.hashed_password):
         # 记录登录失败信息
         log_user_activity(request, "Failed login attempt", form_data.username)
         raise HTTPException(status_code=400, detail="用户名或密码不正确")
@@ -244,7 +223,7 @@ def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db
             # 如果token已过期，可以继续登录
             logging.info(f"Previous token for user {user.username} has expired")
     
-    access_token = create_access_token(data={"sub": user.username}, db=db, user=user)
+    access_token = await create_access_token(data={"sub": user.username}, db=db, user=user)
     
     # 记录登录成功信息
     log_user_activity(request, "Successful login", user.username)
@@ -254,8 +233,8 @@ def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db
 
 # 用户注销
 @app.post("/api/logout")
-def logout(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    logout_user(db, current_user)
+async def logout(request: Request, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await logout_user(db, current_user)
     # 记录注销信息
     log_user_activity(request, "User logged out", current_user.username)
     return {"message": "Successfully logged out"}
@@ -279,68 +258,120 @@ def get_allowed_extensions():
     }
 
 
+# 辅助函数：校验或生成私密文件的下载码
+def resolve_download_code(is_private, download_code):
+    """私密文件返回用户指定的4位下载码（未指定时随机生成），公开文件返回None"""
+    if not is_private:
+        return None
+    # 验证用户提供的下载码是否符合4位数字要求
+    if download_code:
+        if not (len(download_code) == 4 and download_code.isdigit()):
+            raise HTTPException(
+                status_code=400, 
+                detail="Download code must be exactly 4 digits"
+            )
+        return download_code
+    return generate_download_code()
+
+
+# 辅助函数：检查上传文件的扩展名，返回对应的MIME类型
+def get_upload_file_type(filename):
+    allowed_extensions = get_allowed_extensions()
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in allowed_extensions:
+        raise HTTPException(status_code=400, detail="File type not allowed")
+    return allowed_extensions[file_ext]
+
+
+# 上传表单的结构：接口自行解析表单，这里只用于生成接口文档
+UPLOAD_FORM_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {
+                "file": {"type": "string", "format": "binary"},
+                "is_private": {"type": "boolean", "default": False},
+                "download_code": {"type": "string"},
+            },
+        }}},
+    }
+}
+
+
+# 辅助函数：解析表单中的布尔值（与FastAPI的 Form(bool) 接受的写法一致）
+def parse_form_bool(value, name):
+    if value is None or value == "":
+        return False
+    if isinstance(value, str):
+        if value.lower() in ("1", "true", "on", "yes", "t", "y"):
+            return True
+        if value.lower() in ("0", "false", "off", "no", "f", "n"):
+            return False
+    raise HTTPException(status_code=422, detail=f"Field '{name}' must be a boolean")
+
+
+# 辅助函数：单个上传允许的字节数和超出时的错误信息，取最大上传大小和剩余配额中较小的一个
+def upload_size_limit(remaining):
+    if remaining is not None and (not MAX_UPLOAD_SIZE or remaining < MAX_UPLOAD_SIZE):
+        return remaining, f"Storage quota exceeded. {remaining} bytes remaining"
+    if MAX_UPLOAD_SIZE:
+        return MAX_UPLOAD_SIZE, f"File too large. Maximum size is {MAX_UPLOAD_SIZE} bytes"
+    return None, None
+
+
 # 上传文件
-@app.post("/api/files/upload")
+# 不声明 File/Form 参数：声明后FastAPI会在调用接口之前接收完整个请求体，
+# 这里先检查配额，再边接收边解析表单，超出剩余配额或最大上传大小时尽早中止
+@app.post("/api/files/upload", openapi_extra=UPLOAD_FORM_OPENAPI)
 async def upload_file(
     request: Request,
-    file: UploadFile = File(...),
-    is_private: bool = Form(False),
-    download_code: Optional[str] = Form(None),
     current_user: Optional[User] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    # 检查文件格式
-    allowed_extensions = get_allowed_extensions()
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
 
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in allowed_extensions:
-        raise HTTPException(status_code=400, detail="File type not allowed")
+    max_size, too_large_detail = upload_size_limit(await upload_allowance(db, current_user.id))
+    form = await read_upload_form(request, max_size, too_large_detail)
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=422, detail="Field 'file' is required")
+        is_private = parse_form_bool(form.get("is_private"), "is_private")
+        download_code = form.get("download_code") or None
 
-    # 生成唯一的文件名以避免覆盖
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    unique_filename = f"{timestamp}_{file.filename}"
-    file_path = UPLOAD_DIR / unique_filename
+        # 检查文件格式
+        file_type = get_upload_file_type(file.filename)
 
-    # 保存文件
-    try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+        # 处理私密文件的下载码（在写入文件之前校验，避免留下无用文件）
+        final_download_code = resolve_download_code(is_private, download_code)
 
-    # 处理私密文件的下载码
-    if is_private:
-        # 验证用户提供的下载码是否符合4位数字要求
-        if download_code:
-            if not (len(download_code) == 4 and download_code.isdigit()):
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Download code must be exactly 4 digits"
-                )
-            final_download_code = download_code
-        else:
-            final_download_code = generate_download_code()
-    else:
-        final_download_code = None
+        # 分块流式接收文件，内存占用与文件大小无关
+        try:
+            tmp_path, file_size, content_hash = await receive_upload_file(file, max_size, too_large_detail)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+    finally:
+        await form.close()
 
-    # 保存文件信息到数据库
+    # 按内容哈希存储（相同内容只保存一份），并保存文件信息到数据库
     db_file = FileInfo(
         filename=file.filename,  # 保存原始文件名
-        filepath=str(file_path),  # 保存实际存储路径
         upload_time=datetime.now(),
         user_id=current_user.id,
         is_private=is_private,
         download_code=final_download_code if is_private else None,
-        file_type=allowed_extensions[file_ext],
+        file_type=file_type,
         downloads=0
     )
-    db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
+    await store_file_content(db, db_file, content_hash, file_size, tmp_path)
 
     # 记录文件上传信息
-    log_file_access(request, "uploaded", db_file.id, file.filename, 0, current_user, f"Private: {is_private}")
+    log_file_access(request, "uploaded", db_file.id, file.filename, 0, current_user, f"Private: {is_private}, Size: {file_size}, SHA256: {content_hash}")
 
     return {
         "message": "File uploaded successfully", 
@@ -348,35 +379,603 @@ async def upload_file(
         "download_code": final_download_code if is_private else None
     }
 
+# 辅助函数：把接收完的临时文件放入内容存储，并在同一事务中保存文件记录
+async def store_file_content(db, db_file, content_hash, file_size, tmp_path=None):
+    try:
+        # 用量与文件记录在同一事务中增加，超出配额时返回413
+        await charge_usage(db, db_file.user_id, file_size)
+        # acquire_blob 只做重命名等元数据操作，在会话的同步视图中执行
+        key = await db.run_sync(acquire_blob, content_hash, file_size, tmp_path)
+        db_file.filepath = key  # 保存存储key（相对路径），存储可以整体移动
+        db_file.content_hash = content_hash
+        db_file.file_size = file_size
+        db_file.file_mtime = datetime.fromtimestamp((await run_in_threadpool(storage.stat, key)).st_mtime)
+        db.add(db_file)
+        await db.flush()
+        await record_changes(db, [db_file.id], "created")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        if tmp_path:
+            await run_in_threadpool(remove_file, tmp_path)
+        raise
+    event_hub.notify()
+
+    # 图片上传后在后台预先生成缩略图
+    schedule_thumbnails(db_file)
+
+
+# 辅助函数：释放文件记录对应的内容（内容被多个文件引用时只减少引用计数），并减少文件所有者的用量；
+# 不再被引用的内容移出存储key，返回 detach_contents 的结果，调用方提交之后删除、回滚时放回
+async def remove_file_content(db, file):
+    await release_usage(db, {file.user_id: (file.file_size or 0, 1)})
+    if file.content_hash:
+        key = await db.run_sync(release_blob, file.content_hash)
+        keys = [key] if key else []
+    else:
+        # 旧版本上传、尚未迁移到内容存储的文件，直接删除（文件不存在时忽略）
+        keys = [file.filepath] if file.filepath else []
+    return await run_in_threadpool(detach_contents, keys)
+
+
+# 辅助函数：获取文件内容在存储中的状态，内容不存在时返回404
+async def stat_stored_file(file):
+    try:
+        return await run_in_threadpool(storage.stat, file.filepath)
+    except (OSError, TypeError):
+        raise HTTPException(status_code=404, detail="文件不存在或已被删除")
+
+
+# 辅助函数：发送存储中的文件内容，本地存储直接发送文件，其他存储按范围流式读取
+async def send_stored_file(request, file, media_type, stat_result, headers=None):
+    path = await run_in_threadpool(storage.local_path, file.filepath) if storage.is_local else None
+    return await send_file(
+        request,
+        path,
+        media_type,
+        etag=file_etag(file.content_hash, stat_result),
+        cache_control=cache_control_for(file),
+        headers=headers,
+        stat_result=stat_result,
+        iter_range=partial(storage.iter_range, file.filepath)
+    )
+
+
+# 秒传检查：服务器已有相同内容时客户端无需再上传
+@app.get("/api/blobs/{sha256}")
+async def check_blob_exists(
+    sha256: str,
+    size: int,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    blob = await db.scalar(select(Blob).where(Blob.sha256 == sha256.lower(), Blob.size == size))
+    return {"exists": blob is not None}
+
+
+# 秒传：引用服务器上已有的内容创建文件，不传输文件内容
+@app.post("/api/files/instant")
+async def instant_upload(
+    request: Request,
+    upload: InstantUploadCreate,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    file_type = get_upload_file_type(upload.filename)
+    final_download_code = resolve_download_code(upload.is_private, upload.download_code)
+
+    # 同时校验哈希和大小
+    content_hash = upload.sha256.lower()
+    blob = await db.scalar(select(Blob).where(Blob.sha256 == content_hash, Blob.size == upload.size))
+    if not blob:
+        raise HTTPException(status_code=404, detail="Content not found, please upload the file")
+
+    db_file = FileInfo(
+        filename=upload.filename,
+        upload_time=datetime.now(),
+        user_id=current_user.id,
+        is_private=upload.is_private,
+        download_code=final_download_code,
+        file_type=file_type,
+        downloads=0
+    )
+    # 内容已存在，只增加引用计数
+    await store_file_content(db, db_file, content_hash, upload.size)
+
+    log_file_access(request, "uploaded", db_file.id, db_file.filename, 0, current_user,
+                    f"Private: {db_file.is_private}, Size: {upload.size}, Instant: True")
+
+    return {
+        "message": "File uploaded successfully",
+        "file_id": db_file.id,
+        "download_code": final_download_code
+    }
+
+
+# 辅助函数：获取当前用户的分块上传会话
+async def get_upload_session(db, upload_id, current_user):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    session = await db.scalar(select(UploadSession).where(
+        UploadSession.id == upload_id,
+        UploadSession.user_id == current_user.id
+    ))
+    if not session or session.expires_at < datetime.now():
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    return session
+
+
+# 辅助函数：返回分块上传会话的状态
+async def upload_session_status(db, session):
+    received = list(await db.scalars(
+        select(UploadChunk.chunk_index)
+        .where(UploadChunk.session_id == session.id)
+        .order_by(UploadChunk.chunk_index)
+    ))
+    return UploadSessionStatus(
+        upload_id=session.id,
+        filename=session.filename,
+        size=session.total_size,
+        chunk_size=session.chunk_size,
+        total_chunks=session.total_chunks,
+        received_chunks=received,
+        expires_at=session.expires_at
+    )
+
+
+# 辅助函数：删除分块上传会话及其临时文件
+async def discard_upload_session(db, session):
+    await run_in_threadpool(remove_file, session.temp_path)
+    await db.delete(session)
+
+
+# 清理过期的分块上传会话
+async def purge_expired_upload_sessions(db):
+    expired = (await db.scalars(select(UploadSession).where(UploadSession.expires_at < datetime.now()))).all()
+    for session in expired:
+        await discard_upload_session(db, session)
+    if expired:
+        await db.commit()
+        logging.info(f"Purged {len(expired)} expired upload sessions")
+
+
+@app.on_event("startup")
+async def cleanup_upload_sessions_on_startup():
+    async with AsyncSessionLocal() as db:
+        await purge_expired_upload_sessions(db)
+
+
+# 下载计数的后台写回任务，关闭时写回剩余计数
+@app.on_event("startup")
+async def start_download_counter():
+    download_counter.start()
+
+
+@app.on_event("shutdown")
+async def flush_download_counter():
+    await download_counter.stop()
+
+
+# 事件流的后台读取任务
+@app.on_event("startup")
+async def start_event_hub():
+    await event_hub.start()
+
+
+@app.on_event("shutdown")
+async def stop_event_hub():
+    await event_hub.stop()
+
+
+@app.on_event("shutdown")
+async def stop_preview_pool():
+    preview_pool.shutdown()
+
+
+# 关闭时写入队列中剩余的活动日志
+@app.on_event("shutdown")
+async def flush_activity_log():
+    await run_in_threadpool(activity_log.stop)
+
+
+# 下载计数写回后关闭数据库连接池
+@app.on_event("shutdown")
+async def close_database():
+    await async_engine.dispose()
+
+
+# 分块上传：创建上传会话
+@app.post("/api/uploads", response_model=UploadSessionStatus)
+async def create_upload_session(
+    request: Request,
+    upload: UploadSessionCreate,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    file_type = get_upload_file_type(upload.filename)
+    final_download_code = resolve_download_code(upload.is_private, upload.download_code)
+
+    if upload.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+    # 按声明的大小提前检查配额，完成上传时再以实际用量为准
+    max_size, too_large_detail = upload_size_limit(await upload_allowance(db, current_user.id))
+    if max_size is not None and upload.size > max_size:
+        raise HTTPException(status_code=413, detail=too_large_detail)
+
+    chunk_size = upload.chunk_size or DEFAULT_CHUNK_SIZE
+    if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE} bytes"
+        )
+
+    # 顺便清理过期会话
+    await purge_expired_upload_sessions(db)
+
+    # 预分配临时文件，分块直接写入最终位置，完成时只需重命名
+    upload_id = uuid.uuid4().hex
+    temp_path = storage.staging_path(upload_id)
+    await run_in_threadpool(preallocate_file, temp_path, upload.size)
+
+    now = datetime.now()
+    session = UploadSession(
+        id=upload_id,
+        filename=upload.filename,
+        file_type=file_type,
+        total_size=upload.size,
+        chunk_size=chunk_size,
+        total_chunks=max(1, math.ceil(upload.size / chunk_size)),
+        is_private=upload.is_private,
+        download_code=final_download_code,
+        temp_path=str(temp_path),
+        created_at=now,
+        expires_at=now + timedelta(hours=UPLOAD_SESSION_TTL_HOURS),
+        user_id=current_user.id
+    )
+    db.add(session)
+    await db.commit()
+
+    log_user_activity(request, "Upload session created", current_user.username,
+                      f"Upload ID: {upload_id}, Filename: {upload.filename}, Size: {upload.size}")
+
+    return await upload_session_status(db, session)
+
+
+# 分块上传：查询已接收的分块（用于断点续传）
+@app.get("/api/uploads/{upload_id}", response_model=UploadSessionStatus)
+async def get_upload_session_status(
+    upload_id: str,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    session = await get_upload_session(db, upload_id, current_user)
+    return await upload_session_status(db, session)
+
+
+# 分块上传：上传单个分块，可以乱序、并行上传
+@app.put("/api/uploads/{upload_id}/chunks/{chunk_index}")
+async def upload_chunk(
+    request: Request,
+    upload_id: str,
+    chunk_index: int,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    session = await get_upload_session(db, upload_id, current_user)
+    if not 0 <= chunk_index < session.total_chunks:
+        raise HTTPException(status_code=400, detail="Invalid chunk index")
+
+    offset = chunk_index * session.chunk_size
+    expected_size = min(session.chunk_size, session.total_size - offset)
+    # 客户端可以通过 X-Chunk-SHA256 提供分块校验和，校验通过后分块才会写入组装文件
+    checksum = await save_chunk_at(request.stream(), Path(session.temp_path), offset, expected_size,
+                                   request.headers.get("X-Chunk-SHA256"))
+
+    # 记录已接收的分块（重复上传同一分块时覆盖）
+    chunk = await db.scalar(select(UploadChunk).where(
+        UploadChunk.session_id == session.id,
+        UploadChunk.chunk_index == chunk_index
+    ))
+    if chunk:
+        chunk.size = expected_size
+        chunk.sha256 = checksum
+    else:
+        db.add(UploadChunk(session_id=session.id, chunk_index=chunk_index, size=expected_size, sha256=checksum))
+    session.expires_at = datetime.now() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # 并发上传了同一个分块，另一请求已经记录
+        await db.rollback()
+
+    return {"chunk_index": chunk_index, "size": expected_size, "sha256": checksum}
+
+
+# 分块上传：所有分块上传完成后生成文件记录
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload_session(
+    request: Request,
+    upload_id: str,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    session = await get_upload_session(db, upload_id, current_user)
+    received = await db.scalar(
+        select(func.count()).select_from(UploadChunk).where(UploadChunk.session_id == session.id)
+    )
+    if received != session.total_chunks:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload incomplete. {received} of {session.total_chunks} chunks received"
+        )
+
+    # 分块已经写在预分配的文件中，计算整体哈希后直接重命名到内容存储
+    content_hash = await run_in_threadpool(hash_file, session.temp_path)
+
+    db_file = FileInfo(
+        filename=session.filename,
+        upload_time=datetime.now(),
+        user_id=current_user.id,
+        is_private=session.is_private,
+        download_code=session.download_code,
+        file_type=session.file_type,
+        downloads=0
+    )
+    await db.delete(session)
+    try:
+        await store_file_content(db, db_file, content_hash, session.total_size, Path(session.temp_path))
+    except Exception:
+        # 失败时组装好的文件已经被删除或移入内容存储，会话无法再完成，一并作废，客户端需要重新上传
+        try:
+            await discard_upload_session(db, session)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logging.error(f"Failed to discard upload session {session.id}: {str(e)}")
+        raise
+
+    log_file_access(request, "uploaded", db_file.id, db_file.filename, 0, current_user,
+                    f"Private: {db_file.is_private}, Size: {session.total_size}, Chunked: True")
+
+    return {
+        "message": "File uploaded successfully",
+        "file_id": db_file.id,
+        "download_code": db_file.download_code
+    }
+
+
+# 分块上传：取消上传
+@app.delete("/api/uploads/{upload_id}")
+async def abort_upload_session(
+    upload_id: str,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    session = await get_upload_session(db, upload_id, current_user)
+    await discard_upload_session(db, session)
+    await db.commit()
+    return {"message": "Upload session aborted"}
+
+
+# 文件列表支持的排序字段
+FILE_LIST_SORT_KEYS = {
+    "upload_time": FileInfo.upload_time,
+    "filename": FileInfo.filename,
+    "downloads": FileInfo.downloads,
+}
+
+
+# 辅助函数：编码/解码分页游标，游标记录上一页最后一条记录的 (排序字段值, id)
+def encode_list_cursor(sort, file):
+    value = getattr(file, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, file.id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_list_cursor(sort, cursor):
+    try:
+        value, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if sort == "upload_time":
+            value = datetime.fromisoformat(value)
+        return value, int(file_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# 辅助函数：把文件记录转换为列表中的响应对象
+def to_file_response(file, current_user):
+    return FileInfoResponse(
+        id=file.id,
+        filename=file.filename,
+        upload_time=file.upload_time,
+        uploader=file.user.username,
+        is_private=file.is_private,
+        # 只有文件上传者可以看到下载码
+        download_code=file.download_code if file.user_id == current_user.id else None,
+        # 只使用已写回数据库的下载次数：列表与ETag都只取决于共享的数据库，多个进程返回相同的内容
+        downloads=file.downloads or 0,
+        file_type=file.file_type,
+        file_size=file.file_size,
+        can_preview=is_file_previewable(file.file_type),
+        has_thumbnail=is_thumbnailable(file.file_type)
+    )
+
+
+# 辅助函数：文件列表的ETag
+def file_list_etag(version, current_user, request):
+    """
+    同一个版本号下，列表内容还与当前用户（下载码只对上传者可见）和查询参数有关，一并计入ETag
+
+    版本号来自所有进程共享的 file_changes，下载次数写回数据库时也会增加版本号，
+    因此同一列表在各个进程上的ETag相同；尚未写回的下载次数不计入列表，也不计入ETag。
+    """
+    key = f"{current_user.id}:{sorted(request.query_params.multi_items())}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return f'W/"files-{version}-{digest}"'
+
+
 # 获取文件列表
-@app.get("/api/files", response_model=List[FileInfoResponse])
-def get_files(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/api/files", response_model=Union[FileListPage, FileListDelta, List[FileInfoResponse]])
+async def get_files(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    sort: str = Query("upload_time", pattern="^(upload_time|filename|downloads)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    uploader: Optional[str] = None,
+    file_type: Optional[str] = None,
+    is_private: Optional[bool] = None,
+    q: Optional[str] = None,
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None,
+    since: Optional[int] = Query(None, ge=0),
+    unpaginated: bool = Query(False, alias="all"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    分页获取文件列表
+
+    使用基于 (排序字段, id) 的游标分页，翻页时直接从上一页最后一条记录之后开始查询，
+    耗时与页码无关。传入 all=true 时不分页，返回符合筛选条件的完整列表（默认按上传时间倒序，与旧版本相同）。
+
+    响应带有由文件列表版本号生成的ETag，If-None-Match 匹配时返回304，只需要一次按主键的查询。
+    传入 since=<版本号> 时返回该版本之后新上传、有变化和已删除的文件（按同样的筛选条件），
+    变更记录已被清理或变化过多时返回410，客户端需要重新获取完整列表。
+    """
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+
     # 记录文件列表请求
     log_user_activity(request, "File list requested", current_user.username)
-    
-    # 获取所有文件
-    files = db.query(FileInfo).order_by(FileInfo.upload_time.desc()).all()
-    
-    # 处理文件列表
-    file_list = []
-    for file in files:
-        file_list.append(
-            FileInfoResponse(
-                id=file.id,
-                filename=file.filename,
-                upload_time=file.upload_time,
-                uploader=file.user.username,
-                is_private=file.is_private,
-                # 只有文件上传者可以看到下载码
-                download_code=file.download_code if file.user_id == current_user.id else None,
-                downloads=file.downloads,
-                file_type=file.file_type,
-                can_preview=is_file_previewable(file.file_type)
-            )
+
+    version = await current_version(db)
+    etag = file_list_etag(version, current_user, request)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    # 上传者用户名通过JOIN一次性加载，避免逐条查询
+    query = select(FileInfo).options(joinedload(FileInfo.user))
+
+    # 筛选条件（完整列表、分页和增量使用同样的筛选条件）
+    if uploader:
+        query = query.join(User, FileInfo.user_id == User.id).where(User.username == uploader)
+    if file_type:
+        query = query.where(FileInfo.file_type == file_type)
+    if is_private is not None:
+        query = query.where(FileInfo.is_private == is_private)
+    if q:
+        query = query.where(FileInfo.filename.contains(q, autoescape=True))
+    if uploaded_after:
+        query = query.where(FileInfo.upload_time >= uploaded_after)
+    if uploaded_before:
+        query = query.where(FileInfo.upload_time < uploaded_before)
+
+    sort_column = FILE_LIST_SORT_KEYS[sort]
+    if order == "desc":
+        ordered = query.order_by(sort_column.desc(), FileInfo.id.desc())
+    else:
+        ordered = query.order_by(sort_column.asc(), FileInfo.id.asc())
+
+    if unpaginated:
+        files = (await db.scalars(ordered)).all()
+        return [to_file_response(file, current_user) for file in files]
+
+    if since is not None:
+        # 增量：只查询变化过的文件，已删除或不再符合筛选条件的文件归入 deleted
+        version, changed = await changes_since(db, since)
+        files = (await db.scalars(ordered.where(FileInfo.id.in_(list(changed))))).all() if changed else []
+        found = {file.id for file in files}
+        return FileListDelta(
+            version=version,
+            added=[to_file_response(file, current_user) for file in files if changed[file.id]],
+            changed=[to_file_response(file, current_user) for file in files if not changed[file.id]],
+            deleted=[file_id for file_id in changed if file_id not in found]
         )
-    return file_list
+
+    # 游标：只取排在上一页最后一条记录之后的数据
+    if cursor:
+        value, last_id = decode_list_cursor(sort, cursor)
+        if order == "desc":
+            ordered = ordered.where(tuple_(sort_column, FileInfo.id) < tuple_(value, last_id))
+        else:
+            ordered = ordered.where(tuple_(sort_column, FileInfo.id) > tuple_(value, last_id))
+
+    # 多取一条用于判断是否还有下一页
+    files = (await db.scalars(ordered.limit(limit + 1))).all()
+    has_more = len(files) > limit
+    files = files[:limit]
+
+    return FileListPage(
+        items=[to_file_response(file, current_user) for file in files],
+        next_cursor=encode_list_cursor(sort, files[-1]) if has_more else None,
+        version=version
+    )
+
+# 文件变更的实时事件流
+@app.get("/api/events")
+async def stream_file_events(
+    request: Request,
+    last_event_id: Optional[int] = Query(None, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    以 Server-Sent Events 推送文件的新增、修改、删除和下载次数变化
+
+    事件ID是文件列表的版本号：断线重连时浏览器带上 Last-Event-ID 从断点续传，
+    首次连接时也可以用 last_event_id 传入列表响应中的 version，避免获取列表和建立连接之间的变更被遗漏。
+    无法续传时推送 reset 事件，客户端需要重新获取完整列表。
+    """
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+
+    header = request.headers.get("last-event-id", "").strip()
+    if header.isdigit():
+        last_event_id = int(header)
+
+    log_user_activity(request, "Event stream opened", current_user.username)
+    # 连接会保持很长时间，先把数据库连接还给连接池，续传需要的查询由事件分发使用单独的会话
+    await db.close()
+
+    return StreamingResponse(
+        event_hub.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # 获取文件信息
+# 辅助函数：获取尚未回填大小的旧文件记录的大小
+def get_stored_file_size(file):
+    try:
+        return storage.stat(file.filepath).st_size
+    except (OSError, TypeError):
+        return 0
+
+# 辅助函数：检查文件内容的访问权限；提供了错误的下载码时计入该IP的下载码猜测次数，正确的下载码不计数
+def check_file_access(request, current_user, file, download_code):
+    try:
+        check_file_access_permission(current_user, file, download_code)
+    except HTTPException:
+        if download_code:
+            charge_download_code_failures(get_client_ip(request))
+        raise
+
+
 # 辅助函数：检查文件是否可预览
 def is_file_previewable(file_type):
     """检查文件类型是否支持预览"""
@@ -384,16 +983,16 @@ def is_file_previewable(file_type):
 
 # 辅助函数：记录文件访问日志
 def log_file_access(request, action, file_id, filename, downloads=None, current_user=None, extra_info=None):
-    """统一记录文件访问日志"""
-    client_ip = get_client_ip(request)
-    user_info = f"Username: {current_user.username}" if current_user else "Unauthenticated user"
-    if action == 'downloaded':
-        log_message = f"File {action} - {user_info}, File ID: {file_id}, Filename: {filename}, Downloads: {downloads} IP: {client_ip}"
-    else:
-        log_message = f"File {action} - {user_info}, File ID: {file_id}, Filename: {filename}, IP: {client_ip}"
-    if extra_info:
-        log_message += f", {extra_info}"
-    logging.info(log_message)
+    """统一记录文件访问日志（放入队列后立即返回，不在请求中写文件）"""
+    activity_log.log(
+        f"File {action}",
+        user=current_user.username if current_user else None,
+        ip=get_client_ip(request),
+        file_id=file_id,
+        filename=filename,
+        downloads=downloads if action == 'downloaded' else None,
+        detail=extra_info
+    )
 
 @app.get("/api/files/{file_id}/info")
 async def get_file_info(
@@ -401,19 +1000,23 @@ async def get_file_info(
     file_id: int,
     download_code: str = None,
     current_user: Optional[User] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """获取文件信息"""
     try:
-        file = db.query(FileInfo).filter(FileInfo.id == file_id).first()
+        file = await db.scalar(select(FileInfo).options(joinedload(FileInfo.user)).where(FileInfo.id == file_id))
         if not file:
             raise HTTPException(status_code=404, detail="文件不存在")
         
         # 如果是私密文件，需要验证访问权限 - 不需要检查权限
         # check_file_access_permission(current_user, file, download_code)
+        # 但返回的下载码会说明提供的下载码是否正确，错误的下载码同样计入猜测次数
+        if download_code and file.is_private and download_code != file.download_code \
+                and not (current_user and current_user.id == file.user_id):
+            charge_download_code_failures(get_client_ip(request))
 
         # 记录文件信息访问
-        log_file_access(request, "info accessed", file_id, file.filename, current_user)
+        log_file_access(request, "info accessed", file_id, file.filename, current_user=current_user)
         
         # 返回文件基本信息
         return {
@@ -424,10 +1027,12 @@ async def get_file_info(
             "is_private": file.is_private,
             "file_type": file.file_type,
             "can_preview": is_file_previewable(file.file_type),
+            "has_thumbnail": is_thumbnailable(file.file_type),
             # 只有在以下情况下返回下载码：1.文件所有者 2.提供了正确的下载码
             "download_code": file.download_code if (current_user and current_user.id == file.user_id) or (download_code and download_code == file.download_code) else None,
-            "size": os.path.getsize(file.filepath) if os.path.exists(file.filepath) else 0,
-            "downloads": file.downloads or 0
+            "size": file.file_size if file.file_size is not None else await run_in_threadpool(get_stored_file_size, file),
+            # 数据库中的值加上尚未写回的下载次数
+            "downloads": (file.downloads or 0) + download_counter.pending(file.id)
         }
     except HTTPException:
         raise
@@ -442,23 +1047,21 @@ async def download_file(
     file_id: int,
     download_code: str = None,
     current_user: Optional[User] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """下载文件"""
     try:
-        file = db.query(FileInfo).filter(FileInfo.id == file_id).first()
+        file = await db.get(FileInfo, file_id)
         if not file:
             raise HTTPException(status_code=404, detail="文件不存在")
         
         # 检查访问权限 - 对于公开文件，即使未登录也可以访问
         if file.is_private:
             # 私密文件需要检查权限
-            check_file_access_permission(current_user, file, download_code)
+            check_file_access(request, current_user, file, download_code)
         
         # 检查文件是否存在
-        file_path = Path(file.filepath)
-        if not file_path.is_file():
-            raise HTTPException(status_code=404, detail="文件不存在或已被删除")
+        stat_result = await stat_stored_file(file)
         
         # 确保文件类型正确
         content_type = file.file_type
@@ -466,44 +1069,27 @@ async def download_file(
             # 如果数据库中没有记录文件类型，尝试从文件扩展名推断
             content_type = mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
         
-        # 更新下载次数
-        file.downloads = (file.downloads or 0) + 1
-        db.commit()
-        
-        
-        # 记录下载信息
-        log_file_access(request, "downloaded", file_id, file.filename, file.downloads, current_user)
-        
-        # 获取请求的语言
-        accept_language = request.headers.get("accept-language", "").lower()
-        
-        # 使用 RFC 5987 规范处理文件名编码，解决中文文件名问题
-        # 对于所有用户，优先使用 UTF-8 编码并添加 filename* 参数
-        try:
-            # URL编码文件名（保留空格为%20）
-            import urllib.parse
-            encoded_filename_utf8 = urllib.parse.quote(file.filename)
-            
-            # 提供两种格式的文件名，确保最大兼容性
-            # 1. filename: 基本兼容性 (ASCII 文件名)
-            # 2. filename*: 扩展支持 (RFC 5987, 支持 UTF-8)
-            ascii_filename = file.filename.encode('ascii', 'ignore').decode('ascii')
-            content_disposition = f'attachment; filename="{ascii_filename}"; filename*=UTF-8\'\'{encoded_filename_utf8}'
-        except Exception as e:
-            logging.error(f"Error encoding filename: {str(e)}")
-            # 回退方案：简单编码
-            encoded_filename = file.filename.encode('utf-8').decode('latin-1')
-            content_disposition = f'attachment; filename="{encoded_filename}"'
-        
-        return FileResponse(
-            path=str(file_path),
-            filename=file.filename,
-            media_type=content_type,
-            headers={
-                "Content-Disposition": content_disposition
-            }
+        response = await send_stored_file(
+            request,
+            file,
+            content_type,
+            stat_result,
+            # 使用 RFC 5987 规范处理文件名编码，解决中文文件名问题
+            headers={"Content-Disposition": content_disposition(file.filename)}
         )
-        
+
+        # 只有完整下载或从文件开头开始的范围请求才计入下载次数：
+        # 304、断点续传和分段并行下载的其余部分不重复计数
+        if response.status_code == 200 or (response.status_code == 206 and range_includes_start(request)):
+            # 更新下载次数：只在内存中累加，由后台任务批量写回，下载请求不占用数据库写锁
+            download_counter.increment(file.id)
+            downloads = (file.downloads or 0) + download_counter.pending(file.id)
+
+            # 记录下载信息
+            log_file_access(request, "downloaded", file_id, file.filename, downloads, current_user)
+
+        return response
+
     except HTTPException:
         raise
     except Exception as e:
@@ -511,15 +1097,171 @@ async def download_file(
         raise HTTPException(status_code=500, detail="文件下载失败，请稍后重试")
 
 
+# 打包下载多个文件：边读边生成ZIP，不写临时文件
+@app.post("/api/files/archive")
+async def download_archive(
+    request: Request,
+    archive: ArchiveRequest,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    把多个文件打包为一个ZIP下载
+
+    逐个检查文件的访问权限（私密文件需要是上传者或提供正确的下载码），任何一个文件无法访问时整个请求失败。
+    压缩包在发送过程中生成，内存占用与压缩包大小无关；所有文件都不压缩时返回 Content-Length。
+
+    Raises:
+        HTTPException: 文件列表为空或超过 ARCHIVE_MAX_FILES 时返回400，文件不存在时返回404，无权访问时返回403
+    """
+    ids = list(dict.fromkeys(archive.ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No files selected")
+    if len(ids) > ARCHIVE_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {ARCHIVE_MAX_FILES} files can be archived at once")
+
+    files = {file.id: file for file in await db.scalars(select(FileInfo).where(FileInfo.id.in_(ids)))}
+    missing = [file_id for file_id in ids if file_id not in files]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files not found: {missing}")
+    # 请求体中的下载码不经过中间件的检查：需要下载码才能访问的文件各算一次尝试，该IP剩余的次数不够时拒绝，
+    # 其中错误的下载码计入猜测次数
+    guesses = [
+        file_id for file_id in ids
+        if archive.download_codes.get(file_id) and files[file_id].is_private
+        and not (current_user and current_user.id == files[file_id].user_id)
+    ]
+    client_ip = get_client_ip(request)
+    check_download_code_rate(client_ip, len(guesses))
+    charge_download_code_failures(
+        client_ip, sum(1 for file_id in guesses if archive.download_codes[file_id] != files[file_id].download_code)
+    )
+    for file_id in ids:
+        check_file_access_permission(current_user, files[file_id], archive.download_codes.get(file_id))
+
+    def stat_files():
+        sizes = {}
+        for file_id in ids:
+            try:
+                sizes[file_id] = storage.stat(files[file_id].filepath).st_size
+            except (OSError, TypeError):
+                pass
+        return sizes
+
+    sizes = await run_in_threadpool(stat_files)
+    missing = [file_id for file_id in ids if file_id not in sizes]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Files missing from storage: {missing}")
+
+    used_names = set()
+    entries = [
+        ZipEntry(unique_name(files[file_id].filename, used_names), files[file_id].filepath, sizes[file_id],
+                 files[file_id].upload_time)
+        for file_id in ids
+    ]
+    stream = ZipStream(entries)
+    archive_name = archive.filename or f"files-{datetime.now():%Y%m%d-%H%M%S}.zip"
+    if not archive_name.lower().endswith(".zip"):
+        archive_name += ".zip"
+    headers = {
+        "Content-Disposition": content_disposition(archive_name),
+        "Cache-Control": "private, no-store",
+    }
+    length = stream.content_length()
+    if length is not None:
+        headers["Content-Length"] = str(length)
+
+    # 每个文件计一次下载
+    for file_id in ids:
+        file = files[file_id]
+        download_counter.increment(file.id)
+        downloads = (file.downloads or 0) + download_counter.pending(file.id)
+        log_file_access(request, "downloaded", file.id, file.filename, downloads, current_user,
+                        extra_info=f"Archive: {archive_name}")
+
+    return StreamingResponse(stream, media_type="application/zip", headers=headers)
+
+
 # 获取用户信息
 @app.get("/api/user/me")
-def get_user_info(current_user: User = Depends(get_current_user)):
+async def get_user_info(current_user: User = Depends(get_current_user)):
     return {
         "username": current_user.username,
         "id": current_user.id
     }
 
 
+# 获取当前用户的存储用量和配额
+@app.get("/api/user/me/usage", response_model=UserUsage)
+async def get_user_usage(
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    usage = await get_usage(db, current_user.id)
+    return UserUsage(
+        **usage,
+        storage_remaining=max(0, usage["storage_quota"] - usage["storage_bytes"]) if usage["storage_quota"] is not None else None,
+        file_remaining=max(0, usage["file_quota"] - usage["file_count"]) if usage["file_quota"] is not None else None,
+    )
+
+
+# 辅助函数：文件内容的版本，用作预览和缩略图缓存的key（旧文件没有内容哈希，使用大小和修改时间）
+def content_version(file, stat_result=None):
+    if file.content_hash:
+        return file.content_hash
+    return f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+
+
+# 辅助函数：返回缓存的缩略图，不存在时在渲染进程中生成
+async def get_thumbnail(file, size, stat_result=None):
+    key, max_side = file.filepath, THUMBNAIL_SIZES[size]
+
+    async def render(output_path):
+        # 渲染进程读取本地文件
+        file_path = await run_in_threadpool(storage.local_path, key)
+        await preview_pool.run(render_thumbnail, str(file_path), str(output_path), max_side)
+
+    return await thumbnail_cache.get_or_render(f"{file.id}-{content_version(file, stat_result)}-{size}", render)
+
+
+# 后台任务需要保持引用，否则可能在完成前被回收
+background_tasks = set()
+
+
+def _background_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logging.error(f"Background task failed: {task.exception()}")
+
+
+# 辅助函数：上传图片后在后台预先生成常用尺寸的缩略图
+def schedule_thumbnails(file):
+    # 渲染进程繁忙时不预先生成，留到第一次请求时再生成，避免占用预览请求的渲染能力
+    if not is_thumbnailable(file.file_type) or not file.content_hash or preview_pool.stats()["waiting"]:
+        return
+    for size in THUMBNAIL_EAGER_SIZES:
+        task = asyncio.ensure_future(get_thumbnail(file, size))
+        background_tasks.add(task)
+        task.add_done_callback(_background_task_done)
+
+
+# 辅助函数：执行耗时操作，客户端断开连接时取消
+async def cancel_on_disconnect(request, awaitable, poll_interval=0.5):
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 # 预览文件
 @app.get("/api/files/{file_id}/preview", response_class=HTMLResponse)
 async def preview_file(
@@ -527,10 +1269,10 @@ async def preview_file(
     file_id: int,
     download_code: str = None,
     current_user: Optional[User] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """预览文件"""
-    file = db.query(FileInfo).filter(FileInfo.id == file_id).first()
+    file = await db.get(FileInfo, file_id)
     
     if not file:
         raise HTTPException(status_code=404, detail="文件不存在")
@@ -538,10 +1280,9 @@ async def preview_file(
     # 检查访问权限 - 对于公开文件，即使未登录也可以访问
     if file.is_private:
         # 私密文件需要检查权限
-        check_file_access_permission(current_user, file, download_code)
+        check_file_access(request, current_user, file, download_code)
         
-    if not os.path.exists(file.filepath):
-        raise HTTPException(status_code=404, detail="文件不存在")
+    stat_result = await stat_stored_file(file)
     
     # 检查文件是否可预览
     if not is_file_previewable(file.file_type):
@@ -549,58 +1290,39 @@ async def preview_file(
     
     
     try:
-        # 确保文件路径是绝对路径
-        file_path = Path(file.filepath)
-        if not file_path.is_file():
-            raise HTTPException(status_code=404, detail="文件不存在或已被删除")
+        cache_control = cache_control_for(file)
 
         # 根据文件类型处理预览
-        if file.file_type.startswith('image/'):
-            
-            # 图片文件
-            return FileResponse(
-                path=str(file_path),
-                media_type=file.file_type,
-                filename=file.filename
+        if file.file_type.startswith('image/') or file.file_type == 'application/pdf':
+            # 图片和PDF文件直接返回，支持范围请求（PDF阅读器按需读取页面）
+            return await send_stored_file(
+                request,
+                file,
+                file.file_type,
+                stat_result,
+                headers={"Content-Disposition": content_disposition(file.filename, "inline")}
             )
         elif file.file_type == 'text/plain':
             # 文本文件 - 转换为PDF后预览
-            try:
-                # 首先尝试检测文件编码
-                import chardet
-                
-                # 读取文件的前4096字节来检测编码
-                with open(file_path, 'rb') as f:
-                    raw = f.read(4096)
-                    result = chardet.detect(raw)
-                    encoding = result['encoding']
-                
-                # 如果检测失败，默认尝试 UTF-8
-                if not encoding:
-                    encoding = 'utf-8'
-                
-                # 使用检测到的编码读取文件
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.read()
-                
-                # 确保中文字体可用
-                font_name = ensure_chinese_font()
-                # 转换为PDF
-                pdf_path = text_to_pdf(content, font_name)
-                
-                # 返回生成的PDF文件
-                response = FileResponse(
-                    path=str(pdf_path),
-                    media_type='application/pdf',
-                    filename=f"{os.path.basename(file.filename)}.pdf",
-                    headers={
-                        'Content-Disposition': f'inline; filename="{os.path.basename(file.filename)}.pdf"'
-                    },
-                    # background=BackgroundTasks(lambda: os.unlink(str(pdf_path)))  # 清理临时PDF文件
+            # 生成的PDF由源文件决定，ETag和修改时间沿用源文件；缓存仍然有效时不必重新渲染
+            etag = file_etag(file.content_hash, stat_result, "-pdf")
+            if is_not_modified(request, etag, stat_result.st_mtime):
+                return Response(status_code=304, headers=validator_headers(etag, stat_result.st_mtime, cache_control))
+            if stat_result.st_size > PREVIEW_MAX_INPUT_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"文件过大，无法预览（最大 {PREVIEW_MAX_INPUT_SIZE} 字节）"
                 )
-                tasks = BackgroundTasks()
-                tasks.add_task(os.unlink, str(pdf_path))  # 清理临时PDF文件
-                return response
+            try:
+                # 渲染结果缓存在磁盘上，重复预览只需发送缓存文件；
+                # 编码检测和PDF渲染在渲染进程池中执行，客户端断开连接时取消渲染
+                file_path = await run_in_threadpool(storage.local_path, file.filepath)
+                pdf_path = await cancel_on_disconnect(request, preview_cache.get_or_render(
+                    f"{file.id}-{content_version(file, stat_result)}",
+                    lambda output_path: preview_pool.run(render_text_preview, str(file_path), str(output_path))
+                ))
+            except HTTPException:
+                raise
             except Exception as e:
                 logging.error(f"Error converting text to PDF: {str(e)}")
                 
@@ -608,12 +1330,18 @@ async def preview_file(
                     status_code=400,
                     detail=f"无法转换文件为PDF：{str(e)}"
                 )
-        elif file.file_type == 'application/pdf':
-            # PDF文件
-            return FileResponse(
-                path=str(file_path),
-                media_type='application/pdf',
-                filename=file.filename
+
+            # 返回缓存的PDF文件
+            return await send_file(
+                request,
+                pdf_path,
+                'application/pdf',
+                etag=etag,
+                cache_control=cache_control,
+                headers={
+                    'Content-Disposition': content_disposition(f"{os.path.basename(file.filename)}.pdf", "inline")
+                },
+                last_modified=stat_result.st_mtime
             )
         else:
             raise HTTPException(
@@ -629,95 +1357,350 @@ async def preview_file(
             detail="文件预览失败，请稍后重试"
         )
 
-# 删除文件
-@app.delete("/api/files/{file_id}")
-def delete_file(
+# 获取图片缩略图
+@app.get("/api/files/{file_id}/thumbnail")
+async def get_file_thumbnail(
     request: Request,
     file_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    size: str = Query("md", pattern=f"^({'|'.join(THUMBNAIL_SIZES)})$"),
+    download_code: str = None,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    file = db.query(FileInfo).filter(FileInfo.id == file_id).first()
+    """
+    返回图片的JPEG缩略图（sm/md/lg 分别为最长边128/320/1280像素）
+
+    缩略图在上传后预先生成或在第一次请求时生成，缓存在磁盘上；内容不会变化，响应允许长期缓存。
+    """
+    file = await db.get(FileInfo, file_id)
     if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    # 检查管理权限
-    check_file_management_permission(current_user, file)
-    
-    # 删除物理文件
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    # 检查访问权限 - 对于公开文件，即使未登录也可以访问
+    if file.is_private:
+        check_file_access(request, current_user, file, download_code)
+
+    if not is_thumbnailable(file.file_type):
+        raise HTTPException(status_code=400, detail="此文件类型没有缩略图")
+
+    stat_result = await stat_stored_file(file)
+
+    etag = file_etag(file.content_hash, stat_result, f"-thumb-{size}")
+    cache_control = thumbnail_cache_control_for(file)
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=validator_headers(etag, stat_result.st_mtime, cache_control))
+
     try:
-        os.remove(file.filepath)
-    except OSError:
-        # 如果文件不存在，继续删除数据库记录
-        pass
-    
-    # 删除数据库记录
-    db.delete(file)
-    db.commit()
-    
-    # 记录文件删除信息
-    log_file_access(request, "deleted", file_id, file.filename, current_user)
-    
-    return {"message": "File deleted successfully"}
+        thumbnail_path = await cancel_on_disconnect(request, get_thumbnail(file, size, stat_result))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error generating thumbnail for file {file_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"无法生成缩略图：{str(e)}")
 
-# 批量删除文件
-@app.delete("/api/files/batch")
-def batch_delete_files(
+    return await send_file(
+        request,
+        thumbnail_path,
+        "image/jpeg",
+        etag=etag,
+        cache_control=cache_control,
+        last_modified=stat_result.st_mtime
+    )
+
+
+# 分页预览文本文件
+@app.get("/api/files/{file_id}/preview/text")
+async def preview_text_page(
     request: Request,
-    file_ids: List[int],
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    file_id: int,
+    page: int = Query(1, ge=1),
+    download_code: str = None,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    deleted_files = []
-    failed_files = []
+    """
+    按页返回文本文件的内容
 
-    for file_id in file_ids:
-        file = db.query(FileInfo).filter(FileInfo.id == file_id).first()
-        if not file:
-            failed_files.append({"id": file_id, "reason": "File not found"})
-            continue
+    首次访问时在文件旁边建立页偏移索引，之后每页都直接定位到偏移处读取，
+    耗时和内存与文件大小无关。第一页不等待索引建立，此时 total_pages 为 null。
+    """
+    file = await db.get(FileInfo, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    # 检查访问权限 - 对于公开文件，即使未登录也可以访问
+    if file.is_private:
+        check_file_access(request, current_user, file, download_code)
 
+    if file.file_type != 'text/plain':
+        raise HTTPException(status_code=400, detail="只有文本文件支持分页预览")
+
+    await stat_stored_file(file)
+    file_path = await run_in_threadpool(storage.local_path, file.filepath)
+    index_path = await run_in_threadpool(storage.sidecar_path, file.filepath, ".pages")
+    if page == 1 and not await run_in_threadpool(index_is_current, index_path):
+        # 第一页直接从文件开头读取，索引在后台建立
+        start_page_index(file_path, index_path)
+        index_path = None
+    else:
+        try:
+            await cancel_on_disconnect(request, ensure_page_index(file_path, index_path))
+        except HTTPException:
+            raise
+        except Exception as e:
+            logging.error(f"Error indexing text file {file_id}: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"无法建立文本索引：{str(e)}")
+
+    result = await run_in_threadpool(read_text_page, file_path, index_path, page)
+    if result is None:
+        raise HTTPException(status_code=404, detail="页码超出范围")
+
+    log_file_access(request, "text page previewed", file_id, file.filename, current_user=current_user, extra_info=f"Page: {page}")
+    return result
+
+
+# 批量操作文件
+# 需要声明在 /api/files/{file_id} 之前，否则 "batch" 会被当作文件ID匹配
+async def apply_bulk_operation(request, operation: BulkFileOperation, current_user, db) -> BulkFileOperationResult:
+    """
+    对一组文件执行同一操作
+
+    所有文件通过一条 IN 查询加载并逐个检查权限，修改在同一个事务中完成；
+    删除时不再被引用的存储文件在提交前移出存储key，提交之后（不再持有写锁）由线程池并发删除。
+
+    Args:
+        request: 请求对象（用于记录日志）
+        operation: 文件ID列表和操作
+        current_user: 当前用户
+        db: 数据库会话
+
+    Returns:
+        BulkFileOperationResult: 每个文件的操作结果
+
+    Raises:
+        HTTPException: 未登录、ID数量超过 BULK_MAX_IDS 或下载码格式错误时
+    """
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    ids = list(dict.fromkeys(operation.ids))
+    if len(ids) > BULK_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_IDS} files can be processed at once")
+    if operation.action == "set_private" and operation.download_code:
+        resolve_download_code(True, operation.download_code)
+
+    files = {}
+    if ids:
+        files = {file.id: file for file in await db.scalars(select(FileInfo).where(FileInfo.id.in_(ids)))}
+    results = {}
+    targets = []
+    for file_id in ids:
+        file = files.get(file_id)
+        if file is None:
+            results[file_id] = BulkFileOperationItem(id=file_id, ok=False, detail="File not found")
+            continue
         try:
-            # 检查管理权限
             check_file_management_permission(current_user, file)
+        except HTTPException as e:
+            results[file_id] = BulkFileOperationItem(id=file_id, ok=False, detail=e.detail)
+            continue
+        if operation.action == "regenerate_code" and not file.is_private:
+            results[file_id] = BulkFileOperationItem(id=file_id, ok=False, detail="File is not private")
+            continue
+        targets.append(file)
 
-            # 删除物理文件
-            try:
-                os.remove(file.filepath)
-            except OSError:
-                # 如果文件不存在，继续删除数据库记录
-                pass
+    target_ids = [file.id for file in targets]
+    files_table = FileInfo.__table__
+    codes = {}
+    detached = []
+    try:
+        if operation.action == "delete" and targets:
+            usage = {}
+            for file in targets:
+                size, count = usage.get(file.user_id, (0, 0))
+                usage[file.user_id] = (size + (file.file_size or 0), count + 1)
+            await release_usage(db, usage)
+            ref_counts = Counter(file.content_hash for file in targets if file.content_hash)
+            keys = await db.run_sync(release_blobs, ref_counts)
+            # 旧版本上传、尚未迁移到内容存储的文件直接删除
+            keys.extend(file.filepath for file in targets if not file.content_hash and file.filepath)
+            detached = await run_in_threadpool(detach_contents, keys)
+            await db.execute(delete(files_table).where(files_table.c.id.in_(target_ids)))
+            await record_changes(db, target_ids, "deleted")
+        elif operation.action == "set_public" and targets:
+            await db.execute(
+                update(files_table).where(files_table.c.id.in_(target_ids)).values(is_private=False, download_code=None)
+            )
+        elif operation.action in ("set_private", "regenerate_code") and targets:
+            # 指定了下载码时所有文件使用同一个下载码，否则每个文件各自随机生成；
+            # 设为私密时已经是私密的文件保留原来的下载码
+            for file in targets:
+                keep = operation.action == "set_private" and not operation.download_code and file.is_private and file.download_code
+                codes[file.id] = file.download_code if keep else resolve_download_code(True, operation.download_code)
+            await db.execute(
+                update(files_table)
+                .where(files_table.c.id == bindparam("b_id"))
+                .values(is_private=True, download_code=bindparam("b_code")),
+                [{"b_id": file_id, "b_code": code} for file_id, code in codes.items()]
+            )
+        if operation.action != "delete":
+            await record_changes(db, target_ids, "updated")
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(restore_contents, detached)
+        await db.rollback()
+        raise
+    event_hub.notify()
+    # 会话中已加载的对象与数据库不一致，丢弃
+    db.expunge_all()
+    await delete_concurrently([moved for _, moved in detached])
 
-            # 删除数据库记录
-            db.delete(file)
-            
-            # 记录文件删除信息
-            log_file_access(request, "deleted", file_id, file.filename, current_user)
+    if operation.action == "delete":
+        for file_id in target_ids:
+            download_counter.discard(file_id)
+        await preview_cache.invalidate_many(target_ids)
+        await thumbnail_cache.invalidate_many(target_ids)
 
-            deleted_files.append(file_id)
-        except Exception as e:
-            failed_files.append({"id": file_id, "reason": str(e)})
+    log_action = {"delete": "deleted", "set_private": "made private",
+                  "set_public": "made public", "regenerate_code": "download code regenerated"}[operation.action]
+    for file in targets:
+        log_file_access(request, log_action, file.id, file.filename, current_user=current_user, extra_info="Bulk: True")
+        results[file.id] = BulkFileOperationItem(id=file.id, ok=True, download_code=codes.get(file.id))
+
+    return BulkFileOperationResult(
+        action=operation.action,
+        succeeded=len(targets),
+        failed=len(ids) - len(targets),
+        results=[results[file_id] for file_id in ids]
+    )
 
-    db.commit()
 
+@app.post("/api/files/bulk", response_model=BulkFileOperationResult)
+async def bulk_file_operation(
+    request: Request,
+    operation: BulkFileOperation,
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await apply_bulk_operation(request, operation, current_user, db)
+
+
+# 批量删除文件（兼容旧接口，请求体为文件ID列表）
+@app.delete("/api/files/batch")
+async def batch_delete_files(
+    request: Request,
+    file_ids: List[int],
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await apply_bulk_operation(
+        request, BulkFileOperation(ids=file_ids, action="delete"), current_user, db
+    )
     return {
-        "message": f"Batch delete completed. {len(deleted_files)} files deleted successfully, {len(failed_files)} failed.",
-        "deleted_files": deleted_files,
-        "failed_files": failed_files
+        "message": f"Batch delete completed. {result.succeeded} files deleted successfully, {result.failed} failed.",
+        "deleted_files": [item.id for item in result.results if item.ok],
+        "failed_files": [{"id": item.id, "reason": item.detail} for item in result.results if not item.ok]
     }
 
+
+# 删除文件
+@app.delete("/api/files/{file_id}")
+async def delete_file(
+    request: Request,
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    file = await db.get(FileInfo, file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # 检查管理权限
+    check_file_management_permission(current_user, file)
+    
+    # 释放物理文件（如果文件不存在，继续删除数据库记录）
+    detached = await remove_file_content(db, file)
+    
+    # 删除数据库记录
+    try:
+        await db.delete(file)
+        await record_changes(db, [file_id], "deleted")
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(restore_contents, detached)
+        await db.rollback()
+        raise
+    event_hub.notify()
+    # 提交之后再删除文件，删除时不占用写锁
+    await delete_concurrently([moved for _, moved in detached])
+    download_counter.discard(file_id)
+    await preview_cache.invalidate(file_id)
+    await thumbnail_cache.invalidate(file_id)
+    
+    # 记录文件删除信息
+    log_file_access(request, "deleted", file_id, file.filename, current_user=current_user)
+    
+    return {"message": "File deleted successfully"}
+
 # 更新用户信息
 @app.put("/api/user/me")
-def update_user_info(
+async def update_user_info(
     request: Request,
     new_password: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    current_user.hashed_password = get_password_hash(new_password)
-    db.commit()
+    current_user.hashed_password = await run_in_threadpool(get_password_hash, new_password)
+    await invalidate_user_sessions(db, current_user)
+    await db.commit()
     
     # 记录密码更新信息
     log_user_activity(request, "Password updated", current_user.username)
     
-    return {"message": "Password updated successfully"}
\ No newline at end of file
+    return {"message": "Password updated successfully"}
+
+def _collect_component_stats():
+    """抓取 /metrics 时读取各组件已有的统计"""
+    caches = {"auth": auth_cache.stats(), "preview": preview_cache.stats(), "thumbnail": thumbnail_cache.stats()}
+    pool = preview_pool.stats()
+    log_stats = activity_log.stats()
+    admission_stats = admission.stats()
+    event_stats = event_hub.stats()
+
+    def by_cache(field):
+        return {(name,): stats.get(field, 0) for name, stats in caches.items()}
+
+    return [
+        ("cache_hits_total", "counter", "Cache hits.", by_cache("hits"), ("cache",)),
+        ("cache_misses_total", "counter", "Cache misses.", by_cache("misses"), ("cache",)),
+        ("cache_entries", "gauge", "Entries currently cached.",
+         {(name,): stats.get("entries", stats.get("size", 0)) for name, stats in caches.items()}, ("cache",)),
+        ("cache_bytes", "gauge", "Bytes used by on-disk caches.",
+         {(name,): stats["bytes"] for name, stats in caches.items() if "bytes" in stats}, ("cache",)),
+        ("preview_workers", "gauge", "Render worker processes.", {(): pool["workers"]}, ()),
+        ("preview_workers_busy", "gauge", "Render worker processes running a job.", {(): pool["busy"]}, ()),
+        ("preview_jobs_waiting", "gauge", "Render jobs waiting for an idle worker.", {(): pool["waiting"]}, ()),
+        ("download_counts_pending", "gauge", "Download counts not yet flushed to the database.",
+         {(): download_counter.pending_total()}, ()),
+        ("activity_log_records_total", "counter", "Activity log records by outcome.",
+         {(outcome,): log_stats[outcome] for outcome in ("written", "dropped", "sampled_out")}, ("outcome",)),
+        ("activity_log_queued", "gauge", "Activity log records waiting to be written.", {(): log_stats["queued"]}, ()),
+        ("admission_active", "gauge", "Requests holding a concurrency slot, by route class.",
+         {(name,): stats["active"] for name, stats in admission_stats.items()}, ("route_class",)),
+        ("admission_queued", "gauge", "Requests waiting for a concurrency slot, by route class.",
+         {(name,): stats["queued"] for name, stats in admission_stats.items()}, ("route_class",)),
+        ("event_stream_buffered_events", "gauge", "Encoded events kept in memory for stream connections.",
+         {(): event_stats["buffered_events"]}, ()),
+    ]
+
+
+registry.add_collector(_collect_component_stats)
+
+
+# Prometheus 格式的运行指标
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
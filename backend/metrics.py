@@ -0,0 +1,341 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from starlette.routing import Match
+
+# 指标配置（可通过环境变量覆盖）
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")  # 是否收集指标并开放 /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # 设置后访问 /metrics 需要 Authorization: Bearer <METRICS_TOKEN>
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    """可增可减的当前值"""
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """分桶统计的观测值（耗时等），按Prometheus格式输出累计分桶、总和与次数"""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 每个分桶只记录落在该桶内的次数，输出时再累加，观测时只需一次二分查找
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    指标注册表
+
+    指标在收集时只在内存中累加（一次加锁），抓取 /metrics 时才格式化输出。
+    缓存命中率等已有统计不重复收集，通过 add_collector 注册的函数在抓取时读取。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """
+        注册抓取时调用的函数
+
+        Args:
+            collect: 无参函数，返回 [(指标名, 类型, 说明, {标签元组: 值}, 标签名元组)]
+        """
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, metric_type, documentation, values, labelnames in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in values.items():
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP 请求
+http_requests_total = registry.counter(
+    "http_requests_total", "Total HTTP requests by route template, method and status code.",
+    ("method", "route", "status"))
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time from receiving a request until its response body has been sent.",
+    ("method", "route"))
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests currently being processed.", ("method", "route"))
+http_request_bytes_total = registry.counter(
+    "http_request_bytes_total", "Request body bytes received (uploads).", ("route",))
+http_response_bytes_total = registry.counter(
+    "http_response_bytes_total", "Response body bytes sent (downloads, previews).", ("route",))
+
+# 数据库
+db_queries_total = registry.counter(
+    "db_queries_total", "SQL statements executed, by engine and statement type.", ("engine", "operation"))
+db_query_duration_seconds = registry.histogram(
+    "db_query_duration_seconds", "Time spent executing SQL statements in SQLite.", ("engine", "operation"))
+
+# 磁盘
+disk_io_duration_seconds = registry.histogram(
+    "disk_io_duration_seconds", "Time spent in blocking file I/O per chunk or call.", ("operation",))
+disk_io_bytes_total = registry.counter(
+    "disk_io_bytes_total", "Bytes processed by blocking file I/O.", ("operation",))
+
+# 预览渲染
+preview_render_duration_seconds = registry.histogram(
+    "preview_render_duration_seconds", "Time a render job spent in a worker process, by task and outcome.",
+    ("task", "outcome"))
+preview_queue_wait_seconds = registry.histogram(
+    "preview_queue_wait_seconds", "Time a render job waited for an idle worker process.", ("task",))
+
+# 准入控制
+admission_rejected_total = registry.counter(
+    "admission_rejected_total", "Requests rejected by admission control, by route class and reason.",
+    ("route_class", "reason"))
+admission_queue_wait_seconds = registry.histogram(
+    "admission_queue_wait_seconds", "Time an admitted request waited for a concurrency slot.", ("route_class",))
+
+# 响应压缩
+compression_input_bytes_total = registry.counter(
+    "compression_input_bytes_total", "Response body bytes before compression, by encoding.", ("encoding",))
+compression_output_bytes_total = registry.counter(
+    "compression_output_bytes_total", "Response body bytes after compression, by encoding.", ("encoding",))
+compression_seconds_total = registry.counter(
+    "compression_seconds_total", "Time spent compressing response bodies, by encoding.", ("encoding",))
+
+# 事件流
+event_stream_connections = registry.gauge(
+    "event_stream_connections", "Open server-sent event stream connections.")
+event_stream_events_total = registry.counter(
+    "event_stream_events_total", "Events published to the event stream, by event type.", ("event",))
+
+
+@contextmanager
+def disk_io(operation, size=0):
+    """统计一次阻塞的文件I/O耗时和字节数"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        disk_io_duration_seconds.observe(time.perf_counter() - start, operation=operation)
+        if size:
+            disk_io_bytes_total.inc(size, operation=operation)
+
+
+def _statement_operation(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return keyword if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT") else "OTHER"
+
+
+def instrument_engine(engine, name):
+    """
+    通过 SQLAlchemy 的游标事件统计SQL执行次数和耗时
+
+    Args:
+        engine: 同步引擎（异步引擎传入 async_engine.sync_engine）
+        name: engine 标签的值
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # 开始时间记录在本次执行的上下文上，执行出错时随上下文一起丢弃
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        operation = _statement_operation(statement)
+        db_queries_total.inc(engine=name, operation=operation)
+        db_query_duration_seconds.observe(time.perf_counter() - start, engine=name, operation=operation)
+
+
+class RouteResolver:
+    """把请求解析为路由模板（如 /api/files/{file_id}），没有匹配到路由时返回 unmatched"""
+
+    def __init__(self, router, cache_size=4096):
+        self.router = router
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def __call__(self, scope) -> str:
+        # 逐个匹配路由约需几十微秒，按 (方法, 路径) 缓存结果，缓存满时整体清空
+        key = (scope["method"], scope["path"])
+        route_path = self._cache.get(key)
+        if route_path is None:
+            route_path = "unmatched"
+            for route in self.router.routes:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    route_path = route.path
+                    break
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = route_path
+        return route_path
+
+
+class MetricsMiddleware:
+    """
+    统计每个请求的耗时、状态码、进行中的请求数以及请求体和响应体字节数
+
+    路由标签使用路由模板（如 /api/files/{file_id}），不会因为路径参数产生大量标签；
+    没有匹配到路由的请求统一记为 "unmatched"。
+    """
+
+    def __init__(self, app, router, cache_size=4096):
+        self.app = app
+        self._route_for = RouteResolver(router, cache_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = self._route_for(scope)
+        status = 500
+        start = time.perf_counter()
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                size = len(message.get("body", b""))
+                if size:
+                    http_request_bytes_total.inc(size, route=route)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size = len(message.get("body", b""))
+                if size:
+                    http_response_bytes_total.inc(size, route=route)
+            await send(message)
+
+        http_requests_in_flight.inc(method=method, route=route)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method=method, route=route)
+            http_request_duration_seconds.observe(time.perf_counter() - start, method=method, route=route)
+            http_requests_total.inc(method=method, route=route, status=status)
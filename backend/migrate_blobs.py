@@ -0,0 +1,82 @@
+"""
+把旧版本按 "时间戳_文件名" 保存的上传文件迁移到内容寻址存储
+
+对每条尚未迁移的文件记录重新计算SHA-256，相同内容只保留一份并维护引用计数。
+迁移逐条提交，中途中断后可以直接重新运行。
+
+用法（在backend目录下运行）:
+    python migrate_blobs.py [--dry-run]
+"""
+import argparse
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+from database import SessionLocal, engine
+from migrations import run_migrations
+from models import Base, FileInfo
+from storage import acquire_blob, hash_file, remove_file
+from storage_backend import blob_key, storage
+
+
+def place_blob(src, key):
+    """先用硬链接（不支持时复制）放入内容存储，提交后再删除原文件，中断也不会丢数据"""
+    if storage.exists(key):
+        return
+    staging = storage.staging_path(uuid.uuid4().hex)
+    try:
+        os.link(src, staging)
+    except OSError:
+        shutil.copy2(src, staging)
+    storage.commit(staging, key)
+
+
+def migrate(dry_run=False):
+    # 确保 blobs 表和 content_hash 列已存在
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
+    db = SessionLocal()
+    migrated = missing = saved_bytes = 0
+    seen = set()
+    try:
+        files = db.query(FileInfo).filter(FileInfo.content_hash.is_(None)).order_by(FileInfo.id).all()
+        for file in files:
+            if not file.filepath or not os.path.isfile(file.filepath):
+                missing += 1
+                print(f"[skip] File ID {file.id}: {file.filepath} not found")
+                continue
+
+            size = os.path.getsize(file.filepath)
+            sha256 = hash_file(file.filepath)
+            key = blob_key(sha256)
+            if sha256 in seen or storage.exists(key):
+                saved_bytes += size
+            seen.add(sha256)
+
+            if dry_run:
+                print(f"[dry-run] File ID {file.id}: {file.filepath} -> {key}")
+                continue
+
+            place_blob(file.filepath, key)
+            old_path = file.filepath
+            acquire_blob(db, sha256, size)
+            file.filepath = key
+            file.content_hash = sha256
+            file.file_size = size
+            file.file_mtime = datetime.fromtimestamp(storage.stat(key).st_mtime)
+            db.commit()
+            if os.path.abspath(old_path) != os.path.abspath(storage.local_path(key)):
+                remove_file(old_path)
+            migrated += 1
+    finally:
+        db.close()
+
+    print(f"Migrated: {migrated}, missing: {missing}, duplicate bytes reclaimed: {saved_bytes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移上传文件到内容寻址存储")
+    parser.add_argument("--dry-run", action="store_true", help="只显示将要进行的操作")
+    args = parser.parse_args()
+    migrate(args.dry_run)
@@ -0,0 +1,165 @@
+"""
+把本地存储根目录下平铺的内容文件迁移到按哈希分散的子目录（ab/cd/<sha256>），数据库中改为记录相对key
+
+服务运行期间可以直接执行：每批内容在一个写事务中处理，先更新内容记录取得写锁（并发的上传和删除会等待本批完成），
+再把旧文件硬链接到新位置、更新文件记录并提交。读取时新旧位置都会查找；提交前已经解析出旧路径、
+稍后才打开文件的请求（排队等待渲染的预览等）仍会使用旧路径，因此旧文件在提交后再保留 --grace 秒才删除，
+迁移过程中下载和预览不会失败。每批之后暂停一段时间，让服务的写请求有机会执行。中途中断后可以直接重新运行。
+
+尚未迁移到内容寻址存储的旧文件（没有内容哈希）需要先运行 migrate_blobs.py。
+
+用法（在backend目录下运行）:
+    python migrate_storage.py [--batch-size 200] [--pause 0.1] [--grace 60] [--dry-run]
+"""
+import argparse
+import os
+import shutil
+import time
+from pathlib import Path
+
+from sqlalchemy import bindparam, func, select, update
+
+from database import SQLITE_BUSY_TIMEOUT, SessionLocal, engine
+from migrations import run_migrations
+from models import Base, Blob, FileInfo
+from storage_backend import SHA256_PATTERN, SIDECAR_SUFFIXES, LocalStorage, blob_key, storage
+
+
+def link_or_copy(src: Path, dest: Path):
+    """硬链接到新位置（不支持时复制），旧文件保留到提交之后"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.is_file():
+        return
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        pass
+    except OSError:
+        tmp = dest.with_name(f".{dest.name}.migrate")
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dest)
+
+
+def migrate_batch(db, root: Path, after: str, batch_size: int, dry_run: bool):
+    """
+    迁移哈希大于 after 的一批内容
+
+    Returns:
+        (本批最后一个哈希或None, 已链接到新位置、等待删除的旧文件, 更新的文件记录数)
+    """
+    # 第一条语句就是UPDATE：事务开始即取得写锁，随后读到的内容记录在提交前不会被并发删除或新增
+    batch = select(Blob.sha256).where(Blob.sha256 > after).order_by(Blob.sha256).limit(batch_size)
+    db.execute(
+        update(Blob).where(Blob.sha256.in_(batch.scalar_subquery())).values(ref_count=Blob.ref_count)
+        .execution_options(synchronize_session=False)
+    )
+    hashes = db.scalars(batch).all()
+    if not hashes:
+        return None, 0, 0
+
+    moved = []
+    for sha256 in hashes:
+        flat = root / sha256
+        if not flat.is_file():
+            continue
+        sharded = root / blob_key(sha256)
+        if dry_run:
+            print(f"[dry-run] {flat} -> {sharded}")
+            moved.append(flat)
+            continue
+        link_or_copy(flat, sharded)
+        for suffix in SIDECAR_SUFFIXES:
+            # 派生数据可以重新生成，直接移动
+            sidecar = Path(f"{flat}{suffix}")
+            if sidecar.is_file():
+                os.replace(sidecar, Path(f"{sharded}{suffix}"))
+        moved.append(flat)
+
+    # 只更新还没有改为key的记录（包括旧版本记录的平铺绝对路径）
+    stale = db.execute(
+        select(FileInfo.id, FileInfo.content_hash)
+        .where(FileInfo.content_hash.in_(hashes))
+        .where(FileInfo.filepath != func.substr(FileInfo.content_hash, 1, 2) + "/"
+               + func.substr(FileInfo.content_hash, 3, 2) + "/" + FileInfo.content_hash)
+    ).all()
+    if dry_run:
+        db.rollback()
+        return hashes[-1], moved, len(stale)
+    if stale:
+        db.execute(
+            update(FileInfo.__table__).where(FileInfo.__table__.c.id == bindparam("b_id"))
+            .values(filepath=bindparam("b_key")),
+            [{"b_id": file_id, "b_key": blob_key(sha256)} for file_id, sha256 in stale],
+        )
+    db.commit()
+    return hashes[-1], moved, len(stale)
+
+
+def remove_expired(pending, grace: float, now: float):
+    """删除提交超过 grace 秒的旧文件，pending 按提交时间排序：[(提交时间, [旧文件])]"""
+    while pending and now - pending[0][0] >= grace:
+        for flat in pending.pop(0)[1]:
+            try:
+                os.remove(flat)
+            except FileNotFoundError:
+                pass
+
+
+def migrate(batch_size=200, pause=0.1, grace=60.0, dry_run=False):
+    if not isinstance(storage, LocalStorage):
+        raise SystemExit("migrate_storage.py only applies to the local storage backend")
+    # 确保 blobs 表和 content_hash 列已存在
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
+    root = storage.root
+    db = SessionLocal()
+    moved = updated = batches = 0
+    pending = []
+    after = ""
+    try:
+        while True:
+            started = time.perf_counter()
+            after, batch_moved, batch_updated = migrate_batch(db, root, after, batch_size, dry_run)
+            if after is None:
+                break
+            moved += len(batch_moved)
+            if batch_moved and not dry_run:
+                pending.append((time.monotonic(), batch_moved))
+            remove_expired(pending, grace, time.monotonic())
+            updated += batch_updated
+            batches += 1
+            elapsed = time.perf_counter() - started
+            if elapsed * 1000 > SQLITE_BUSY_TIMEOUT / 2:
+                print(f"[warn] batch took {elapsed:.1f}s, concurrent writes may time out; use a smaller --batch-size")
+            if pause:
+                time.sleep(pause)
+
+        if pending:
+            print(f"Waiting {grace:.0f}s before removing the old files")
+            time.sleep(max(0.0, grace - (time.monotonic() - pending[-1][0])))
+            remove_expired(pending, 0, time.monotonic())
+
+        legacy = db.scalar(select(func.count()).select_from(FileInfo).where(FileInfo.content_hash.is_(None)))
+        # 没有内容记录的平铺文件（引用已全部删除但文件残留）不会被迁移，只报告数量
+        orphans = 0 if dry_run else sum(
+            1 for entry in os.scandir(root) if entry.is_file() and SHA256_PATTERN.match(entry.name)
+        )
+    finally:
+        db.close()
+
+    prefix = "[dry-run] " if dry_run else ""
+    print(f"{prefix}Moved {moved} blob(s), updated {updated} file record(s) in {batches} batch(es)")
+    if orphans:
+        print(f"{orphans} unreferenced file(s) left in {root}")
+    if legacy:
+        print(f"{legacy} file(s) without content hash, run migrate_blobs.py first")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移到按哈希分散的存储目录")
+    parser.add_argument("--batch-size", type=int, default=200, help="每个事务迁移的内容数")
+    parser.add_argument("--pause", type=float, default=0.1, help="每批之间暂停的秒数")
+    parser.add_argument("--grace", type=float, default=60, help="旧文件在提交后保留的秒数")
+    parser.add_argument("--dry-run", action="store_true", help="只打印将要迁移的文件")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.pause, args.grace, args.dry_run)
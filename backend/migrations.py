@@ -0,0 +1,141 @@
+"""
+数据库版本迁移
+
+每个迁移有一个递增的版本号，已执行的版本记录在 schema_migrations 表中，启动时只执行未执行过的迁移。
+所有迁移都可以重复执行（先检查列/索引是否存在），因此新建的数据库（已由 create_all 建好完整结构）
+运行迁移时只会记录版本号。数据回填按批提交，每批只短暂持有写锁，可以在服务运行时执行。
+
+用法（在backend目录下运行）:
+    python migrations.py
+"""
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from database import engine
+from models import FileChange, FileInfo
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def _has_column(conn, table, column):
+    return column in [c["name"] for c in inspect(conn).get_columns(table)]
+
+
+def _add_column(conn, table, column, ddl):
+    if not _has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def add_content_hash(conn):
+    """files 表增加 content_hash 列，指向按内容存储的 blobs"""
+    _add_column(conn, "files", "content_hash", "VARCHAR(64) REFERENCES blobs(sha256)")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_content_hash ON files (content_hash)"))
+
+
+def add_file_metadata_columns(conn):
+    """files 表增加文件大小和修改时间列，避免每次请求都访问磁盘"""
+    _add_column(conn, "files", "file_size", "INTEGER")
+    _add_column(conn, "files", "file_mtime", "DATETIME")
+
+
+def create_file_indexes(conn):
+    """为文件列表和筛选查询创建组合索引（与 models.FileInfo.__table_args__ 保持一致）"""
+    for index in FileInfo.__table__.indexes:
+        columns = ", ".join(column.name for column in index.columns)
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index.name} ON files ({columns})"))
+
+
+def backfill_file_metadata(conn):
+    """分批回填已有文件的大小和修改时间"""
+    # 使用独立连接分批提交，避免长时间持有写锁；只访问本迁移涉及的列，不依赖之后的模型结构
+    last_id = 0
+    while True:
+        with engine.begin() as batch_conn:
+            rows = batch_conn.execute(
+                text("SELECT id, filepath FROM files WHERE id > :last_id AND file_size IS NULL ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}
+            ).all()
+            if not rows:
+                break
+            for file_id, filepath in rows:
+                try:
+                    stat = os.stat(filepath)
+                    size, mtime = stat.st_size, datetime.fromtimestamp(stat.st_mtime)
+                except (OSError, TypeError):
+                    # 文件已丢失，记为0避免重复检查
+                    size, mtime = 0, None
+                batch_conn.execute(
+                    text("UPDATE files SET file_size = :size, file_mtime = :mtime WHERE id = :id"),
+                    {"size": size, "mtime": mtime, "id": file_id}
+                )
+        last_id = rows[-1][0]
+
+
+def add_token_generation(conn):
+    """users 表增加 token_generation 列，用于跨进程使认证缓存失效"""
+    _add_column(conn, "users", "token_generation", "INTEGER DEFAULT 0")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_token_generation ON users (token_generation)"))
+
+
+def add_user_usage_columns(conn):
+    """users 表增加存储用量计数和配额列"""
+    _add_column(conn, "users", "storage_bytes", "INTEGER DEFAULT 0")
+    _add_column(conn, "users", "file_count", "INTEGER DEFAULT 0")
+    _add_column(conn, "users", "storage_quota", "INTEGER")
+    _add_column(conn, "users", "file_quota", "INTEGER")
+
+
+def backfill_user_usage(conn):
+    """按已有的文件记录分批统计每个用户的用量"""
+    from usage import reconcile_usage
+    reconcile_usage(engine, BACKFILL_BATCH_SIZE)
+
+
+def create_file_changes(conn):
+    """创建文件列表的变更记录表（文件列表版本号和增量同步）"""
+    FileChange.__table__.create(conn, checkfirst=True)
+
+
+# (版本号, 迁移函数)，只能在末尾追加
+MIGRATIONS = [
+    (1, add_content_hash),
+    (2, add_file_metadata_columns),
+    (3, create_file_indexes),
+    (4, backfill_file_metadata),
+    (5, add_token_generation),
+    (6, add_user_usage_columns),
+    (7, backfill_user_usage),
+    (8, create_file_changes),
+]
+
+
+def run_migrations():
+    """执行所有未执行过的迁移"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations "
+            "(version INTEGER PRIMARY KEY, name VARCHAR, applied_at DATETIME)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        logging.info(f"Applying migration {version}: {migration.__name__}")
+        with engine.begin() as conn:
+            migration(conn)
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": migration.__name__, "applied_at": datetime.now()}
+            )
+
+
+if __name__ == "__main__":
+    from models import Base
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -9,10 +9,24 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     active_token = Column(String, nullable=True)  # 存储当前活跃的token
+    token_generation = Column(Integer, default=0, index=True)  # 会话变化时递增，用于通知其他进程使认证缓存失效
+    storage_bytes = Column(Integer, default=0)  # 已保存文件的总字节数，随上传和删除在同一事务中增减
+    file_count = Column(Integer, default=0)  # 已保存的文件数
+    storage_quota = Column(Integer, nullable=True)  # 存储空间配额（字节），为空时使用默认配额，0表示不限制
+    file_quota = Column(Integer, nullable=True)  # 文件数配额，为空时使用默认配额，0表示不限制
     files = relationship("FileInfo", back_populates="user")
+    upload_sessions = relationship("UploadSession", back_populates="user")
 
 class FileInfo(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # 与文件列表的排序/筛选/游标条件对应的组合索引
+        Index("ix_files_upload_time_id", "upload_time", "id"),
+        Index("ix_files_user_id_upload_time", "user_id", "upload_time", "id"),
+        Index("ix_files_is_private_upload_time", "is_private", "upload_time", "id"),
+        Index("ix_files_file_type_upload_time", "file_type", "upload_time", "id"),
+        Index("ix_files_filename_id", "filename", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String)
@@ -22,5 +36,59 @@ class FileInfo(Base):
     download_code = Column(String(4), nullable=True)  # 限制为4位
     file_type = Column(String)  # 存储文件类型
     downloads = Column(Integer, default=0)  # 下载次数
+    content_hash = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True)  # 文件内容的SHA-256
+    file_size = Column(Integer, nullable=True)  # 文件大小（字节），上传时记录
+    file_mtime = Column(DateTime, nullable=True)  # 存储文件的修改时间
     user_id = Column(Integer, ForeignKey("users.id"))
-    user = relationship("User", back_populates="files")
\ No newline at end of file
+    user = relationship("User", back_populates="files")
+
+class Blob(Base):
+    """按内容寻址存储的文件内容，多个 FileInfo 可以引用同一份内容"""
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0)  # 引用该内容的文件记录数，为0时删除
+    created_at = Column(DateTime)
+
+class FileChange(Base):
+    """文件列表的变更记录：每次上传、删除、修改私密设置或写回下载次数都追加一行，最大的 version 即文件列表的版本号"""
+    __tablename__ = "file_changes"
+    # AUTOINCREMENT：删除旧记录后版本号也不会重复使用，保证单调递增
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    version = Column(Integer, primary_key=True)
+    file_id = Column(Integer)
+    change = Column(String(8))  # created、updated、deleted 或 download（写回下载次数）
+    changed_at = Column(DateTime)
+
+class UploadSession(Base):
+    """分块上传会话，记录一次可续传的上传"""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, index=True)  # 随机生成的上传ID
+    filename = Column(String)
+    file_type = Column(String)
+    total_size = Column(Integer)
+    chunk_size = Column(Integer)
+    total_chunks = Column(Integer)
+    is_private = Column(Boolean, default=False)
+    download_code = Column(String(4), nullable=True)
+    temp_path = Column(String)  # 预分配的临时文件，分块直接写入对应偏移
+    created_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)  # 过期后会被清理
+    user_id = Column(Integer, ForeignKey("users.id"))
+    user = relationship("User", back_populates="upload_sessions")
+    chunks = relationship("UploadChunk", back_populates="session", cascade="all, delete-orphan")
+
+class UploadChunk(Base):
+    """分块上传会话中已接收的分块"""
+    __tablename__ = "upload_chunks"
+    __table_args__ = (UniqueConstraint("session_id", "chunk_index"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, ForeignKey("upload_sessions.id"), index=True)
+    chunk_index = Column(Integer)
+    size = Column(Integer)
+    sha256 = Column(String(64))  # 分块校验和
+    session = relationship("UploadSession", back_populates="chunks")
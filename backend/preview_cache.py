@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+from storage import remove_file
+
+# 预览缓存配置（可通过环境变量覆盖）
+PREVIEW_CACHE_DIR = Path(os.getenv("PREVIEW_CACHE_DIR", Path(__file__).parent.absolute() / "preview_cache"))
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", 512 * 1024 * 1024))  # 缓存目录的总大小上限，默认512MB
+THUMBNAIL_CACHE_DIR = Path(os.getenv("THUMBNAIL_CACHE_DIR", Path(__file__).parent.absolute() / "thumbnails"))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 1024 * 1024 * 1024))  # 缩略图缓存的总大小上限，默认1GB
+
+
+class PreviewCache:
+    """
+    渲染好的预览文件（文本转PDF、缩略图）的磁盘缓存
+
+    缓存文件以 "文件ID-内容版本" 命名，内容版本是内容哈希（旧文件为大小和修改时间），
+    因此内容变化后旧缓存自然失效。总大小超过 PREVIEW_CACHE_MAX_BYTES 时按最近使用时间淘汰，
+    使用时间记录在缓存文件的修改时间上，重启后可以恢复LRU顺序。
+    同一个key的并发请求只渲染一次，其余请求等待同一次渲染的结果；所有等待的请求都取消后渲染也随之取消。
+    """
+
+    def __init__(self, directory=PREVIEW_CACHE_DIR, max_bytes=PREVIEW_CACHE_MAX_BYTES, suffix=".pdf"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> 文件大小，按最近使用排序
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._load()
+
+    def _load(self):
+        """启动时扫描缓存目录，按修改时间恢复LRU顺序，并删除上次渲染中断留下的临时文件"""
+        found = []
+        for path in self.directory.iterdir():
+            if path.name.startswith("."):
+                remove_file(path)
+            elif path.suffix == self.suffix:
+                stat = path.stat()
+                found.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def path_for(self, key) -> Path:
+        return self.directory / f"{key}{self.suffix}"
+
+    def _add(self, key, size):
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+
+    def _drop(self, key):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+
+    def _touch(self, key, path) -> bool:
+        """命中时更新使用时间；文件可能已被其他进程淘汰，此时视为未命中"""
+        try:
+            os.utime(path)
+        except OSError:
+            self._drop(key)
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True
+        # 其他进程生成的缓存文件
+        self._add(key, os.path.getsize(path))
+        return True
+
+    def _evict(self, keep=None):
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes:
+                    return
+                key = next((k for k in self._entries if k != keep), None)
+                if key is None:
+                    return
+                self._total_bytes -= self._entries.pop(key)
+            remove_file(self.path_for(key))
+
+    def _commit(self, key, tmp_path: Path, path: Path):
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self._add(key, size)
+        self._evict(keep=key)
+
+    async def _render(self, key, path: Path, render):
+        tmp_path = self.directory / f".{uuid.uuid4().hex}.tmp"
+        try:
+            await render(tmp_path)
+            await run_in_threadpool(self._commit, key, tmp_path, path)
+        except BaseException:
+            await run_in_threadpool(remove_file, tmp_path)
+            raise
+        return path
+
+    async def get_or_render(self, key, render) -> Path:
+        """
+        返回缓存的预览文件，不存在时生成
+
+        Args:
+            key: 缓存key（文件ID-内容版本）
+            render: 异步函数 render(输出路径)，把预览写入给定路径
+
+        Returns:
+            缓存文件路径
+        """
+        path = self.path_for(key)
+        if await run_in_threadpool(self._touch, key, path):
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.ensure_future(self._render(key, path, render))
+            inflight = self._inflight[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        task = inflight["task"]
+        inflight["waiters"] += 1
+        try:
+            # 单个请求被取消时不影响其他等待同一结果的请求，最后一个请求取消时才取消渲染
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if inflight["waiters"] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            inflight["waiters"] -= 1
+
+    def _invalidate(self, file_id):
+        prefix = f"{file_id}-"
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            self._drop(key)
+        # 也删除其他进程生成、本进程尚未记录的缓存文件
+        for path in self.directory.glob(f"{prefix}*{self.suffix}"):
+            remove_file(path)
+
+    async def invalidate(self, file_id):
+        """文件删除后删除其所有预览缓存"""
+        try:
+            await run_in_threadpool(self._invalidate, file_id)
+        except OSError as e:
+            logging.error(f"Failed to invalidate preview cache for file {file_id}: {str(e)}")
+
+    def _invalidate_many(self, file_ids):
+        # 一次遍历缓存记录和缓存目录，而不是每个文件各 glob 一次整个目录
+        file_ids = {str(file_id) for file_id in file_ids}
+        with self._lock:
+            keys = [key for key in self._entries if key.split("-", 1)[0] in file_ids]
+        for key in keys:
+            self._drop(key)
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.endswith(self.suffix) and name.split("-", 1)[0] in file_ids:
+                    remove_file(entry.path)
+
+    async def invalidate_many(self, file_ids):
+        """批量删除文件后删除这些文件的所有预览缓存"""
+        if not file_ids:
+            return
+        try:
+            await run_in_threadpool(self._invalidate_many, file_ids)
+        except OSError as e:
+            logging.error(f"Failed to invalidate preview cache for {len(file_ids)} files: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+preview_cache = PreviewCache()
+thumbnail_cache = PreviewCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, suffix=".jpg")
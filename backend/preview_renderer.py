@@ -0,0 +1,552 @@
+"""
+文本预览渲染
+
+文本转PDF（编码检测 + reportlab 渲染）是CPU密集的操作，在独立的渲染进程池中执行，
+不占用API进程的事件循环和GIL。渲染进程启动时注册一次中文字体，之后一直复用。
+
+大文本文件使用分页预览：首次访问时扫描一遍文件，在文件旁边保存每页的起始偏移，
+之后按页定位读取，耗时和内存与文件大小无关。
+"""
+import asyncio
+import codecs
+import functools
+import logging
+import mmap
+import multiprocessing
+import os
+import tempfile
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import chardet
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from starlette.concurrency import run_in_threadpool
+
+from metrics import preview_queue_wait_seconds, preview_render_duration_seconds
+
+# 渲染进程池配置（可通过环境变量覆盖）
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", os.cpu_count() or 2))  # 渲染进程数
+PREVIEW_QUEUE_SIZE = int(os.getenv("PREVIEW_QUEUE_SIZE", 32))  # 等待空闲渲染进程的最大任务数，超出时返回503
+PREVIEW_RENDER_TIMEOUT = float(os.getenv("PREVIEW_RENDER_TIMEOUT", 60))  # 单个渲染任务的超时时间（秒）
+PREVIEW_MAX_INPUT_SIZE = int(os.getenv("PREVIEW_MAX_INPUT_SIZE", 20 * 1024 * 1024))  # 允许预览的文本文件最大字节数
+
+# 文本分页预览配置
+PREVIEW_PAGE_LINES = int(os.getenv("PREVIEW_PAGE_LINES", 200))  # 每页最多行数
+PREVIEW_PAGE_BYTES = int(os.getenv("PREVIEW_PAGE_BYTES", 64 * 1024))  # 每页最多字节数（超长的行会被拆分到多页）
+PREVIEW_INDEX_TIMEOUT = float(os.getenv("PREVIEW_INDEX_TIMEOUT", 600))  # 建立分页索引的超时时间（秒）
+
+# 缩略图配置：尺寸名 -> 最长边像素
+THUMBNAIL_SIZES = {"sm": 128, "md": 320, "lg": 1280}
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 85))  # JPEG质量
+THUMBNAIL_TYPES = {"image/jpeg", "image/png"}
+# 上传后预先生成的尺寸，其余尺寸在第一次请求时生成
+THUMBNAIL_EAGER_SIZES = [size for size in os.getenv("THUMBNAIL_EAGER_SIZES", "sm,md").split(",") if size in THUMBNAIL_SIZES]
+
+# 注册中文字体
+FONT_PATH = Path(__file__).parent / "fonts"
+FONT_PATH.mkdir(exist_ok=True)
+
+# 已注册的字体名，每个进程只注册一次（渲染进程在启动时注册）
+_registered_font = None
+
+# 下载并注册中文字体（如果不存在）
+def ensure_chinese_font():
+    global _registered_font
+    if _registered_font is None:
+        _registered_font = _register_chinese_font()
+    return _registered_font
+
+def _register_chinese_font():
+    font_file = FONT_PATH / "simhei.ttf"
+    if not font_file.exists():
+        try:
+            # 如果字体文件不存在，尝试从Windows系统字体目录复制
+            windows_font = Path("C:/Windows/Fonts/simhei.ttf")
+            if windows_font.exists():
+                import shutil
+                shutil.copy(str(windows_font), str(font_file))
+            else:
+                # 如果Windows字体不存在，使用内置的DejaVuSans
+                pdfmetrics.registerFont(TTFont('Chinese', 'DejaVuSans.ttf'))
+                return 'DejaVuSans'
+        except Exception as e:
+            logging.error(f"Font setup error: {e}")
+            # 如果出错，使用内置的DejaVuSans
+            return 'DejaVuSans'
+    
+    try:
+        # 注册字体
+        pdfmetrics.registerFont(TTFont('Chinese', str(font_file)))
+        return 'Chinese'
+    except Exception as e:
+        # 如果注册失败，使用内置的DejaVuSans
+        logging.error(f"Font setup error: {e}")
+        pdfmetrics.registerFont(TTFont('Chinese', 'DejaVuSans.ttf'))
+        return 'DejaVuSans'
+
+# 转换文本为PDF
+def text_to_pdf(text, font_name='Chinese', output_path=None):
+    try:
+        if output_path is None:
+            # 未指定输出路径时创建一个临时文件来保存PDF
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+                output_path = tmp_file.name
+
+        # 创建PDF文档
+        # invariant 使相同文本生成的PDF字节完全相同，范围请求可以跨多次渲染使用同一个ETag
+        c = canvas.Canvas(str(output_path), pagesize=A4, invariant=1)
+        width, height = A4
+        
+        # 设置字体和大小
+        c.setFont(font_name, 12)
+        
+        # 分割文本为行
+        lines = text.split('\n')
+        y = height - 50  # 起始位置（上边距）
+        line_height = 15  # 行高
+        margin = 50  # 左右边距
+        
+        # 写入每一行文本
+        for line in lines:
+            if y < 50:  # 如果到达页面底部
+                c.showPage()  # 创建新页面
+                y = height - 50  # 重置y坐标
+                c.setFont(font_name, 12)  # 重新设置字体
+            
+            # 处理过长的行
+            while len(line) * 7 > (width - 2 * margin):  # 估算行宽
+                # 按照页面宽度截断行
+                break_point = int((width - 2 * margin) / 7)
+                c.drawString(margin, y, line[:break_point])
+                line = line[break_point:]
+                y -= line_height
+                
+                if y < 50:  # 检查是否需要新页面
+                    c.showPage()
+                    y = height - 50
+                    c.setFont(font_name, 12)
+            
+            # 写入剩余的行或原始行
+            if line:
+                c.drawString(margin, y, line)
+                y -= line_height
+        
+        c.save()
+        return str(output_path)
+    except Exception as e:
+        logging.error(f"Error generating PDF: {e}")
+        return None
+
+# 把文本文件转换为PDF，返回PDF路径（在渲染进程中执行）
+def render_text_preview(file_path, output_path=None):
+    # 首先尝试检测文件编码
+    # 读取文件的前4096字节来检测编码
+    with open(file_path, 'rb') as f:
+        raw = f.read(4096)
+        result = chardet.detect(raw)
+        encoding = result['encoding']
+    
+    # 如果检测失败，默认尝试 UTF-8
+    if not encoding:
+        encoding = 'utf-8'
+    
+    # 使用检测到的编码读取文件
+    with open(file_path, 'r', encoding=encoding) as f:
+        content = f.read()
+    
+    # 确保中文字体可用
+    font_name = ensure_chinese_font()
+    # 转换为PDF
+    pdf_path = text_to_pdf(content, font_name, output_path)
+    if not pdf_path:
+        raise ValueError("PDF生成失败")
+    return pdf_path
+
+
+def is_thumbnailable(file_type):
+    return file_type in THUMBNAIL_TYPES
+
+
+def render_thumbnail(file_path, output_path, max_side, quality=THUMBNAIL_QUALITY):
+    """生成最长边不超过 max_side 的JPEG缩略图（在渲染进程中执行）"""
+    with Image.open(file_path) as image:
+        # JPEG在解码时直接按1/2、1/4、1/8缩小，大图不需要完整解码；其他格式忽略
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        # reducing_gap 先用整数倍的 reduce 快速缩小，再做高质量重采样
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if image.mode in ("RGBA", "LA", "P"):
+            # 透明背景填充为白色
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(output_path, "JPEG", quality=quality, optimize=True)
+    return str(output_path)
+
+
+# 页偏移索引格式：[每页行数, 每页字节数, 格式版本, 编码名称（32字节，不足补0）, 第1页起始偏移, 第2页起始偏移, ..., 文件大小]，
+# 除编码名称外均为8字节无符号整数；编码在建立索引时检测一次，每页都按同一编码解码
+_INDEX_ITEM_SIZE = array("Q").itemsize
+_INDEX_VERSION = 3
+_INDEX_ENCODING_BYTES = 32
+_INDEX_HEADER = 3 + _INDEX_ENCODING_BYTES // _INDEX_ITEM_SIZE
+
+
+def _char_boundary(data, start, limit, encoding):
+    """[start, limit) 中最后一个完整字符的结束偏移（start 必须在字符边界上）"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    decoder.decode(data[start:limit])
+    end = limit - len(decoder.getstate()[0])
+    return end if end > start else limit
+
+
+def _newline(encoding):
+    """编码后的换行符（不含BOM），其长度也是查找换行时需要对齐的编码单元宽度（UTF-16为2，UTF-32为4）"""
+    one, two = "\n".encode(encoding), "\n\n".encode(encoding)
+    return two[len(two) - (len(two) - len(one)):]
+
+
+def _find_newline(data, newline, start, limit):
+    """在 [start, limit) 中查找与编码单元对齐的换行符（start 必须对齐），返回换行符之后的偏移，找不到时返回-1"""
+    width = len(newline)
+    position = data.find(newline, start, limit)
+    while position >= 0 and (position - start) % width:
+        position = data.find(newline, position + 1, limit)
+    return position + width if position >= 0 else -1
+
+
+def _page_end(data, start, limit, page_lines=PREVIEW_PAGE_LINES, encoding="utf-8", at_eof=True):
+    """
+    从 start 开始的一页的结束偏移：第 page_lines 个换行之后（换行符按文件的编码查找）
+
+    不足 page_lines 行就到达 limit（且 limit 不是文件末尾）时，在最后一个换行之后分页；
+    一行都没有结束时退回到最后一个完整字符之后，多字节字符不会被拆到两页。
+    """
+    newline = _newline(encoding)
+    end = start
+    for _ in range(page_lines):
+        position = _find_newline(data, newline, end, limit)
+        if position < 0:
+            break
+        end = position
+    else:
+        return end
+    if at_eof:
+        return limit
+    if end > start:
+        return end
+    return _char_boundary(data, start, limit, encoding)
+
+
+def build_page_index(file_path, index_path, page_lines=PREVIEW_PAGE_LINES, page_bytes=PREVIEW_PAGE_BYTES):
+    """检测文本文件的编码，扫描文件把每页的起始偏移写入索引文件（在渲染进程中执行）"""
+    size = os.path.getsize(file_path)
+    encoding = _detect_encoding(file_path)
+    offsets = array("Q", [page_lines, page_bytes, _INDEX_VERSION])
+    offsets.frombytes(encoding.encode("ascii").ljust(_INDEX_ENCODING_BYTES, b"\0"))
+    offsets.append(0)
+    if size:
+        # 使用mmap按需读取，内存占用与文件大小无关
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while start < size:
+                limit = min(start + page_bytes, size)
+                start = _page_end(data, start, limit, page_lines, encoding, at_eof=limit == size)
+                offsets.append(start)
+    else:
+        offsets.append(0)
+
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        offsets.tofile(f)
+    os.replace(tmp_path, index_path)
+    return len(offsets) - _INDEX_HEADER - 1
+
+
+def index_is_current(index_path, page_lines=PREVIEW_PAGE_LINES, page_bytes=PREVIEW_PAGE_BYTES):
+    """索引存在、格式版本相同且与当前分页配置一致"""
+    header = array("Q")
+    try:
+        with open(index_path, "rb") as f:
+            header.fromfile(f, _INDEX_HEADER)
+    except (OSError, EOFError):
+        return False
+    return list(header[:3]) == [page_lines, page_bytes, _INDEX_VERSION]
+
+
+def _detect_encoding(file_path):
+    with open(file_path, "rb") as f:
+        head = f.read(4096)
+    encoding = chardet.detect(head)["encoding"]
+    # 开头只有ASCII字符时按UTF-8解码，后面的中文才能正确显示
+    if not encoding or encoding.lower() == "ascii":
+        return "utf-8"
+    try:
+        encoding = codecs.lookup(encoding).name
+    except LookupError:
+        return "utf-8"
+    if encoding in ("utf-16", "utf-32"):
+        # 按开头的BOM确定字节序，之后的页从文件中间开始解码，不能依赖BOM
+        big_endian = head.startswith(codecs.BOM_UTF16_BE if encoding == "utf-16" else codecs.BOM_UTF32_BE)
+        encoding = f"{encoding}-{'be' if big_endian else 'le'}"
+    return encoding
+
+
+def read_text_page(file_path, index_path, page, page_lines=PREVIEW_PAGE_LINES, page_bytes=PREVIEW_PAGE_BYTES):
+    """
+    读取文本文件的第 page 页（从1开始）
+
+    Args:
+        file_path: 文本文件路径
+        index_path: 页偏移索引路径；为 None 时只能读取第一页
+        page: 页码
+
+    Returns:
+        页内容字典；页码超出范围时返回 None
+    """
+    size = os.path.getsize(file_path)
+    total_pages = None
+    if index_path is None:
+        if page != 1:
+            return None
+        # 索引尚未建立，第一页单独检测编码
+        encoding = _detect_encoding(file_path)
+        with open(file_path, "rb") as f:
+            data = f.read(page_bytes)
+        start, end = 0, _page_end(data, 0, len(data), page_lines, encoding, at_eof=len(data) == size)
+    else:
+        total_pages = os.path.getsize(index_path) // _INDEX_ITEM_SIZE - _INDEX_HEADER - 1
+        if page > total_pages:
+            return None
+        header, bounds = array("Q"), array("Q")
+        with open(index_path, "rb") as f:
+            header.fromfile(f, _INDEX_HEADER)
+            f.seek((_INDEX_HEADER + page - 1) * _INDEX_ITEM_SIZE)
+            bounds.fromfile(f, 2)
+        encoding = header[3:].tobytes().rstrip(b"\0").decode("ascii")
+        start, end = bounds
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+
+    text = data[:end - start].decode(encoding, errors="replace")
+    if start == 0:
+        # 按明确字节序的编码（如 utf-16-le）解码时开头的BOM会保留为字符
+        text = text.removeprefix("\ufeff")
+    return {
+        "page": page,
+        "total_pages": total_pages,
+        "has_more": end < size,
+        "start_offset": start,
+        "end_offset": end,
+        "encoding": encoding,
+        "text": text,
+    }
+
+
+# 正在建立的索引，同一文件的并发请求共用一次扫描
+_index_builds = {}
+
+
+def _index_build_done(key, task):
+    _index_builds.pop(key, None)
+    if not task.cancelled() and task.exception():
+        logging.error(f"Failed to build page index {key}: {task.exception()}")
+
+
+def start_page_index(file_path, index_path):
+    """在渲染进程中建立索引，返回建立索引的任务（已在建立时返回同一个任务）"""
+    key = str(index_path)
+    task = _index_builds.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            preview_pool.run(build_page_index, str(file_path), key, timeout=PREVIEW_INDEX_TIMEOUT)
+        )
+        _index_builds[key] = task
+        task.add_done_callback(functools.partial(_index_build_done, key))
+    return task
+
+
+async def ensure_page_index(file_path, index_path):
+    """确保页偏移索引已建立；请求被取消时索引仍在后台继续建立"""
+    if await run_in_threadpool(index_is_current, index_path):
+        return
+    await asyncio.shield(start_page_index(file_path, index_path))
+
+
+def _worker_main(conn):
+    """渲染进程：启动时注册字体，然后循环执行父进程发来的任务"""
+    ensure_chinese_font()
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        fn, args = job
+        try:
+            conn.send(("ok", fn(*args)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def terminate(self):
+        # 不在这里关闭管道：等待结果的线程会因进程退出读到EOF后自行结束
+        self.process.terminate()
+
+
+class PreviewRenderPool:
+    """
+    常驻的渲染进程池
+
+    每个渲染进程同时只执行一个任务。任务超时或调用方取消（如客户端断开连接）时，
+    直接结束正在执行该任务的进程并启动一个新进程替代，不影响其他任务。
+    等待空闲进程的任务数超过 PREVIEW_QUEUE_SIZE 时立即返回503，避免请求无限堆积。
+    进程在第一次使用时才启动。
+    """
+
+    def __init__(self, workers=PREVIEW_WORKERS, queue_size=PREVIEW_QUEUE_SIZE, timeout=PREVIEW_RENDER_TIMEOUT):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self._waiting = 0
+        self._busy = 0
+        self._idle = None
+        self._all = []
+        self._executor = None
+        # spawn 启动的进程不继承API进程的线程和事件循环，在各平台上行为一致
+        self._context = multiprocessing.get_context("spawn")
+
+    def _spawn(self):
+        worker = _Worker(self._context)
+        self._all.append(worker)
+        return worker
+
+    def _retire(self, worker):
+        worker.terminate()
+        if worker in self._all:
+            self._all.remove(worker)
+
+    def _start(self):
+        self._idle = asyncio.Queue()
+        # 每个渲染进程对应一个等待结果的线程
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preview-render")
+        for _ in range(self.workers):
+            self._idle.put_nowait(self._spawn())
+
+    async def run(self, fn, *args, timeout=None):
+        """
+        在渲染进程中执行 fn(*args)
+
+        Args:
+            fn: 模块级函数（需要能被pickle）
+            args: 参数（需要能被pickle）
+            timeout: 超时时间（秒），默认 PREVIEW_RENDER_TIMEOUT
+
+        Returns:
+            fn 的返回值
+
+        Raises:
+            HTTPException: 队列已满时返回503，超时返回504
+            RuntimeError: 渲染失败
+        """
+        if self._idle is None:
+            self._start()
+        if self._waiting >= self.queue_size:
+            raise HTTPException(status_code=503, detail="预览服务繁忙，请稍后重试", headers={"Retry-After": "5"})
+
+        task = getattr(fn, "__name__", "unknown")
+        queued_at = time.perf_counter()
+        idle = self._idle
+        self._waiting += 1
+        try:
+            worker = await idle.get()
+        finally:
+            self._waiting -= 1
+
+        started_at = time.perf_counter()
+        preview_queue_wait_seconds.observe(started_at - queued_at, task=task)
+        self._busy += 1
+        finished = False
+        outcome = "error"
+        try:
+            worker.conn.send((fn, args))
+            loop = asyncio.get_running_loop()
+            status, result = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, worker.conn.recv),
+                timeout or self.timeout
+            )
+            finished = True
+            outcome = "ok" if status != "error" else "error"
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            outcome = "timeout"
+            raise HTTPException(status_code=504, detail="预览生成超时")
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            outcome = "cancelled"
+            raise
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"渲染进程异常退出: {e}")
+        finally:
+            self._busy -= 1
+            preview_render_duration_seconds.observe(time.perf_counter() - started_at, task=task, outcome=outcome)
+            if self._idle is not idle:
+                # 执行期间进程池已关闭，进程已被结束，不再放回或补充
+                self._retire(worker)
+            elif finished:
+                self._idle.put_nowait(worker)
+            else:
+                # 进程可能仍在执行被放弃的任务，结束它并补充新进程
+                self._retire(worker)
+                self._idle.put_nowait(self._spawn())
+
+        if status == "error":
+            self.failed += 1
+            raise RuntimeError(result)
+        self.completed += 1
+        return result
+
+    def shutdown(self):
+        for worker in list(self._all):
+            self._retire(worker)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._idle = None
+        self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "busy": self._busy,
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+        }
+
+
+preview_pool = PreviewRenderPool()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -41,6 +41,81 @@ class FileInfoResponse(FileInfo):
     """API响应中的文件信息模型"""
     download_code: Optional[str] = None
     can_preview: bool = False
+    has_thumbnail: bool = False
     
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class FileListPage(BaseModel):
+    """分页的文件列表，next_cursor 为空表示没有下一页，version 为查询时文件列表的版本号"""
+    items: List[FileInfoResponse]
+    next_cursor: Optional[str] = None
+    version: Optional[int] = None
+
+class FileListDelta(BaseModel):
+    """文件列表的增量：since 版本之后新上传、有变化和已删除（或不再符合筛选条件）的文件"""
+    version: int
+    added: List[FileInfoResponse]
+    changed: List[FileInfoResponse]
+    deleted: List[int]
+
+class UploadSessionCreate(BaseModel):
+    """创建分块上传会话的请求"""
+    filename: str
+    size: int
+    chunk_size: Optional[int] = None
+    is_private: bool = False
+    download_code: Optional[str] = None
+
+class UploadSessionStatus(BaseModel):
+    """分块上传会话状态"""
+    upload_id: str
+    filename: str
+    size: int
+    chunk_size: int
+    total_chunks: int
+    received_chunks: List[int]
+    expires_at: datetime
+
+class InstantUploadCreate(BaseModel):
+    """秒传请求：引用服务器上已有的内容创建文件"""
+    filename: str
+    sha256: str
+    size: int
+    is_private: bool = False
+    download_code: Optional[str] = None
+
+class BulkFileOperation(BaseModel):
+    """批量操作文件：delete 删除，set_private / set_public 设为私密或公开，regenerate_code 重新生成私密文件的下载码"""
+    ids: List[int]
+    action: Literal["delete", "set_private", "set_public", "regenerate_code"]
+    download_code: Optional[str] = None  # set_private 时使用的下载码，未指定时每个文件随机生成
+
+class BulkFileOperationItem(BaseModel):
+    """单个文件的操作结果，失败时 detail 为原因"""
+    id: int
+    ok: bool
+    detail: Optional[str] = None
+    download_code: Optional[str] = None
+
+class BulkFileOperationResult(BaseModel):
+    """批量操作的结果，results 与请求中的 ids 顺序一致（重复的id只保留一个）"""
+    action: str
+    succeeded: int
+    failed: int
+    results: List[BulkFileOperationItem]
+
+class ArchiveRequest(BaseModel):
+    """打包下载多个文件，私密文件的下载码按文件ID提供"""
+    ids: List[int]
+    download_codes: Dict[int, str] = {}
+    filename: Optional[str] = None  # 压缩包的文件名，默认为 files-<时间>.zip
+
+class UserUsage(BaseModel):
+    """用户的存储用量和配额，配额为 null 表示不限制"""
+    storage_bytes: int
+    file_count: int
+    storage_quota: Optional[int] = None
+    file_quota: Optional[int] = None
+    storage_remaining: Optional[int] = None
+    file_remaining: Optional[int] = None
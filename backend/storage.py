@@ -0,0 +1,361 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, UploadFile
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import FormData
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from metrics import disk_io
+from models import Blob
+from storage_backend import STORAGE_ROOT, blob_key, storage
+
+# 本地存储的根目录（可通过 STORAGE_ROOT 环境变量修改）
+UPLOAD_DIR = STORAGE_ROOT
+
+# 配置（可通过环境变量覆盖）
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 每次读取1MB
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 2 * 1024 * 1024 * 1024))  # 默认2GB，0表示不限制
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # 上传表单中文件内容以外的部分（multipart边界、其他字段）允许的字节数
+
+# 分块上传配置
+DEFAULT_CHUNK_SIZE = int(os.getenv("DEFAULT_CHUNK_SIZE", 8 * 1024 * 1024))  # 默认分块8MB
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24))  # 会话闲置超过该时间后过期
+UNLINK_CONCURRENCY = int(os.getenv("UNLINK_CONCURRENCY", 16))  # 批量删除时同时在线程池中删除文件的线程数
+
+
+def temp_upload_path() -> Path:
+    """生成上传用的暂存文件路径，接收完成后由 acquire_blob 放入存储"""
+    return storage.staging_path(uuid.uuid4().hex)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_chunk(buffer, hasher, chunk: bytes):
+    # 写入和计算哈希都放在线程池中执行，避免阻塞事件循环
+    with disk_io("write", len(chunk)):
+        hasher.update(chunk)
+        buffer.write(chunk)
+
+
+def _discard_temp_file(buffer, tmp_path: Path):
+    buffer.close()
+    remove_file(tmp_path)
+
+
+async def read_upload_form(request: Request, max_size: Optional[int], too_large_detail: str) -> FormData:
+    """
+    边接收边解析上传表单（multipart/form-data），请求体超过限制时尽早中止
+
+    声明的 Content-Length 已经超出限制时不读取请求体，直接返回413；未声明或声明不实时，
+    接收的字节数一旦超出限制立即停止接收并返回413，不必等整个请求体传完。
+    调用方用完后需要关闭返回的表单（await form.close()）。
+
+    Args:
+        request: 请求
+        max_size: 文件内容允许的最大字节数（None表示不限制），请求体另外允许 UPLOAD_FORM_OVERHEAD 字节
+        too_large_detail: 超出限制时的错误信息
+
+    Raises:
+        HTTPException: 超出限制时返回413，不是合法的 multipart 表单时返回400
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+    limit = max_size + UPLOAD_FORM_OVERHEAD if max_size is not None else None
+    declared = request.headers.get("content-length")
+    if limit is not None and declared and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=too_large_detail)
+
+    exceeded = False
+
+    async def limited_stream():
+        nonlocal exceeded
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if limit is not None and received > limit:
+                # 以解析错误的形式中止，解析器会关闭已经创建的临时文件
+                exceeded = True
+                raise MultiPartException(too_large_detail)
+            yield chunk
+
+    try:
+        return await MultiPartParser(request.headers, limited_stream(), max_files=1, max_fields=10).parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=413 if exceeded else 400, detail=e.message)
+
+
+async def receive_upload_file(
+    file: UploadFile,
+    max_size: Optional[int] = MAX_UPLOAD_SIZE,
+    too_large_detail: Optional[str] = None
+) -> Tuple[Path, int, str]:
+    """
+    以固定大小的分块流式接收上传文件
+
+    文件写入存储后端的暂存文件，同时增量计算大小和SHA-256，
+    因此每个上传占用的内存与文件大小无关。调用方随后用 acquire_blob 把临时文件放入存储。
+
+    Args:
+        file: 上传的文件对象
+        max_size: 允许的最大字节数（None或0表示不限制）
+        too_large_detail: 超出限制时的错误信息，默认为 "File too large..."
+
+    Returns:
+        (临时文件路径, 文件大小, SHA-256十六进制摘要)
+
+    Raises:
+        HTTPException: 文件超过大小限制时返回413
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = temp_upload_path()
+    buffer = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            # 边接收边检查大小，超出限制立即中止
+            if max_size and size > max_size:
+                raise HTTPException(
+                    status_code=413,
+                    detail=too_large_detail or f"File too large. Maximum size is {max_size} bytes"
+                )
+            await run_in_threadpool(_write_chunk, buffer, hasher, chunk)
+
+        await run_in_threadpool(buffer.close)
+    except BaseException:
+        await run_in_threadpool(_discard_temp_file, buffer, tmp_path)
+        raise
+
+    return tmp_path, size, hasher.hexdigest()
+
+
+def hash_file(path) -> str:
+    """分块读取文件计算SHA-256"""
+    hasher = hashlib.sha256()
+    with disk_io("hash", os.path.getsize(path)), open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def acquire_blob(db: Session, sha256: str, size: int, tmp_path: Optional[Path] = None) -> str:
+    """
+    为内容增加一个引用，返回内容对应的存储key
+
+    引用计数通过一条 upsert 语句原子地增加，该语句会持有SQLite写锁直到调用方提交，
+    因此与 release_blob 不会交错：如果内容已经存在，丢弃临时文件；否则把临时文件放入存储。
+    tmp_path 为 None 表示秒传，此时内容必须已经存在。
+    调用方需要在同一个事务中写入 FileInfo 后再提交。
+    """
+    stmt = sqlite_insert(Blob).values(
+        sha256=sha256, size=size, ref_count=1, created_at=datetime.now()
+    ).on_conflict_do_update(
+        index_elements=[Blob.sha256],
+        set_={"ref_count": Blob.ref_count + 1}
+    )
+    db.execute(stmt)
+
+    key = blob_key(sha256)
+    if storage.exists(key):
+        if tmp_path:
+            remove_file(tmp_path)
+    elif tmp_path:
+        storage.commit(tmp_path, key)
+    else:
+        raise FileNotFoundError(f"Blob {sha256} is missing")
+    return key
+
+
+def release_blob(db: Session, sha256: str) -> Optional[str]:
+    """
+    减少内容的引用计数，最后一个引用消失时删除内容记录并返回内容的存储key
+
+    与 release_blobs 相同，调用方在提交之前用 detach_contents 移走返回的内容，提交之后再删除文件。
+    """
+    # 原子地减少计数，UPDATE 之后本事务持有写锁，随后读到的计数不会被并发修改
+    db.query(Blob).filter(Blob.sha256 == sha256).update(
+        {Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False
+    )
+    remaining = db.query(Blob.ref_count).filter(Blob.sha256 == sha256).scalar()
+    if remaining is not None and remaining <= 0:
+        db.query(Blob).filter(Blob.sha256 == sha256).delete(synchronize_session=False)
+        return blob_key(sha256)
+    return None
+
+
+def release_blobs(db: Session, ref_counts: Dict[str, int]) -> List[str]:
+    """
+    批量减少内容的引用计数，删除不再被引用的内容记录
+
+    UPDATE 之后本事务持有写锁；不再被引用的内容的key返回给调用方，调用方在提交之前用 detach_contents
+    移走这些内容，提交之后再用 delete_concurrently 删除文件，删除文件时不占用写锁。
+
+    Args:
+        db: 数据库会话
+        ref_counts: {内容哈希: 要减少的引用数}
+
+    Returns:
+        需要删除的内容的存储key
+    """
+    if not ref_counts:
+        return []
+    # 一条语句按哈希 executemany，而不是每个内容各执行一次 UPDATE 和 SELECT
+    blobs = Blob.__table__
+    db.execute(
+        update(blobs)
+        .where(blobs.c.sha256 == bindparam("b_sha256"))
+        .values(ref_count=blobs.c.ref_count - bindparam("b_count")),
+        [{"b_sha256": sha256, "b_count": count} for sha256, count in ref_counts.items()]
+    )
+    released = db.scalars(
+        select(Blob.sha256).where(Blob.sha256.in_(list(ref_counts)), Blob.ref_count <= 0)
+    ).all()
+    if not released:
+        return []
+    db.execute(delete(Blob).where(Blob.sha256.in_(released)).execution_options(synchronize_session=False))
+    return [blob_key(sha256) for sha256 in released]
+
+
+def detach_contents(keys: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    把要删除的内容移出原来的key，返回 [(原key, 移出后的key)]
+
+    在提交之前、持有写锁时调用（在线程池中执行）。移动只是一次重命名，之后并发的 acquire_blob 按原key
+    找不到旧文件，会重新放入内容，因此提交之后删除移出的文件不会删掉新上传的内容。
+    事务回滚时用 restore_contents 放回。
+    """
+    detached = []
+    try:
+        for key in keys:
+            moved = storage.detach(key)
+            if moved is not None:
+                detached.append((key, moved))
+    except Exception:
+        restore_contents(detached)
+        raise
+    return detached
+
+
+def restore_contents(detached: List[Tuple[str, str]]):
+    """把 detach_contents 移走的内容放回原来的key"""
+    for key, moved in detached:
+        storage.restore(moved, key)
+
+
+def _delete_keys(keys: Iterable[str]):
+    for key in keys:
+        storage.delete(key)
+
+
+async def delete_concurrently(keys: List[str], concurrency: int = UNLINK_CONCURRENCY):
+    """
+    在线程池中并发删除存储中的内容（不存在时忽略）
+
+    key 分成 concurrency 组，每组在一个线程中依次删除，避免为每个文件调度一次线程池。
+    """
+    if not keys:
+        return
+    concurrency = max(1, min(concurrency, len(keys)))
+    await asyncio.gather(*(
+        run_in_threadpool(_delete_keys, keys[index::concurrency]) for index in range(concurrency)
+    ))
+
+
+def preallocate_file(path: Path, size: int):
+    """创建指定大小的空文件，分块上传时各分块直接写入对应偏移，组装时无需再复制"""
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _open_at_offset(path: Path, offset: int):
+    f = open(path, "r+b")
+    f.seek(offset)
+    return f
+
+
+def _copy_into(source: Path, path: Path, offset: int):
+    """把已经校验过的分块从旁路文件复制到预分配文件的指定偏移处"""
+    with open(source, "rb") as src, _open_at_offset(path, offset) as dst:
+        for data in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+            dst.write(data)
+
+
+async def save_chunk_at(
+    stream: AsyncIterator[bytes],
+    path: Path,
+    offset: int,
+    expected_size: int,
+    expected_sha256: Optional[str] = None
+) -> str:
+    """
+    接收一个分块，校验通过后写入预分配文件的指定偏移处
+
+    请求体先写入预分配文件旁边的临时文件，大小和校验和都正确后才复制到目标位置，
+    重新上传已经接收过的分块时，内容损坏或不完整的请求不会覆盖已有的正确数据。
+
+    Args:
+        stream: 请求体的异步字节流
+        path: 预分配的临时文件
+        offset: 分块在文件中的起始偏移
+        expected_size: 分块应有的字节数
+        expected_sha256: 客户端提供的分块SHA-256（可选）
+
+    Returns:
+        分块的SHA-256十六进制摘要
+
+    Raises:
+        HTTPException: 分块大小与预期不符或校验和不一致时返回400
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    part_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    buffer = await run_in_threadpool(open, part_path, "wb")
+    try:
+        try:
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                # 超过分块大小立即中止
+                if size > expected_size:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Chunk too large. Expected {expected_size} bytes"
+                    )
+                await run_in_threadpool(_write_chunk, buffer, hasher, chunk)
+        finally:
+            await run_in_threadpool(buffer.close)
+
+        if size != expected_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Incomplete chunk. Expected {expected_size} bytes, got {size}"
+            )
+        checksum = hasher.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != checksum:
+            raise HTTPException(status_code=400, detail="Chunk checksum mismatch")
+        with disk_io("chunk_copy", size):
+            await run_in_threadpool(_copy_into, part_path, path, offset)
+    finally:
+        await run_in_threadpool(remove_file, part_path)
+    return checksum
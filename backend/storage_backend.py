@@ -0,0 +1,246 @@
+import importlib
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import disk_io
+
+# 存储配置（可通过环境变量覆盖）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local，或 "模块:类名" 指定自定义的 StorageBackend 子类
+STORAGE_ROOT = Path(os.getenv("STORAGE_ROOT", Path(__file__).parent.absolute() / "uploads"))  # 本地存储的根目录
+STORAGE_READ_CHUNK_SIZE = int(os.getenv("STORAGE_READ_CHUNK_SIZE", 1024 * 1024))  # 按范围读取内容时每次读取的字节数
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# 内容文件旁边保存的派生数据（文本分页预览的页偏移索引），随内容一起移动和删除
+SIDECAR_SUFFIXES = (".pages",)
+
+
+def blob_key(sha256: str) -> str:
+    """内容的存储key：按哈希前两级各两个十六进制字符分散到子目录，如 ab/cd/abcd...（每级256个目录）"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class StorageBackend(ABC):
+    """
+    存储后端接口
+
+    文件内容按key（相对路径形式的字符串，如 blob_key 的返回值）保存，数据库中只记录key，
+    因此可以整体移动到其他目录或其他存储。写入先写到本地的暂存文件（上传时边接收边写入，
+    分块上传按偏移写入），完成后用 commit 放入存储。
+
+    子类需要实现 stat、open、staging_path、commit、delete 和 local_path；预览渲染和文本分页需要本地文件，
+    不在本地磁盘上的后端应在 local_path 中把内容缓存到本地后返回缓存路径。
+    下载只通过 stat 和 iter_range 读取；is_local 为真时直接发送 local_path 指向的文件。
+    """
+
+    is_local = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # detach 和 restore 必须成对覆盖，否则移走的内容在事务回滚时无法放回
+        if (cls.detach is StorageBackend.detach) != (cls.restore is StorageBackend.restore):
+            raise TypeError(f"{cls.__name__} must override both detach and restore")
+
+    @abstractmethod
+    def stat(self, key: str) -> os.stat_result:
+        """返回内容的大小和修改时间，不存在时抛出 FileNotFoundError"""
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """以二进制只读方式打开内容，返回可以 seek 的文件对象"""
+
+    @abstractmethod
+    def staging_path(self, name: str) -> Path:
+        """写入用的本地暂存文件路径"""
+
+    @abstractmethod
+    def commit(self, staging_path: Path, key: str):
+        """把写完的暂存文件放入存储"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除内容及其派生数据，不存在时忽略"""
+
+    @abstractmethod
+    def local_path(self, key: str) -> Path:
+        """内容在本地磁盘上的路径（直接发送文件、预览渲染使用）"""
+
+    def detach(self, key: str) -> Optional[str]:
+        """
+        把内容移到一个新的key下，之后按原key读不到内容，返回新的key（内容不存在时返回None）
+
+        删除内容时在数据库提交之前调用，提交之后再用 delete 删除新的key。默认实现直接删除内容并返回None，
+        可以快速重命名的后端应同时覆盖此方法和 restore。
+        """
+        self.delete(key)
+        return None
+
+    def restore(self, detached_key: str, key: str):
+        """
+        把 detach 移走的内容放回原来的key（事务回滚时调用）
+
+        默认的 detach 直接删除内容、不返回新的key，不会调用到这里，因此默认实现没有需要放回的内容。
+        """
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.stat(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sidecar_path(self, key: str, suffix: str) -> Path:
+        """内容的派生数据（如页偏移索引）的本地路径"""
+        return Path(f"{self.local_path(key)}{suffix}")
+
+    async def iter_range(self, key: str, start: int, end: int,
+                         chunk_size: int = STORAGE_READ_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """按块读取 [start, end]（包含end）范围内的内容，读取在线程池中执行"""
+        f = await run_in_threadpool(self.open, key)
+        try:
+            await run_in_threadpool(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_in_threadpool(_read_chunk, f, min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await run_in_threadpool(f.close)
+
+
+def _read_chunk(f, size: int) -> bytes:
+    with disk_io("read", size):
+        return f.read(size)
+
+
+class LocalStorage(StorageBackend):
+    """
+    本地磁盘存储
+
+    key 是相对于根目录的路径，内容按 blob_key 分散在两级子目录中，避免单个目录下文件过多。
+    旧版本在数据库中记录的绝对路径仍然可以作为key使用；根目录下平铺的旧内容文件迁移（migrate_storage.py）
+    期间先硬链接到新位置再删除旧文件，读取时新旧位置都会查找，迁移过程中不会读不到文件。
+    """
+
+    is_local = True
+
+    def __init__(self, root=STORAGE_ROOT):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, key: str):
+        """key 可能对应的文件路径，按查找顺序排列"""
+        path = Path(key)
+        if not path.is_absolute():
+            path = self.root / key
+            name = path.name
+            # 分片的key也查找旧的平铺位置（尚未迁移或正在迁移）
+            if SHA256_PATTERN.match(name) and key == blob_key(name):
+                return path, self.root / name
+            return (path,)
+        if path.parent == self.root and SHA256_PATTERN.match(path.name):
+            # 旧的平铺绝对路径也查找分片位置（已经迁移，但调用方读到的是迁移前的记录）
+            return path, self.root / blob_key(path.name)
+        return (path,)
+
+    def local_path(self, key: str) -> Path:
+        paths = self._paths(key)
+        for path in paths:
+            if path.is_file():
+                return path
+        return paths[0]
+
+    def stat(self, key: str) -> os.stat_result:
+        paths = self._paths(key)
+        for path in paths[:-1]:
+            try:
+                return os.stat(path)
+            except FileNotFoundError:
+                pass
+        return os.stat(paths[-1])
+
+    def open(self, key: str) -> BinaryIO:
+        paths = self._paths(key)
+        for path in paths[:-1]:
+            try:
+                return open(path, "rb")
+            except FileNotFoundError:
+                pass
+        return open(paths[-1], "rb")
+
+    def staging_path(self, name: str) -> Path:
+        # 暂存文件放在根目录下，放入存储时是同一文件系统内的原子重命名
+        return self.root / f".{name}.part"
+
+    def commit(self, staging_path: Path, key: str):
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staging_path, path)
+
+    def detach(self, key: str) -> Optional[str]:
+        # 同一文件系统内的重命名，耗时与文件大小无关
+        path = self.local_path(key)
+        detached = f".{uuid.uuid4().hex}.deleted"
+        try:
+            os.replace(path, self.root / detached)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            # 旧版本记录的绝对路径可能不在根目录所在的文件系统上，无法重命名时直接删除
+            self.delete(key)
+            return None
+        for suffix in SIDECAR_SUFFIXES:
+            try:
+                os.replace(f"{path}{suffix}", self.root / f"{detached}{suffix}")
+            except OSError:
+                pass
+        return detached
+
+    def restore(self, detached_key: str, key: str):
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.root / detached_key, path)
+        for suffix in SIDECAR_SUFFIXES:
+            try:
+                os.replace(self.root / f"{detached_key}{suffix}", f"{path}{suffix}")
+            except OSError:
+                pass
+
+    def delete(self, key: str):
+        for path in self._paths(key):
+            for target in (path, *(Path(f"{path}{suffix}") for suffix in SIDECAR_SUFFIXES)):
+                try:
+                    os.remove(target)
+                except OSError:
+                    pass
+
+
+def create_storage_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    """
+    按名称创建存储后端
+
+    Args:
+        name: "local"，或 "模块:类名"（类需要继承 StorageBackend，用无参构造）
+
+    Returns:
+        StorageBackend
+    """
+    if name == "local":
+        return LocalStorage()
+    module_name, _, class_name = name.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    if not issubclass(backend_class, StorageBackend):
+        raise TypeError(f"{name} is not a StorageBackend")
+    return backend_class()
+
+
+storage = create_storage_backend()
+# 预览、缩略图等缓存文件总在本地磁盘上，按绝对路径读取，与内容使用同一个按范围读取的实现
+local_files = storage if isinstance(storage, LocalStorage) else LocalStorage()
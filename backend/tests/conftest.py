@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 测试直接导入 backend 下的模块（与运行服务时的工作目录一致）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# 导入应用的测试使用临时目录中的数据库、存储和日志，不影响 backend 目录下的数据
+_work_dir = Path(tempfile.mkdtemp(prefix="netdisk-tests-"))
+for _name, _value in {
+    "DATABASE_URL": f"sqlite:///{_work_dir / 'netdisk.db'}",
+    "STORAGE_ROOT": str(_work_dir / "uploads"),
+    "PREVIEW_CACHE_DIR": str(_work_dir / "preview_cache"),
+    "THUMBNAIL_CACHE_DIR": str(_work_dir / "thumbnails"),
+    "ACTIVITY_LOG_FILE": str(_work_dir / "logs" / "activity.log"),
+}.items():
+    os.environ.setdefault(_name, _value)
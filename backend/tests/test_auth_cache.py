@@ -0,0 +1,28 @@
+"""token缓存：查询期间会话失效时，已注销的token不会被写回缓存"""
+from auth import AuthCache
+
+
+def test_put_skipped_when_user_invalidated_during_lookup():
+    cache = AuthCache()
+    lookup = cache.begin_lookup()
+    cache.invalidate_user(1)  # 查询进行中用户注销（本进程或同步到的其他进程的变更）
+    cache.put("token", 1, "alice", 2 ** 40, lookup)
+    assert cache.get("token") is None
+
+
+def test_put_kept_when_other_user_invalidated():
+    cache = AuthCache()
+    lookup = cache.begin_lookup()
+    cache.invalidate_user(2)
+    cache.put("token", 1, "alice", 2 ** 40, lookup)
+    assert cache.get("token")[:2] == (1, "alice")
+
+
+def test_put_skipped_after_clear():
+    cache = AuthCache()
+    lookup = cache.begin_lookup()
+    cache.clear()
+    cache.put("token", 1, "alice", 2 ** 40, lookup)
+    assert cache.get("token") is None
+    cache.put("token", 1, "alice", 2 ** 40, cache.begin_lookup())
+    assert cache.get("token") is not None
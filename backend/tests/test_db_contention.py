@@ -0,0 +1,37 @@
+"""数据库写入并发压力测试：并发的登录、上传、下载计数写回、列表和删除不应出现 "database is locked" """
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_contention(*args):
+    # 在子进程中运行：数据库路径、下载计数写回阈值等配置在导入 main 时读取，需要使用单独的临时数据库
+    env = {name: value for name, value in os.environ.items() if name not in ("DATABASE_URL", "ASYNC_DATABASE_URL")}
+    env["ADMISSION_ENABLED"] = "false"
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.db_contention", *args],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=600,
+    )
+    return result
+
+
+def assert_no_lock_errors(result):
+    output = result.stdout + result.stderr
+    assert "'database is locked' errors: 0" in result.stdout, output
+    assert "failed requests (5xx or exception): 0" in result.stdout, output
+    assert result.returncode == 0, output
+
+
+def test_concurrent_writers_in_one_process():
+    assert_no_lock_errors(run_contention("--clients", "40", "--rounds", "2", "--downloads", "2"))
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uvicorn --workers 需要 fork")
+def test_concurrent_writers_across_worker_processes():
+    assert_no_lock_errors(run_contention("--clients", "30", "--rounds", "2", "--downloads", "2",
+                                         "--mode", "uvicorn", "--workers", "2"))
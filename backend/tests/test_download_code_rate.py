@@ -0,0 +1,66 @@
+"""下载码限流：只有错误的下载码计数，持有正确下载码的访客可以连续翻页"""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from admission import DOWNLOAD_CODE_BURST, admission
+from preview_renderer import PREVIEW_PAGE_LINES
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture(autouse=True)
+def reset_download_code_limiter():
+    admission.download_code_limiter._buckets.clear()
+    yield
+    admission.download_code_limiter._buckets.clear()
+
+
+@pytest.fixture(scope="module")
+def private_text_file(client):
+    r = client.post("/api/register", json={"username": "code-owner", "password": "secret"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    lines = "".join(f"第{i}行\n" for i in range(PREVIEW_PAGE_LINES * 15))
+    r = client.post("/api/files/upload", headers=headers,
+                    files={"file": ("pages.txt", lines.encode("utf-8"), "text/plain")},
+                    data={"is_private": "true", "download_code": "1234"})
+    assert r.status_code == 200, r.text
+    return r.json()["file_id"]
+
+
+def test_correct_code_is_not_limited(client, private_text_file):
+    pages = int(DOWNLOAD_CODE_BURST) + 5
+    for page in range(1, pages + 1):
+        r = client.get(f"/api/files/{private_text_file}/preview/text",
+                       params={"page": page, "download_code": "1234"})
+        assert r.status_code == 200, (page, r.text)
+        assert r.json()["page"] == page
+    for _ in range(3):
+        assert client.get(f"/api/files/{private_text_file}/info", params={"download_code": "1234"}).status_code == 200
+        assert client.get(f"/api/files/{private_text_file}", params={"download_code": "1234"},
+                          headers={"Range": "bytes=0-99"}).status_code == 206
+
+
+def test_wrong_codes_are_limited(client, private_text_file):
+    for _ in range(int(DOWNLOAD_CODE_BURST)):
+        r = client.get(f"/api/files/{private_text_file}", params={"download_code": "0000"})
+        assert r.status_code == 403
+    r = client.get(f"/api/files/{private_text_file}", params={"download_code": "0000"})
+    assert r.status_code == 429
+    assert "Retry-After" in r.headers
+    # 猜错次数用完之后，携带下载码的请求都被拒绝，直到令牌补充
+    r = client.get(f"/api/files/{private_text_file}/preview/text", params={"download_code": "1234"})
+    assert r.status_code == 429
+
+
+def test_wrong_codes_on_info_are_counted(client, private_text_file):
+    for _ in range(int(DOWNLOAD_CODE_BURST)):
+        r = client.get(f"/api/files/{private_text_file}/info", params={"download_code": "0000"})
+        assert r.status_code == 200
+        assert r.json()["download_code"] is None
+    r = client.get(f"/api/files/{private_text_file}/info", params={"download_code": "0000"})
+    assert r.status_code == 429
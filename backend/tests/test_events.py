@@ -0,0 +1,200 @@
+"""事件流：用假的变更来源测试续传、reset 和多个连接的分发"""
+import asyncio
+
+from events import EventHub
+
+
+class FakeChangeSource:
+    """内存中的变更记录，version 从1开始连续递增；oldest 之前的记录视为已清理"""
+
+    def __init__(self):
+        self.changes = []
+        self.oldest = 1
+
+    def add(self, event, data):
+        version = len(self.changes) + 1
+        self.changes.append((version, event, data))
+        return version
+
+    async def current_version(self):
+        return len(self.changes)
+
+    async def oldest_version(self):
+        return self.oldest if self.changes else 0
+
+    async def fetch(self, since, limit):
+        return [change for change in self.changes[since:] if change[0] >= self.oldest][:limit]
+
+
+def event_ids(chunks):
+    return [int(line[4:]) for chunk in chunks for line in chunk.decode().split("\n") if line.startswith("id: ")]
+
+
+def event_names(chunks):
+    return [line[7:] for chunk in chunks for line in chunk.decode().split("\n") if line.startswith("event: ")]
+
+
+async def collect(hub, last_event_id, count, timeout=2):
+    """读取事件流直到收到 count 个事件"""
+    chunks = []
+
+    async def read():
+        async for chunk in hub.stream(last_event_id):
+            chunks.append(chunk)
+            if len(event_ids(chunks)) >= count:
+                return
+
+    await asyncio.wait_for(read(), timeout)
+    return chunks
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_hub(source, **kwargs):
+    kwargs.setdefault("poll_interval", 0.01)
+    kwargs.setdefault("heartbeat_interval", 0.05)
+    return EventHub(source, **kwargs)
+
+
+def test_resume_from_last_event_id():
+    async def scenario():
+        source = FakeChangeSource()
+        for i in range(5):
+            source.add("file-created", {"id": i + 1})
+        hub = make_hub(source)
+        await hub.start()
+        try:
+            chunks = await collect(hub, 2, 3)
+        finally:
+            await hub.stop()
+        assert event_ids(chunks) == [3, 4, 5]
+        assert chunks[0] == b"retry: 3000\n\n"
+
+    run(scenario())
+
+
+def test_resume_replays_from_source_when_behind_buffer():
+    async def scenario():
+        source = FakeChangeSource()
+        hub = make_hub(source, buffer_size=2, batch_size=2)
+        await hub.start()
+        try:
+            for i in range(10):
+                source.add("file-created", {"id": i + 1})
+            hub.notify()
+            await asyncio.sleep(0.1)
+            # 缓冲区只保留最近的事件，更早的部分从变更来源补发
+            assert hub.buffer_since > 1
+            chunks = await collect(hub, 1, 9)
+        finally:
+            await hub.stop()
+        assert event_ids(chunks) == list(range(2, 11))
+
+    run(scenario())
+
+
+def test_skipped_changes_advance_cursor_without_event():
+    async def scenario():
+        source = FakeChangeSource()
+        hub = make_hub(source)
+        await hub.start()
+        try:
+            reader = asyncio.create_task(collect(hub, None, 2))
+            await asyncio.sleep(0.05)
+            source.add("file-created", {"id": 1})
+            source.add("file-created", None)  # 文件已删除，不推送
+            source.add("file-deleted", {"id": 1})
+            hub.notify()
+            chunks = await reader
+        finally:
+            await hub.stop()
+        assert event_ids(chunks) == [1, 3]
+        assert event_names(chunks) == ["file-created", "file-deleted"]
+
+    run(scenario())
+
+
+def test_reset_when_last_event_id_is_too_old():
+    async def scenario():
+        source = FakeChangeSource()
+        for i in range(10):
+            source.add("file-created", {"id": i + 1})
+        source.oldest = 6  # 1-5 已经被清理
+        hub = make_hub(source)
+        await hub.start()
+        try:
+            chunks = await collect(hub, 2, 1)
+        finally:
+            await hub.stop()
+        assert event_names(chunks) == ["reset"]
+        assert event_ids(chunks) == [10]
+        assert b'"version":10' in chunks[-1]
+
+    run(scenario())
+
+
+def test_reset_when_last_event_id_is_in_the_future():
+    async def scenario():
+        source = FakeChangeSource()
+        source.add("file-created", {"id": 1})
+        hub = make_hub(source)
+        await hub.start()
+        try:
+            chunks = await collect(hub, 50, 1)
+        finally:
+            await hub.stop()
+        assert event_names(chunks) == ["reset"]
+        assert event_ids(chunks) == [1]
+
+    run(scenario())
+
+
+def test_fan_out_to_several_subscribers():
+    async def scenario():
+        source = FakeChangeSource()
+        hub = make_hub(source)
+        await hub.start()
+        try:
+            readers = [asyncio.create_task(collect(hub, None, 3)) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            assert hub.connections == 5
+            source.add("file-created", {"id": 1})
+            source.add("downloads-changed", {"id": 1, "downloads": 3})
+            hub.notify()
+            await asyncio.sleep(0.05)
+            source.add("file-deleted", {"id": 1})
+            hub.notify()
+            results = await asyncio.gather(*readers)
+        finally:
+            await hub.stop()
+        for chunks in results:
+            assert event_ids(chunks) == [1, 2, 3]
+            assert event_names(chunks) == ["file-created", "downloads-changed", "file-deleted"]
+        # 所有连接发送的是同一份编码后的事件
+        assert len({b"".join(chunks[1:]) for chunks in results}) == 1
+        assert hub.connections == 0
+
+    run(scenario())
+
+
+def test_idle_stream_sends_heartbeat():
+    async def scenario():
+        hub = make_hub(FakeChangeSource(), heartbeat_interval=0.02)
+        await hub.start()
+        chunks = []
+
+        async def read():
+            async for chunk in hub.stream(None):
+                chunks.append(chunk)
+                if len(chunks) >= 3:
+                    return
+
+        try:
+            await asyncio.wait_for(read(), 1)
+        finally:
+            await hub.stop()
+        assert chunks[1:] == [b": ping\n\n", b": ping\n\n"]
+
+    run(scenario())
@@ -0,0 +1,37 @@
+"""文件列表：all=true 的完整列表与分页使用同样的筛选条件"""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="module")
+def headers(client):
+    r = client.post("/api/register", json={"username": "list-owner", "password": "secret"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    for name, private in [("report.txt", False), ("notes.txt", True), ("photo.png", False)]:
+        content_type = "image/png" if name.endswith(".png") else "text/plain"
+        r = client.post("/api/files/upload", headers=headers,
+                        files={"file": (name, f"content of {name}".encode(), content_type)},
+                        data={"is_private": str(private).lower()})
+        assert r.status_code == 200, r.text
+    return headers
+
+
+@pytest.mark.parametrize("params", [
+    {"q": "report"},
+    {"file_type": "text/plain"},
+    {"is_private": "true"},
+    {"uploader": "list-owner", "sort": "filename", "order": "asc"},
+])
+def test_unpaginated_list_applies_filters(client, headers, params):
+    paged = client.get("/api/files", headers=headers, params={**params, "limit": 500}).json()["items"]
+    full = client.get("/api/files", headers=headers, params={**params, "all": "true"}).json()
+    assert [item["id"] for item in full] == [item["id"] for item in paged]
+    assert full
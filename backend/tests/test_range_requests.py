@@ -0,0 +1,115 @@
+"""范围请求：单个范围、后缀范围、合并、multipart/byteranges、If-Range 和416"""
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from file_responses import parse_range_header, send_file
+
+CONTENT = bytes(range(256)) * 40  # 10240字节
+ETAG = '"test-etag"'
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return await send_file(request, path, "application/octet-stream", ETAG, "private, no-cache")
+
+    return TestClient(app)
+
+
+def test_parse_single_and_suffix_ranges():
+    assert parse_range_header("bytes=0-99", 1000) == [(0, 99)]
+    assert parse_range_header("bytes=900-", 1000) == [(900, 999)]
+    assert parse_range_header("bytes=-100", 1000) == [(900, 999)]
+    # 后缀超过文件大小时返回整个文件，结束位置超出时截断
+    assert parse_range_header("bytes=-5000", 1000) == [(0, 999)]
+    assert parse_range_header("bytes=990-5000", 1000) == [(990, 999)]
+
+
+def test_parse_merges_overlapping_and_adjacent_ranges():
+    assert parse_range_header("bytes=500-599,0-99,50-149,150-199", 1000) == [(0, 199), (500, 599)]
+
+
+def test_parse_ignores_invalid_header():
+    assert parse_range_header(None, 1000) is None
+    assert parse_range_header("items=0-1", 1000) is None
+    assert parse_range_header("bytes=abc", 1000) is None
+    assert parse_range_header("bytes=10-5", 1000) is None
+
+
+def test_single_range(client):
+    resp = client.get("/file", headers={"Range": "bytes=100-199"})
+    assert resp.status_code == 206
+    assert resp.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert resp.headers["content-length"] == "100"
+    assert resp.content == CONTENT[100:200]
+
+
+def test_suffix_range(client):
+    resp = client.get("/file", headers={"Range": "bytes=-300"})
+    assert resp.status_code == 206
+    assert resp.headers["content-range"] == f"bytes {len(CONTENT) - 300}-{len(CONTENT) - 1}/{len(CONTENT)}"
+    assert resp.content == CONTENT[-300:]
+
+
+def test_overlapping_ranges_are_merged_into_one_part(client):
+    resp = client.get("/file", headers={"Range": "bytes=0-99,50-149"})
+    assert resp.status_code == 206
+    assert resp.headers["content-range"] == f"bytes 0-149/{len(CONTENT)}"
+    assert resp.content == CONTENT[:150]
+
+
+def test_multiple_ranges_return_multipart_body(client):
+    resp = client.get("/file", headers={"Range": "bytes=0-9,1000-1019"})
+    assert resp.status_code == 206
+    media_type, _, boundary = resp.headers["content-type"].partition("; boundary=")
+    assert media_type == "multipart/byteranges"
+    assert resp.headers["content-length"] == str(len(resp.content))
+
+    parts = resp.content.split(f"--{boundary}".encode())
+    assert parts[0] == b""
+    assert parts[-1] == b"--\r\n"
+    bodies = []
+    for part in parts[1:-1]:
+        head, _, body = part.partition(b"\r\n\r\n")
+        assert b"Content-Type: application/octet-stream" in head
+        bodies.append((head, body[:-2]))
+    assert b"Content-Range: bytes 0-9/10240" in bodies[0][0]
+    assert bodies[0][1] == CONTENT[0:10]
+    assert b"Content-Range: bytes 1000-1019/10240" in bodies[1][0]
+    assert bodies[1][1] == CONTENT[1000:1020]
+
+
+def test_if_range_match_returns_partial_content(client):
+    resp = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": ETAG})
+    assert resp.status_code == 206
+    assert resp.content == CONTENT[:10]
+
+
+def test_if_range_mismatch_returns_full_content(client):
+    for validator in ('"other-etag"', f"W/{ETAG}", formatdate(0, usegmt=True)):
+        resp = client.get("/file", headers={"Range": "bytes=0-9", "If-Range": validator})
+        assert resp.status_code == 200
+        assert "content-range" not in resp.headers
+        assert resp.content == CONTENT
+
+
+def test_unsatisfiable_range_returns_416(client):
+    resp = client.get("/file", headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert resp.status_code == 416
+    assert resp.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_no_range_returns_full_content(client):
+    resp = client.get("/file")
+    assert resp.status_code == 200
+    assert resp.headers["accept-ranges"] == "bytes"
+    assert resp.headers["etag"] == ETAG
+    assert resp.content == CONTENT
@@ -0,0 +1,71 @@
+"""文本分页预览：页边界不拆开多字节字符，编码在建立索引时检测一次"""
+import pytest
+
+import preview_renderer
+from preview_renderer import build_page_index, index_is_current, read_text_page
+
+TEXT = "第一行：中文内容\n" + "很长的一行没有换行符，" * 40 + "\n短行\n" + "最后一行" * 30
+
+
+def read_all_pages(file_path, index_path, page_lines, page_bytes):
+    pages = []
+    page = 1
+    while True:
+        result = read_text_page(file_path, index_path, page, page_lines, page_bytes)
+        if result is None:
+            return pages
+        pages.append(result)
+        page += 1
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "gb18030", "utf-16"])
+def test_pages_split_on_character_boundaries(tmp_path, encoding):
+    file_path = tmp_path / "a.txt"
+    file_path.write_bytes(TEXT.encode(encoding))
+    index_path = tmp_path / "a.txt.pages"
+    # 每页字节数不是字符长度的整数倍，超长的行会在字符中间到达上限
+    total = build_page_index(str(file_path), str(index_path), page_lines=3, page_bytes=61)
+    assert index_is_current(index_path, page_lines=3, page_bytes=61)
+
+    pages = read_all_pages(file_path, index_path, 3, 61)
+    assert len(pages) == total
+    assert all("�" not in page["text"] for page in pages)
+    assert "".join(page["text"] for page in pages) == TEXT
+    assert not pages[-1]["has_more"]
+    assert all(page["start_offset"] % len("\n".encode(pages[0]["encoding"])) == 0 for page in pages)
+    # 还没有索引时读取的第一页与索引中的第一页相同
+    assert read_text_page(file_path, None, 1, 3, 61)["text"] == pages[0]["text"]
+
+
+def test_page_ends_at_last_newline_before_byte_limit(tmp_path):
+    file_path = tmp_path / "a.txt"
+    file_path.write_bytes("一二三\n四五六七八九十\n".encode("utf-8") * 3)
+    index_path = tmp_path / "a.txt.pages"
+    build_page_index(str(file_path), str(index_path), page_lines=10, page_bytes=40)
+
+    first = read_text_page(file_path, index_path, 1, 10, 40)
+    assert first["text"] == "一二三\n四五六七八九十\n"
+    # 还没有索引时第一页与索引中的第一页相同
+    assert read_text_page(file_path, None, 1, 10, 40)["text"] == first["text"]
+
+
+def test_encoding_is_detected_only_when_building_index(tmp_path, monkeypatch):
+    file_path = tmp_path / "a.txt"
+    file_path.write_bytes(TEXT.encode("utf-8"))
+    index_path = tmp_path / "a.txt.pages"
+    build_page_index(str(file_path), str(index_path), page_lines=3, page_bytes=61)
+
+    def fail(_):
+        raise AssertionError("encoding detected again")
+
+    monkeypatch.setattr(preview_renderer, "_detect_encoding", fail)
+    result = read_text_page(file_path, index_path, 2, 3, 61)
+    assert result["encoding"] == "utf-8"
+
+
+def test_old_index_format_is_rebuilt(tmp_path):
+    from array import array
+    index_path = tmp_path / "a.txt.pages"
+    with open(index_path, "wb") as f:
+        array("Q", [3, 61, 0, 10]).tofile(f)
+    assert not index_is_current(index_path, page_lines=3, page_bytes=61)
@@ -0,0 +1,194 @@
+"""
+用户存储用量和配额
+
+每个用户已保存的字节数和文件数记录在 users.storage_bytes / users.file_count 上，
+在上传（包括秒传和分块上传）、删除和批量删除保存文件记录的同一个事务中增减，查询用量不需要统计文件。
+配额优先使用用户自己的 storage_quota / file_quota，为空时使用默认配额，0表示不限制。
+增加用量和检查配额是同一条UPDATE语句，并发上传也不会超出配额。
+
+计数与文件记录不一致时（手工修改数据库、旧版本升级等），可以分批按文件记录重建:
+    python usage.py [--batch-size 500]
+"""
+import argparse
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, func, or_, select, text, update
+
+from models import User
+
+# 配额配置（可通过环境变量覆盖）
+USER_STORAGE_QUOTA = int(os.getenv("USER_STORAGE_QUOTA", 0))  # 每个用户默认可以保存的总字节数，0表示不限制
+USER_FILE_QUOTA = int(os.getenv("USER_FILE_QUOTA", 0))  # 每个用户默认可以保存的文件数，0表示不限制
+USAGE_RECONCILE_BATCH_SIZE = int(os.getenv("USAGE_RECONCILE_BATCH_SIZE", 500))  # 重建用量时每个事务处理的用户数
+
+users_table = User.__table__
+
+# 按文件记录重新统计一批用户的用量，只更新不一致的用户；单条语句，执行期间持有写锁，与上传、删除不会交错
+RECONCILE_SQL = """
+UPDATE users SET
+    storage_bytes = (SELECT COALESCE(SUM(file_size), 0) FROM files WHERE files.user_id = users.id),
+    file_count = (SELECT COUNT(*) FROM files WHERE files.user_id = users.id)
+WHERE id BETWEEN :low AND :high AND (
+    storage_bytes IS NOT (SELECT COALESCE(SUM(file_size), 0) FROM files WHERE files.user_id = users.id)
+    OR file_count IS NOT (SELECT COUNT(*) FROM files WHERE files.user_id = users.id)
+)
+"""
+
+
+def effective_quota(quota: Optional[int], default: int) -> Optional[int]:
+    """用户自己的配额为空时使用默认配额，返回None表示不限制"""
+    value = default if quota is None else quota
+    return value if value > 0 else None
+
+
+def _within_quota(used, quota, amount, default):
+    limit = func.coalesce(quota, default)
+    return or_(limit <= 0, used + amount <= limit)
+
+
+async def get_usage(db, user_id: int) -> dict:
+    """
+    查询用户的用量和配额
+
+    Returns:
+        {"storage_bytes", "file_count", "storage_quota", "file_quota"}，配额为None表示不限制
+    """
+    row = (await db.execute(
+        select(users_table.c.storage_bytes, users_table.c.file_count,
+               users_table.c.storage_quota, users_table.c.file_quota)
+        .where(users_table.c.id == user_id)
+    )).one()
+    return {
+        "storage_bytes": row.storage_bytes or 0,
+        "file_count": row.file_count or 0,
+        "storage_quota": effective_quota(row.storage_quota, USER_STORAGE_QUOTA),
+        "file_quota": effective_quota(row.file_quota, USER_FILE_QUOTA),
+    }
+
+
+async def upload_allowance(db, user_id: int) -> Optional[int]:
+    """
+    上传之前检查配额，返回还可以上传的字节数（None表示不限制）
+
+    只用于在接收内容之前尽早拒绝，最终以保存文件记录时 charge_usage 的检查为准。
+
+    Raises:
+        HTTPException: 文件数或存储空间已经用完时返回413
+    """
+    usage = await get_usage(db, user_id)
+    if usage["file_quota"] is not None and usage["file_count"] >= usage["file_quota"]:
+        raise HTTPException(status_code=413, detail=quota_exceeded_detail(usage, files=1))
+    if usage["storage_quota"] is None:
+        return None
+    remaining = usage["storage_quota"] - usage["storage_bytes"]
+    if remaining <= 0:
+        raise HTTPException(status_code=413, detail=quota_exceeded_detail(usage))
+    return remaining
+
+
+async def charge_usage(db, user_id: int, size: int, files: int = 1):
+    """
+    增加用户的用量，超出配额时不修改并返回413
+
+    调用方需要与文件记录在同一个事务中提交；UPDATE 之后本事务持有写锁，
+    同一用户的并发上传依次检查，不会一起超出配额。
+
+    Raises:
+        HTTPException: 超出存储空间或文件数配额时返回413，说明超出的是哪一项配额和剩余的用量
+    """
+    result = await db.execute(
+        update(users_table)
+        .where(
+            users_table.c.id == user_id,
+            _within_quota(users_table.c.storage_bytes, users_table.c.storage_quota, size, USER_STORAGE_QUOTA),
+            _within_quota(users_table.c.file_count, users_table.c.file_quota, files, USER_FILE_QUOTA),
+        )
+        .values(storage_bytes=users_table.c.storage_bytes + size, file_count=users_table.c.file_count + files)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=413, detail=quota_exceeded_detail(await get_usage(db, user_id), size, files))
+
+
+def quota_exceeded_detail(usage: dict, size: Optional[int] = None, files: int = 0) -> str:
+    """
+    按当前用量说明超出了哪一项配额，以及还剩多少
+
+    Args:
+        usage: get_usage 的返回值
+        size: 本次要增加的字节数（为None时不在信息中列出）
+        files: 本次要增加的文件数
+    """
+    if usage["file_quota"] is not None and usage["file_count"] + files > usage["file_quota"]:
+        remaining = max(usage["file_quota"] - usage["file_count"], 0)
+        return f"File count quota exceeded ({usage['file_quota']} files). {remaining} files remaining"
+    remaining = max((usage["storage_quota"] or 0) - usage["storage_bytes"], 0)
+    requested = f"{size} bytes requested, " if size is not None else ""
+    return f"Storage quota exceeded ({usage['storage_quota']} bytes). {requested}{remaining} bytes remaining"
+
+
+async def release_usage(db, usage: Dict[int, Tuple[int, int]]):
+    """
+    减少用户的用量（删除文件时调用，与删除文件记录在同一个事务中提交）
+
+    Args:
+        db: 数据库会话
+        usage: {用户ID: (减少的字节数, 减少的文件数)}
+    """
+    params = [
+        {"b_id": user_id, "b_bytes": size, "b_files": files}
+        for user_id, (size, files) in usage.items() if user_id is not None
+    ]
+    if not params:
+        return
+    # 计数与文件记录不一致时不会减成负数，重建后恢复准确
+    await db.execute(
+        update(users_table)
+        .where(users_table.c.id == bindparam("b_id"))
+        .values(
+            storage_bytes=func.max(users_table.c.storage_bytes - bindparam("b_bytes"), 0),
+            file_count=func.max(users_table.c.file_count - bindparam("b_files"), 0),
+        ),
+        params
+    )
+
+
+def reconcile_usage(engine, batch_size: int = USAGE_RECONCILE_BATCH_SIZE) -> Tuple[int, int]:
+    """
+    按文件记录分批重建所有用户的用量计数，每批一个短事务，可以在服务运行时执行
+
+    Returns:
+        (检查的用户数, 修正的用户数)
+    """
+    checked = corrected = 0
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            ids = conn.execute(
+                text("SELECT id FROM users WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size}
+            ).scalars().all()
+        if not ids:
+            break
+        with engine.begin() as conn:
+            corrected += conn.execute(text(RECONCILE_SQL), {"low": ids[0], "high": ids[-1]}).rowcount
+        checked += len(ids)
+        last_id = ids[-1]
+    return checked, corrected
+
+
+if __name__ == "__main__":
+    from database import engine
+    from migrations import run_migrations
+    from models import Base
+
+    parser = argparse.ArgumentParser(description="按文件记录重建用户的存储用量")
+    parser.add_argument("--batch-size", type=int, default=USAGE_RECONCILE_BATCH_SIZE, help="每个事务处理的用户数")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
+    checked, corrected = reconcile_usage(engine, args.batch_size)
+    print(f"Checked {checked} user(s), corrected {corrected}")
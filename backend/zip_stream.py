@@ -0,0 +1,255 @@
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import disk_io
+from storage import UPLOAD_CHUNK_SIZE
+from storage_backend import storage
+
+# 打包下载配置（可通过环境变量覆盖）
+ARCHIVE_MAX_FILES = int(os.getenv("ARCHIVE_MAX_FILES", 1000))  # 一次最多打包的文件数
+# 压缩级别：1压缩最快（文本约为原大小的三分之一，速度仍接近磁盘读取速度），0表示所有文件都不压缩
+ARCHIVE_COMPRESS_LEVEL = int(os.getenv("ARCHIVE_COMPRESS_LEVEL", 1))
+# 已经压缩过的类型原样存储，再压缩只会浪费CPU
+ARCHIVE_STORED_EXTENSIONS = {
+    ext.strip().lower()
+    for ext in os.getenv("ARCHIVE_STORED_EXTENSIONS", ".zip,.rar,.jpg,.jpeg,.png,.docx,.xlsx").split(",")
+    if ext.strip()
+}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# 通用标志位：bit 3 表示CRC和大小写在内容之后的数据描述符中，bit 11 表示文件名为UTF-8
+FLAGS = 0x08 | 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+# 由Unix系统创建，外部属性为普通文件 0644
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64
+EXTERNAL_ATTR = (0o100644 & 0xFFFF) << 16
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+DATA_DESCRIPTOR_ZIP64 = struct.Struct("<IIQQ")
+END_RECORD = struct.Struct("<IHHHHIIH")
+END_RECORD_ZIP64 = struct.Struct("<IQHHIIQQQQ")
+END_LOCATOR_ZIP64 = struct.Struct("<IIQI")
+
+
+def _dos_datetime(value: datetime):
+    """ZIP使用DOS格式的时间（1980年起，精度2秒）"""
+    if value.year < 1980:
+        value = datetime(1980, 1, 1)
+    dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    return dos_time, dos_date
+
+
+def _max_deflate_size(size: int) -> int:
+    # 与 zlib 的 compressBound 相同：不可压缩的内容经过deflate后的最大长度
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+
+
+def unique_name(name: str, used: set) -> str:
+    """清理压缩包内的文件名，重名时在扩展名前加序号"""
+    name = name.replace("\\", "_").replace("/", "_").lstrip(".") or "file"
+    candidate = name
+    stem, ext = os.path.splitext(name)
+    index = 1
+    while candidate.lower() in used:
+        candidate = f"{stem} ({index}){ext}"
+        index += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+class ZipEntry:
+    """压缩包中的一个文件"""
+
+    def __init__(self, name: str, key: str, size: int, modified: Optional[datetime] = None):
+        self.name = name
+        self.encoded_name = name.encode("utf-8")
+        self.key = key
+        self.size = size
+        self.dos_time, self.dos_date = _dos_datetime(modified or datetime.now())
+        stored = ARCHIVE_COMPRESS_LEVEL <= 0 or os.path.splitext(name)[1].lower() in ARCHIVE_STORED_EXTENSIONS
+        self.method = ZIP_STORED if stored else ZIP_DEFLATED
+        # 压缩后的大小要到写完才知道，按最坏情况决定是否需要ZIP64
+        max_size = size if stored else _max_deflate_size(size)
+        self.zip64 = max_size >= ZIP64_LIMIT
+        # 写入时填充
+        self.offset = 0
+        self.crc = 0
+        self.compressed_size = size if stored else None
+
+    @property
+    def version(self) -> int:
+        return VERSION_ZIP64 if self.zip64 else VERSION_DEFAULT
+
+    def local_header(self) -> bytes:
+        if self.zip64:
+            # 大小记录在数据描述符中，本地头中的ZIP64扩展字段先填0
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            sizes = ZIP64_LIMIT
+        else:
+            extra = b""
+            sizes = 0
+        return LOCAL_HEADER.pack(
+            0x04034b50, self.version, FLAGS, self.method, self.dos_time, self.dos_date,
+            0, sizes, sizes, len(self.encoded_name), len(extra)
+        ) + self.encoded_name + extra
+
+    def data_descriptor(self) -> bytes:
+        if self.zip64:
+            return DATA_DESCRIPTOR_ZIP64.pack(0x08074b50, self.crc, self.compressed_size, self.size)
+        return DATA_DESCRIPTOR.pack(0x08074b50, self.crc, self.compressed_size, self.size)
+
+    def central_header(self) -> bytes:
+        # ZIP64扩展字段只包含超出32位的字段，依次为原始大小、压缩后大小、本地头偏移
+        fields = []
+        size = compressed_size = offset = None
+        if self.zip64:
+            fields += [self.size, self.compressed_size]
+            size = compressed_size = ZIP64_LIMIT
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+            offset = ZIP64_LIMIT
+        extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields) if fields else b""
+        version = VERSION_ZIP64 if fields else VERSION_DEFAULT
+        return CENTRAL_HEADER.pack(
+            0x02014b50, VERSION_MADE_BY, version, FLAGS, self.method, self.dos_time, self.dos_date,
+            self.crc, compressed_size if compressed_size is not None else self.compressed_size,
+            size if size is not None else self.size,
+            len(self.encoded_name), len(extra), 0, 0, 0, EXTERNAL_ATTR,
+            offset if offset is not None else self.offset
+        ) + self.encoded_name + extra
+
+
+def _end_records(entries: List[ZipEntry], directory_offset: int, directory_size: int) -> bytes:
+    count = len(entries)
+    records = b""
+    if count >= ZIP_FILECOUNT_LIMIT or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+        zip64_end_offset = directory_offset + directory_size
+        records += END_RECORD_ZIP64.pack(
+            0x06064b50, END_RECORD_ZIP64.size - 12, VERSION_MADE_BY, VERSION_ZIP64, 0, 0,
+            count, count, directory_size, directory_offset
+        )
+        records += END_LOCATOR_ZIP64.pack(0x07064b50, 0, zip64_end_offset, 1)
+        count = min(count, ZIP_FILECOUNT_LIMIT)
+        directory_offset = min(directory_offset, ZIP64_LIMIT)
+        directory_size = min(directory_size, ZIP64_LIMIT)
+    return records + END_RECORD.pack(0x06054b50, 0, 0, count, count, directory_size, directory_offset, 0)
+
+
+def _read_chunk(f, crc: int, compressor, size: int):
+    """读取一块内容并计算CRC、压缩（在线程池中执行，zlib 计算时释放GIL）"""
+    with disk_io("read", size):
+        data = f.read(size)
+    if not data:
+        return 0, crc, compressor.flush() if compressor else b""
+    crc = zlib.crc32(data, crc)
+    return len(data), crc, compressor.compress(data) if compressor else data
+
+
+def _read_whole(key, compressor, size: int):
+    """一次读取小于一块大小的小文件，打开、读取、压缩和关闭只需一次线程池调度"""
+    with storage.open(key) as f:
+        with disk_io("read", size):
+            # 多读一个字节，用于发现文件大小的变化
+            data = f.read(size + 1)
+    crc = zlib.crc32(data)
+    output = compressor.compress(data) + compressor.flush() if compressor else data
+    return len(data), crc, output
+
+
+class ZipStream:
+    """
+    边读边生成的ZIP压缩包
+
+    每个文件按块读取、计算CRC并按需压缩后立即输出，CRC和大小写在文件内容之后的数据描述符中，
+    因此不需要临时文件，也不需要把整个文件读入内存，内存占用与压缩包大小无关。
+    单个文件或偏移超过4GB、文件数超过65535时使用ZIP64。
+    所有文件都不压缩时压缩包的大小可以提前算出，用作 Content-Length。
+    """
+
+    def __init__(self, entries: List[ZipEntry], chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.entries = entries
+        self.chunk_size = chunk_size
+
+    def content_length(self) -> Optional[int]:
+        """所有文件都不压缩时返回压缩包的字节数，否则返回None"""
+        if any(entry.method != ZIP_STORED for entry in self.entries):
+            return None
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset += len(entry.local_header()) + entry.size + len(entry.data_descriptor())
+        directory_size = sum(len(entry.central_header()) for entry in self.entries)
+        return offset + directory_size + len(_end_records(self.entries, offset, directory_size))
+
+    async def _iter_entry(self, entry: ZipEntry) -> AsyncIterator[bytes]:
+        compressor = None
+        if entry.method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(ARCHIVE_COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        if entry.size < self.chunk_size:
+            read, crc, data = await run_in_threadpool(_read_whole, entry.key, compressor, entry.size)
+            compressed = len(data)
+            if data:
+                yield data
+        else:
+            read, crc, compressed = 0, 0, 0
+            f = await run_in_threadpool(storage.open, entry.key)
+            try:
+                while True:
+                    size, crc, data = await run_in_threadpool(_read_chunk, f, crc, compressor, self.chunk_size)
+                    read += size
+                    if data:
+                        compressed += len(data)
+                        yield data
+                    if not size:
+                        break
+            finally:
+                await run_in_threadpool(f.close)
+        if read != entry.size:
+            # 响应头已经发出，只能中断下载，让客户端得到一个不完整的压缩包
+            raise RuntimeError(f"{entry.key} changed size while archiving ({entry.size} -> {read})")
+        entry.crc = crc
+        entry.compressed_size = compressed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        # 文件头、数据描述符和小文件的内容合并到约一块大小后再发送，减少小文件较多时的发送次数
+        pending = []
+        pending_size = 0
+        async for piece in self._iter_pieces():
+            pending.append(piece)
+            pending_size += len(piece)
+            if pending_size >= self.chunk_size:
+                yield pending[0] if len(pending) == 1 else b"".join(pending)
+                pending = []
+                pending_size = 0
+        if pending:
+            yield b"".join(pending)
+
+    async def _iter_pieces(self) -> AsyncIterator[bytes]:
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = entry.local_header()
+            yield header
+            offset += len(header)
+            async for data in self._iter_entry(entry):
+                offset += len(data)
+                yield data
+            descriptor = entry.data_descriptor()
+            yield descriptor
+            offset += len(descriptor)
+
+        directory = b"".join(entry.central_header() for entry in self.entries)
+        yield directory
+        yield _end_records(self.entries, offset, len(directory))
@@ -1,16 +1,26 @@
 import React from 'react';
 import { Modal, message } from 'antd';
 import axios from 'axios';
+import TextPagePreview from './TextPagePreview';
 
 // 预览文件的通用组件
 const FilePreview = {
   // 预览文件内容
   async previewFile(fileId, fileInfo, downloadCode = null) {
+    // 文本文件分页预览，不再整体转换为PDF
+    if (fileInfo?.file_type === 'text/plain') {
+      this.previewTextPages(fileId, downloadCode);
+      return true;
+    }
+
     try {
       // 构建API URL
-      let apiUrl = `/api/files/${fileId}/preview`;
+      // 图片预览使用缩小后的大尺寸缩略图，不必下载原图
+      let apiUrl = fileInfo?.has_thumbnail
+        ? `/api/files/${fileId}/thumbnail?size=lg`
+        : `/api/files/${fileId}/preview`;
       if (downloadCode) {
-        apiUrl += `?download_code=${downloadCode}`;
+        apiUrl += `${apiUrl.includes('?') ? '&' : '?'}download_code=${downloadCode}`;
       }
 
       // 获取token（如果用户已登录）
@@ -130,6 +140,15 @@ const FilePreview = {
     }
   },
 
+  // 分页预览文本文件，滚动时按需加载后续页面
+  previewTextPages(fileId, downloadCode = null) {
+    Modal.info({
+      title: '文本预览',
+      width: '80%',
+      content: <TextPagePreview fileId={fileId} downloadCode={downloadCode} />,
+    });
+  },
+
   // 预览图片
   previewImage(fileUrl) {
     Modal.info({
@@ -0,0 +1,87 @@
+import React, { useState, useEffect, useRef, useCallback } from 'react';
+import { Spin, Typography, message } from 'antd';
+import { fileAPI } from '../services/api';
+
+const { Text } = Typography;
+
+// 距离底部小于该像素时加载下一页
+const LOAD_MORE_THRESHOLD = 200;
+
+// 文本文件分页预览：先显示第一页，滚动到底部时再请求后续页面
+function TextPagePreview({ fileId, downloadCode = null }) {
+  const [pages, setPages] = useState([]);
+  const [hasMore, setHasMore] = useState(true);
+  const [totalPages, setTotalPages] = useState(null);
+  const [loading, setLoading] = useState(false);
+  const [error, setError] = useState(null);
+  const loadingRef = useRef(false);
+
+  const loadPage = useCallback(async (page) => {
+    if (loadingRef.current) return;
+    loadingRef.current = true;
+    setLoading(true);
+    try {
+      const data = await fileAPI.previewTextPage(fileId, page, downloadCode);
+      setPages((prev) => [...prev, data.text]);
+      setHasMore(data.has_more);
+      if (data.total_pages) {
+        setTotalPages(data.total_pages);
+      }
+    } catch (err) {
+      console.error('加载文本页面失败:', err);
+      const detail = err.response?.data?.detail || err.message || '未知错误';
+      setError(detail);
+      message.error('文本预览失败: ' + detail);
+    } finally {
+      loadingRef.current = false;
+      setLoading(false);
+    }
+  }, [fileId, downloadCode]);
+
+  useEffect(() => {
+    setPages([]);
+    setHasMore(true);
+    setTotalPages(null);
+    setError(null);
+    loadPage(1);
+  }, [loadPage]);
+
+  const handleScroll = (e) => {
+    const { scrollTop, scrollHeight, clientHeight } = e.currentTarget;
+    if (hasMore && !error && scrollHeight - scrollTop - clientHeight < LOAD_MORE_THRESHOLD) {
+      loadPage(pages.length + 1);
+    }
+  };
+
+  return (
+    <div>
+      <pre
+        onScroll={handleScroll}
+        style={{
+          height: '60vh',
+          overflow: 'auto',
+          whiteSpace: 'pre-wrap',
+          wordWrap: 'break-word',
+          backgroundColor: '#f5f5f5',
+          padding: '15px',
+          borderRadius: '4px',
+          fontSize: '14px',
+          lineHeight: '1.6',
+          fontFamily: 'Consolas, Monaco, "Andale Mono", "Ubuntu Mono", monospace'
+        }}
+      >
+        {pages.join('')}
+        {loading && (
+          <div style={{ textAlign: 'center', padding: '8px 0' }}>
+            <Spin size="small" />
+          </div>
+        )}
+      </pre>
+      <Text type="secondary">
+        已加载 {pages.length}{totalPages ? ` / ${totalPages}` : ''} 页{!hasMore && '（已到末尾）'}
+      </Text>
+    </div>
+  );
+}
+
+export default TextPagePreview;
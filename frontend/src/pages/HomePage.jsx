@@ -1,5 +1,5 @@
-import React, { useState } from 'react';
-import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
+import React, { useEffect, useRef, useState } from 'react';
+import { useInfiniteQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import {
   Table, Button, Upload, message,
   Card, Switch, Input,
@@ -18,6 +18,18 @@ import axios from 'axios';
 import { useAuth } from '../contexts/AuthContext';
 import FilePreview from '../components/FilePreview';
 import { formatFileSize, copyToClipboard, downloadFile } from '../utils/fileUtils';
+import { fileAPI } from '../services/api';
+
+// 超过该大小的文件使用分块上传（支持并行与断点续传）
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+// 文件列表每页条数
+const FILE_PAGE_SIZE = 50;
+// 事件流断开时增量同步文件列表的间隔（毫秒），列表没有变化时服务端直接返回空增量或304
+const FILE_SYNC_INTERVAL = 15000;
+// 事件流断开后重连的等待时间（毫秒）
+const EVENT_RECONNECT_DELAY = 3000;
+// 收到事件后合并同步的等待时间（毫秒），连续的多个事件只同步一次
+const EVENT_SYNC_DELAY = 300;
 
 // Typography是antd库中的一个文字排版组件，提供了一系列用于文本展示的子组件，如Text、Title、Paragraph等，用于更好地控制文本的样式和排版。
 const { Text, Paragraph } = Typography; 
@@ -38,18 +50,130 @@ function HomePage() {
   const [shareModalVisible, setShareModalVisible] = useState(false);
   const [currentShareLink, setCurrentShareLink] = useState('');
   const [currentShareFile, setCurrentShareFile] = useState(null);
-
-  // 获取文件列表
-  const { data: files, isLoading } = useQuery({
-    queryKey: ['files'],
-    queryFn: async () => {
+  // 已加载页面中最早的列表版本号，增量同步从该版本开始
+  const listVersion = useRef(null);
+
+  // 获取文件列表（服务端分页和文件名搜索）
+  const {
+    data: filePages, isLoading, fetchNextPage, hasNextPage, isFetchingNextPage,
+  } = useInfiniteQuery({
+    queryKey: ['files', searchText],
+    queryFn: async ({ pageParam }) => {
       const token = localStorage.getItem('token');
       const response = await axios.get('/api/files', {
         headers: { Authorization: `Bearer ${token}` },
+        params: {
+          limit: FILE_PAGE_SIZE,
+          cursor: pageParam,
+          q: searchText || undefined,
+        },
       });
+      const { version } = response.data;
+      listVersion.current = !pageParam || listVersion.current === null
+        ? version
+        : Math.min(listVersion.current, version);
       return response.data;
     },
+    getNextPageParam: (lastPage) => lastPage.next_cursor || undefined,
   });
+  const files = filePages?.pages.flatMap((page) => page.items);
+
+  // 增量同步文件列表：只获取当前版本之后的变化并合并到已加载的页面，无法增量同步时重新获取
+  const syncFiles = async () => {
+    const since = listVersion.current;
+    if (since === null) {
+      queryClient.invalidateQueries(['files']);
+      return;
+    }
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get('/api/files', {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { since, q: searchText || undefined },
+      });
+      const delta = response.data;
+      // 同步期间列表已经重新加载，放弃本次增量
+      if (listVersion.current !== since) return;
+      const updated = new Map(delta.changed.map((file) => [file.id, file]));
+      const removed = new Set([...delta.deleted, ...delta.added.map((file) => file.id)]);
+      queryClient.setQueryData(['files', searchText], (old) => old && {
+        ...old,
+        pages: old.pages.map((page, index) => ({
+          ...page,
+          items: [
+            // 新上传的文件排在第一页最前面
+            ...(index === 0 ? delta.added : []),
+            ...page.items
+              .filter((file) => !removed.has(file.id))
+              .map((file) => updated.get(file.id) || file),
+          ],
+        })),
+      });
+      listVersion.current = delta.version;
+    } catch (error) {
+      // 410：变更记录已被清理或变化过多，重新获取完整列表
+      listVersion.current = null;
+      queryClient.invalidateQueries(['files']);
+    }
+  };
+
+  // 订阅文件变更事件，其他用户上传、删除或下载次数变化时增量同步；事件流断开期间定期同步（页面不可见时跳过）
+  useEffect(() => {
+    const controller = new AbortController();
+    let connected = false;
+    let lastEventId = null;
+    let syncTimer = null;
+    let reconnectTimer = null;
+
+    const scheduleSync = () => {
+      if (syncTimer === null) {
+        syncTimer = setTimeout(() => {
+          syncTimer = null;
+          syncFiles();
+        }, EVENT_SYNC_DELAY);
+      }
+    };
+
+    const connect = async () => {
+      try {
+        await fileAPI.streamEvents({
+          lastEventId,
+          signal: controller.signal,
+          onOpen: () => {
+            connected = true;
+            // 断线期间可能错过了变化
+            if (lastEventId !== null) scheduleSync();
+          },
+          onEvent: ({ id, event }) => {
+            lastEventId = id;
+            if (event === 'reset') {
+              listVersion.current = null;
+            }
+            scheduleSync();
+          },
+        });
+      } catch (error) {
+        if (controller.signal.aborted) return;
+      }
+      connected = false;
+      if (!controller.signal.aborted) {
+        reconnectTimer = setTimeout(connect, EVENT_RECONNECT_DELAY);
+      }
+    };
+    connect();
+
+    const pollTimer = setInterval(() => {
+      if (!connected && !document.hidden) {
+        syncFiles();
+      }
+    }, FILE_SYNC_INTERVAL);
+    return () => {
+      controller.abort();
+      clearTimeout(syncTimer);
+      clearTimeout(reconnectTimer);
+      clearInterval(pollTimer);
+    };
+  }, [searchText]);
 
   // 删除文件
   const deleteMutation = useMutation({
@@ -61,7 +185,7 @@ function HomePage() {
     },
     onSuccess: () => {
       message.success('文件删除成功');
-      queryClient.invalidateQueries(['files']);
+      syncFiles();
     },
     onError: (error) => {
       message.error(error.response?.data?.detail || '文件删除失败');
@@ -94,7 +218,7 @@ function HomePage() {
     },
     onSuccess: () => {
       message.success('文件上传成功');
-      queryClient.invalidateQueries(['files']);
+      syncFiles();
     },
     onError: (error) => {
       message.error(error.response?.data?.detail || '文件上传失败');
@@ -103,6 +227,23 @@ function HomePage() {
 
   // 处理上传
   const handleUpload = (info) => {
+    // 大文件使用分块上传
+    if (info.file.size > CHUNKED_UPLOAD_THRESHOLD) {
+      fileAPI.uploadFileChunked(info.file, {
+        isPrivate,
+        downloadCode,
+        onProgress: (percent) => info.onProgress({ percent }),
+      }).then(() => {
+        message.success('文件上传成功');
+        syncFiles();
+        info.onSuccess();
+      }).catch((error) => {
+        message.error(error.response?.data?.detail || '文件上传失败，重新上传可从断点继续');
+        info.onError(error);
+      });
+      return;
+    }
+
     // const { file } = info;
     const formData = new FormData();
     formData.append('file', info.file);
@@ -158,8 +299,18 @@ function HomePage() {
         return;
       }
 
+      // 文本文件分页预览，滚动时按需加载后续页面
+      if (files?.find(f => f.id === fileId)?.file_type === 'text/plain') {
+        FilePreview.previewTextPages(fileId, code);
+        return;
+      }
+
+      // 图片预览使用缩小后的大尺寸缩略图，不必下载原图
+      if (files?.find(f => f.id === fileId)?.has_thumbnail) {
+        url = `/api/files/${fileId}/thumbnail?size=lg`;
+      }
       if (code) {
-        url += `?download_code=${code}`;
+        url += `${url.includes('?') ? '&' : '?'}download_code=${code}`;
       }
       // 如果用户已登录，添加认证头
       const token = localStorage.getItem('token');
@@ -271,6 +422,25 @@ function HomePage() {
       title: '文件名',
       dataIndex: 'filename',
       key: 'filename',
+      render: (text, record) => {
+        // 图片显示小缩略图；私密文件的<img>无法携带认证头，只在有下载码时显示
+        const canShowThumbnail = record.has_thumbnail && (!record.is_private || record.download_code);
+        if (!canShowThumbnail) {
+          return text;
+        }
+        const query = record.is_private ? `&download_code=${record.download_code}` : '';
+        return (
+          <Space>
+            <img
+              src={`/api/files/${record.id}/thumbnail?size=sm${query}`}
+              alt=""
+              loading="lazy"
+              style={{ width: 32, height: 32, objectFit: 'cover', borderRadius: 4 }}
+            />
+            {text}
+          </Space>
+        );
+      },
     },
     {
       title: '上传时间',
@@ -531,7 +701,7 @@ function HomePage() {
         extra={
           <Input
             prefix={<SearchOutlined />}
-            placeholder="搜索文件名、上传者或文件类型"
+            placeholder="搜索文件名"
             style={{ width: 300 }}
             value={searchText}
             onChange={(e) => setSearchText(e.target.value)}
@@ -541,19 +711,18 @@ function HomePage() {
       >
         <Table
           columns={columns}
-          dataSource={files?.filter(file => {
-            if (!searchText) return true;
-            const lowerSearchText = searchText.toLowerCase();
-            return (
-              file.filename.toLowerCase().includes(lowerSearchText) ||
-              file.uploader.toLowerCase().includes(lowerSearchText) ||
-              file.file_type?.toLowerCase().includes(lowerSearchText) ||
-              (file.is_private ? '私密文件' : '公开文件').includes(lowerSearchText)
-            );
-          })}
+          dataSource={files}
           rowKey="id"
           loading={isLoading}
+          pagination={false}
         />
+        {hasNextPage && (
+          <div style={{ textAlign: 'center', marginTop: 16 }}>
+            <Button onClick={() => fetchNextPage()} loading={isFetchingNextPage}>
+              加载更多
+            </Button>
+          </div>
+        )}
       </Card>
 
       <Modal
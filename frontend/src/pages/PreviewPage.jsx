@@ -102,14 +102,23 @@ function PreviewPage() {
       }
 
       // 构建API URL
-      let apiUrl = `/api/files/${fileId}/preview`;
+      // 图片预览使用缩小后的大尺寸缩略图，不必下载原图
+      let apiUrl = fileInfo.has_thumbnail
+        ? `/api/files/${fileId}/thumbnail?size=lg`
+        : `/api/files/${fileId}/preview`;
       const code = inputCode || savedDownloadCode;
       if (code) {
-        apiUrl += `?download_code=${code}`;
+        apiUrl += `${apiUrl.includes('?') ? '&' : '?'}download_code=${code}`;
         // 保存有效的下载码以便后续使用
         setSavedDownloadCode(code);
       }
 
+      // 文本文件分页预览：先显示第一页，滚动时再请求后续页面，大文件也能立即打开
+      if (fileInfo.file_type === 'text/plain') {
+        FilePreview.previewTextPages(fileId, code);
+        return;
+      }
+
       // 获取token（如果用户已登录）
       const token = localStorage.getItem('token');
       const headers = {};
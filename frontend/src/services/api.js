@@ -56,9 +56,9 @@ export const authAPI = {
 
 // 文件相关API
 export const fileAPI = {
-  // 获取文件列表
-  getFiles: async () => {
-    const response = await api.get('/files');
+  // 获取文件列表（分页），params 支持 limit、cursor、sort、order、q 等筛选参数
+  getFiles: async (params = {}) => {
+    const response = await api.get('/files', { params });
     return response.data;
   },
 
@@ -83,6 +83,61 @@ export const fileAPI = {
     return response.data;
   },
 
+  // 分块上传文件：多个分块并行上传，断线后可以从已上传的分块继续
+  uploadFileChunked: async (file, { isPrivate = false, downloadCode = null, concurrency = 3, onProgress } = {}) => {
+    // 以文件名、大小和修改时间作为续传标识
+    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    let session = null;
+
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+      try {
+        session = (await api.get(`/uploads/${savedId}`)).data;
+      } catch (error) {
+        // 会话已过期或不存在，重新创建
+        localStorage.removeItem(resumeKey);
+      }
+    }
+    if (!session) {
+      session = (await api.post('/uploads', {
+        filename: file.name,
+        size: file.size,
+        is_private: isPrivate,
+        download_code: isPrivate && downloadCode ? downloadCode : null,
+      })).data;
+      localStorage.setItem(resumeKey, session.upload_id);
+    }
+
+    const received = new Set(session.received_chunks);
+    const pending = [];
+    for (let i = 0; i < session.total_chunks; i += 1) {
+      if (!received.has(i)) pending.push(i);
+    }
+
+    let done = received.size;
+    const report = () => onProgress && onProgress(Math.round((done / session.total_chunks) * 100));
+    report();
+
+    const worker = async () => {
+      while (pending.length > 0) {
+        const index = pending.shift();
+        const start = index * session.chunk_size;
+        const chunk = file.slice(start, Math.min(start + session.chunk_size, file.size));
+        await api.put(`/uploads/${session.upload_id}/chunks/${index}`, chunk, {
+          headers: { 'Content-Type': 'application/octet-stream' },
+          timeout: 0,
+        });
+        done += 1;
+        report();
+      }
+    };
+    await Promise.all(Array.from({ length: concurrency }, worker));
+
+    const response = await api.post(`/uploads/${session.upload_id}/complete`);
+    localStorage.removeItem(resumeKey);
+    return response.data;
+  },
+
   // 删除文件
   deleteFile: async (fileId) => {
     const response = await api.delete(`/files/${fileId}`);
@@ -129,6 +184,54 @@ export const fileAPI = {
     return response;
   },
 
+  // 分页预览文本文件，返回 { page, total_pages, has_more, text, ... }
+  previewTextPage: async (fileId, page = 1, downloadCode = null) => {
+    const params = { page };
+    if (downloadCode) {
+      params.download_code = downloadCode;
+    }
+    const response = await api.get(`/files/${fileId}/preview/text`, { params });
+    return response.data;
+  },
+
+  // 订阅文件变更事件流（Server-Sent Events）。EventSource 不能设置 Authorization 请求头，这里用 fetch 读取并解析，
+  // 每收到一个事件调用 onEvent({ id, event, data })；连接断开时返回，调用方按 Last-Event-ID 重连
+  streamEvents: async ({ lastEventId = null, onOpen, onEvent, signal } = {}) => {
+    const headers = { Authorization: `Bearer ${localStorage.getItem('token')}` };
+    if (lastEventId !== null) {
+      headers['Last-Event-ID'] = String(lastEventId);
+    }
+    const response = await fetch('/api/events', { headers, signal, cache: 'no-store' });
+    if (!response.ok) {
+      throw new Error(`Event stream failed: ${response.status}`);
+    }
+    if (onOpen) onOpen();
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) return;
+      buffer += value;
+      let end = buffer.indexOf('\n\n');
+      while (end !== -1) {
+        const message = { id: null, event: 'message', data: '' };
+        buffer.slice(0, end).split('\n').forEach((line) => {
+          const sep = line.indexOf(': ');
+          const [field, content] = sep === -1 ? [line, ''] : [line.slice(0, sep), line.slice(sep + 2)];
+          if (field === 'id') message.id = Number(content);
+          else if (field === 'event') message.event = content;
+          else if (field === 'data') message.data += content;
+        });
+        buffer = buffer.slice(end + 2);
+        // 心跳（注释行）和 retry 没有事件ID，忽略
+        if (message.id !== null) {
+          onEvent({ ...message, data: message.data ? JSON.parse(message.data) : null });
+        }
+        end = buffer.indexOf('\n\n');
+      }
+    }
+  },
+
   // 生成分享链接
   generateShareLink: async (fileId) => {
     const response = await api.post(`/files/${fileId}/share`);